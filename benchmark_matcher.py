@@ -0,0 +1,326 @@
+# Template-matching benchmark over a recorded screenshot corpus.
+# Replays a directory of captured frames (e.g. mini_screenshot.py output)
+# against the bundled templates and reports per-template latency
+# percentiles, hit/miss accuracy at several confidence levels and memory use.
+# The matcher is built by tablet_mode.build_matcher, so it has the same
+# template variants, miss sweep and memory-mapped bundle as a real run.
+# Runs headless; needs only numpy and opencv.
+#
+# Usage:
+#   python benchmark_matcher.py SCREENSHOT_DIR [--labels labels.json]
+#       [--display-scale 2.0] [--no-bundle] [--output results.json] [--compare baseline.json]
+#
+# labels.json maps frame file names to the templates visible in them:
+#   {"screenshot_20250101_120000.png": ["windows-logo.png"], ...}
+# Without labels, the ground truth is an exhaustive full-resolution
+# cv2.matchTemplate at --reference-confidence (what pyautogui used to do),
+# of every template variant the matcher searches.
+#
+# Accuracy is measured on each template's best score over all its variants
+# (PyramidMatcher.best_match), computed once per frame without hints or
+# other matcher state and compared with every confidence level, so the
+# levels do not influence each other.
+import argparse
+import glob
+import json
+import os
+import platform
+import sys
+import time
+import tracemalloc
+
+import cv2
+
+from location_hints import LocationHintCache
+from tablet_mode import TEMPLATE_DISPLAY_SCALE, TEMPLATE_IMAGES, build_matcher
+from template_matcher import FileFrameSource, FramePyramid
+
+CONFIDENCE_LEVELS = [0.7, 0.75, 0.8, 0.85, 0.9]
+RESULTS_VERSION = 1
+
+
+def percentile(values, fraction):
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, int(round(fraction * (len(ordered) - 1))))
+    return ordered[index]
+
+
+def latency_summary(values_ms):
+    return {
+        "count": len(values_ms),
+        "p50_ms": round(percentile(values_ms, 0.5), 3),
+        "p90_ms": round(percentile(values_ms, 0.9), 3),
+        "p99_ms": round(percentile(values_ms, 0.99), 3),
+        "max_ms": round(max(values_ms, default=0.0), 3),
+    }
+
+
+def reference_visible(frame, variants, confidence):
+    """
+    Exhaustive full-resolution match of every template variant, the baseline
+    the pyramid matcher must agree with.
+    """
+    for variant in variants:
+        if variant.shape[0] > frame.shape[0] or variant.shape[1] > frame.shape[1]:
+            continue
+        scores = cv2.matchTemplate(frame, variant, cv2.TM_CCOEFF_NORMED)
+        if cv2.minMaxLoc(scores)[1] >= confidence:
+            return True
+    return False
+
+
+def load_frames(directory):
+    paths = sorted(
+        path
+        for pattern in ("*.png", "*.jpg", "*.bmp")
+        for path in glob.glob(os.path.join(directory, pattern))
+    )
+    if not paths:
+        raise SystemExit(f"No screenshots found in {directory}")
+    return paths
+
+
+def run_benchmark(
+    frame_paths,
+    template_paths,
+    labels,
+    reference_confidence,
+    repeat,
+    use_hints,
+    display_scale=TEMPLATE_DISPLAY_SCALE,
+    use_bundle=True,
+):
+    hints = LocationHintCache(path=None) if use_hints else None
+    matcher = build_matcher(
+        FileFrameSource(frame_paths),
+        hints=hints,
+        display_scale=lambda: display_scale,
+        use_bundle=use_bundle,
+    )
+    # Scores for the accuracy tables come from a second matcher, untouched by
+    # the timed lookups (their hints and remembered variants).
+    scorer = build_matcher(
+        FileFrameSource(frame_paths),
+        hints=None,
+        display_scale=lambda: display_scale,
+        use_bundle=use_bundle,
+    )
+    variants = {}
+    for path in template_paths:
+        try:
+            variants[path] = [variant.levels[0] for variant in scorer.load_variants(path)]
+        except FileNotFoundError as e:
+            raise SystemExit(str(e))
+
+    latencies = {path: [] for path in template_paths}
+    batch_latencies = []
+    pyramid_latencies = []
+    # confusion[confidence][template] = {"tp": .., "fp": .., "tn": .., "fn": ..}
+    confusion = {
+        str(level): {path: {"tp": 0, "fp": 0, "tn": 0, "fn": 0} for path in template_paths}
+        for level in CONFIDENCE_LEVELS
+    }
+
+    # tracemalloc hooks every allocation and would slow the timed loops, so
+    # memory is measured in a separate pass afterwards.
+    readable_paths = []
+    for frame_path in frame_paths:
+        frame = cv2.imread(frame_path, cv2.IMREAD_GRAYSCALE)
+        if frame is None:
+            print(f"WARNING: Skipping unreadable frame {frame_path}", file=sys.stderr)
+            continue
+        readable_paths.append(frame_path)
+        name = os.path.basename(frame_path)
+        if labels is not None:
+            truth = {path: os.path.basename(path) in labels.get(name, []) for path in template_paths}
+        else:
+            truth = {
+                path: reference_visible(frame, variants[path], reference_confidence)
+                for path in template_paths
+            }
+
+        for _ in range(repeat):
+            start_time = time.perf_counter()
+            pyramid = FramePyramid(frame)
+            pyramid.level(matcher.max_level)
+            pyramid_latencies.append((time.perf_counter() - start_time) * 1000)
+
+            for path in template_paths:
+                start_time = time.perf_counter()
+                matcher.locate(path, frame=pyramid)
+                latencies[path].append((time.perf_counter() - start_time) * 1000)
+
+            start_time = time.perf_counter()
+            matcher.locate_many(template_paths, frame=FramePyramid(frame))
+            batch_latencies.append((time.perf_counter() - start_time) * 1000)
+
+        pyramid = FramePyramid(frame)
+        for path in template_paths:
+            best = scorer.best_match(path, pyramid, confidence=min(CONFIDENCE_LEVELS))
+            for level in CONFIDENCE_LEVELS:
+                found = best is not None and best.score >= level
+                key = ("tp" if truth[path] else "fp") if found else ("fn" if truth[path] else "tn")
+                confusion[str(level)][path][key] += 1
+
+    peak_bytes = peak_matching_memory(matcher, readable_paths, template_paths)
+    matcher.close()
+    scorer.close()
+
+    accuracy = {}
+    for level, per_template in confusion.items():
+        accuracy[level] = {}
+        for path, counts in per_template.items():
+            total = sum(counts.values())
+            accuracy[level][path] = dict(
+                counts, accuracy=round((counts["tp"] + counts["tn"]) / total, 4) if total else 0.0
+            )
+
+    return {
+        "version": RESULTS_VERSION,
+        "environment": {
+            "python": platform.python_version(),
+            "opencv": cv2.__version__,
+            "machine": platform.machine(),
+        },
+        "corpus": {
+            "frames": len(readable_paths),
+            "repeat": repeat,
+            "hints": use_hints,
+            "display_scale": display_scale,
+            "bundle": matcher.bundle is not None,
+        },
+        "latency": {path: latency_summary(values) for path, values in latencies.items()},
+        "batch_latency": latency_summary(batch_latencies),
+        "pyramid_latency": latency_summary(pyramid_latencies),
+        "accuracy": accuracy,
+        "memory": {"tracemalloc_peak_mb": round(peak_bytes / 1e6, 2), "max_rss_mb": max_rss_mb()},
+    }
+
+
+def peak_matching_memory(matcher, frame_paths, template_paths):
+    """Peak bytes traced by tracemalloc while matching every template once per frame."""
+    tracemalloc.start()
+    for frame_path in frame_paths:
+        pyramid = FramePyramid(cv2.imread(frame_path, cv2.IMREAD_GRAYSCALE))
+        for path in template_paths:
+            matcher.locate(path, frame=pyramid)
+        matcher.locate_many(template_paths, frame=pyramid)
+    _, peak_bytes = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return peak_bytes
+
+
+def max_rss_mb():
+    try:
+        import resource
+    except ImportError:  # Windows
+        return None
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is in kilobytes on Linux, bytes on macOS
+    return round(rss / 1e6 if sys.platform == "darwin" else rss / 1e3, 1)
+
+
+def print_report(results):
+    print(f"Frames: {results['corpus']['frames']} x{results['corpus']['repeat']}")
+    print(f"{'template':<24} {'p50':>8} {'p90':>8} {'p99':>8} {'max':>8}  (ms)")
+    rows = list(results["latency"].items()) + [
+        ("<locate_many>", results["batch_latency"]),
+        ("<pyramid build>", results["pyramid_latency"]),
+    ]
+    for name, summary in rows:
+        print(
+            f"{name:<24} {summary['p50_ms']:>8.2f} {summary['p90_ms']:>8.2f} "
+            f"{summary['p99_ms']:>8.2f} {summary['max_ms']:>8.2f}"
+        )
+    print()
+    print(f"{'confidence':<12}" + "".join(f"{os.path.basename(p):>22}" for p in results["latency"]))
+    for level, per_template in results["accuracy"].items():
+        cells = "".join(
+            f"{c['accuracy']:>10.3f} fp={c['fp']:<3} fn={c['fn']:<3}" for c in per_template.values()
+        )
+        print(f"{level:<12}{cells}")
+    print()
+    memory = results["memory"]
+    print(f"Memory: tracemalloc peak {memory['tracemalloc_peak_mb']} MB, max RSS {memory['max_rss_mb']} MB")
+
+
+def compare(results, baseline, tolerance):
+    """Prints latency/accuracy changes against a baseline run; returns True on a regression."""
+    regressed = False
+    print(f"Comparison against baseline (tolerance {tolerance:.0%}):")
+    for path, summary in results["latency"].items():
+        before = baseline.get("latency", {}).get(path)
+        if not before or not before["p50_ms"]:
+            continue
+        change = summary["p50_ms"] / before["p50_ms"] - 1
+        flag = "REGRESSION" if change > tolerance else ""
+        regressed |= bool(flag)
+        print(f"  {path:<24} p50 {before['p50_ms']:.2f} -> {summary['p50_ms']:.2f} ms ({change:+.0%}) {flag}")
+    for level, per_template in results["accuracy"].items():
+        for path, counts in per_template.items():
+            before = baseline.get("accuracy", {}).get(level, {}).get(path)
+            if before and counts["accuracy"] < before["accuracy"]:
+                regressed = True
+                print(
+                    f"  {path} @ {level}: accuracy {before['accuracy']:.3f} -> {counts['accuracy']:.3f} REGRESSION"
+                )
+    return regressed
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the template matcher on saved screenshots.")
+    parser.add_argument("frames", help="Directory of captured screenshots.")
+    parser.add_argument(
+        "--templates", nargs="+", default=list(TEMPLATE_IMAGES), help="Template PNGs to match."
+    )
+    parser.add_argument("--labels", help="JSON file mapping frame names to visible templates.")
+    parser.add_argument("--reference-confidence", type=float, default=0.8)
+    parser.add_argument("--repeat", type=int, default=3, help="Timed runs per frame.")
+    parser.add_argument("--hints", action="store_true", help="Enable the (in-memory) location hint cache.")
+    parser.add_argument(
+        "--display-scale",
+        type=float,
+        default=TEMPLATE_DISPLAY_SCALE,
+        help="Display scale the screenshots were taken at (1.0 = 100%%).",
+    )
+    parser.add_argument(
+        "--no-bundle", action="store_true", help="Decode the template PNGs instead of mapping the bundle."
+    )
+    parser.add_argument("--output", help="Write results as JSON for later --compare.")
+    parser.add_argument("--compare", help="Baseline results JSON to compare against.")
+    parser.add_argument("--tolerance", type=float, default=0.15, help="Allowed p50 slowdown before flagging.")
+    args = parser.parse_args()
+
+    labels = None
+    if args.labels:
+        with open(args.labels, "r", encoding="utf-8") as f:
+            labels = json.load(f)
+
+    results = run_benchmark(
+        load_frames(args.frames),
+        args.templates,
+        labels,
+        args.reference_confidence,
+        args.repeat,
+        args.hints,
+        display_scale=args.display_scale,
+        use_bundle=not args.no_bundle,
+    )
+    print_report(results)
+
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(results, f, indent=2, sort_keys=True)
+        print(f"Results written to {args.output}")
+
+    if args.compare:
+        with open(args.compare, "r", encoding="utf-8") as f:
+            baseline = json.load(f)
+        if compare(results, baseline, args.tolerance):
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,210 @@
+# Capture/encode pipeline for mini_screenshot.py.
+# Encoding a full-screen PNG can take longer than capturing it, so frames are
+# captured on a fixed schedule and handed to a pool of encoder threads through
+# a bounded queue. When the encoders fall behind, frames are dropped according
+# to a policy instead of letting the capture schedule drift.
+import collections
+import datetime
+import queue
+import threading
+import time
+
+DROP_OLDEST = "drop-oldest"  # Discard the oldest queued frame to make room
+DROP_NEWEST = "drop-newest"  # Discard the frame just captured
+BLOCK = "block"  # Wait for room; the capture schedule slips instead
+DROP_POLICIES = (DROP_OLDEST, DROP_NEWEST, BLOCK)
+
+_STOP = object()  # Sentinel telling an encoder worker to exit
+
+
+class StageTimer:
+    """Keeps the most recent latency samples of one pipeline stage, in milliseconds."""
+
+    def __init__(self, max_samples=1000):
+        self.samples = collections.deque(maxlen=max_samples)
+        self._lock = threading.Lock()
+
+    def add(self, duration_ms):
+        with self._lock:
+            self.samples.append(duration_ms)
+
+    def percentile(self, fraction):
+        with self._lock:
+            ordered = sorted(self.samples)
+        if not ordered:
+            return 0.0
+        index = min(len(ordered) - 1, int(round(fraction * (len(ordered) - 1))))
+        return ordered[index]
+
+    def summary(self):
+        return f"p50={self.percentile(0.5):.1f}ms p95={self.percentile(0.95):.1f}ms max={self.percentile(1.0):.1f}ms"
+
+
+class PipelineStats:
+    """Counters and per-stage latencies reported by CapturePipeline."""
+
+    def __init__(self):
+        self.captured = 0
+        self.encoded = 0
+        self.failed = 0
+        self.dropped = 0
+        self.missed_ticks = 0
+        self.max_queue_depth = 0
+        self.capture = StageTimer()
+        self.queue_wait = StageTimer()
+        self.encode = StageTimer()
+        self._lock = threading.Lock()
+
+    def count(self, name, amount=1):
+        with self._lock:
+            setattr(self, name, getattr(self, name) + amount)
+
+    def report(self, queue_depth):
+        return (
+            f"captured={self.captured} encoded={self.encoded} failed={self.failed} "
+            f"dropped={self.dropped} missed_ticks={self.missed_ticks} "
+            f"queue={queue_depth} (max {self.max_queue_depth}) | "
+            f"capture {self.capture.summary()} | wait {self.queue_wait.summary()} | "
+            f"encode {self.encode.summary()}"
+        )
+
+
+class CapturePipeline:
+    """
+    Captures frames on a fixed schedule and encodes them on background workers.
+
+    Args:
+        capture (callable): Returns a frame that stays valid after the next
+            capture (copy reused buffers before returning them).
+        encode (callable): encode(frame, timestamp) writes one frame out.
+        interval_seconds (float): Time between captures. Ticks are scheduled
+            from the start time, so slow captures do not make the interval drift.
+        queue_size (int): Frames that may wait for an encoder.
+        workers (int): Number of encoder threads.
+        drop_policy (str): One of DROP_POLICIES, applied when the queue is full.
+        report (callable): Receives a stats line every report_every captures.
+        report_every (int): Captures between reports; 0 reports only at the end.
+    """
+
+    def __init__(
+        self,
+        capture,
+        encode,
+        interval_seconds=5,
+        queue_size=4,
+        workers=2,
+        drop_policy=DROP_OLDEST,
+        report=print,
+        report_every=12,
+    ):
+        if drop_policy not in DROP_POLICIES:
+            raise ValueError(
+                f"Unknown drop policy '{drop_policy}', expected one of {DROP_POLICIES}"
+            )
+        self.capture = capture
+        self.encode = encode
+        self.interval_seconds = interval_seconds
+        self.drop_policy = drop_policy
+        self.workers = workers
+        self.report = report
+        self.report_every = report_every
+        self.stats = PipelineStats()
+        self._queue = queue.Queue(maxsize=queue_size)
+        self._stop_event = threading.Event()
+
+    def stop(self):
+        """Asks run() to finish after the current capture (safe from any thread)."""
+        self._stop_event.set()
+
+    def run(self, max_frames=None):
+        """
+        Runs the capture loop until stop() is called, max_frames are captured,
+        or KeyboardInterrupt; then drains the queue and joins the encoders.
+        """
+        threads = [
+            threading.Thread(target=self._encoder_loop, name=f"encoder-{i}", daemon=True)
+            for i in range(self.workers)
+        ]
+        for thread in threads:
+            thread.start()
+
+        next_tick = time.perf_counter()
+        last_reported = 0
+        try:
+            while not self._stop_event.is_set():
+                if max_frames is not None and self.stats.captured >= max_frames:
+                    break
+                self._capture_once()
+                captured = self.stats.captured
+                # A failed capture leaves the count unchanged; report each multiple once.
+                if (
+                    self.report_every
+                    and captured % self.report_every == 0
+                    and captured != last_reported
+                ):
+                    last_reported = captured
+                    self.report(self.stats.report(self._queue.qsize()))
+
+                next_tick += self.interval_seconds
+                now = time.perf_counter()
+                if now > next_tick:
+                    # Fell more than a whole interval behind; skip the missed
+                    # ticks instead of capturing a burst to catch up.
+                    missed = int((now - next_tick) // self.interval_seconds) + 1
+                    self.stats.count("missed_ticks", missed)
+                    next_tick += missed * self.interval_seconds
+                self._stop_event.wait(max(0.0, next_tick - time.perf_counter()))
+        finally:
+            for _ in threads:
+                self._queue.put(_STOP)
+            for thread in threads:
+                thread.join()
+            self.report(self.stats.report(self._queue.qsize()))
+
+    def _capture_once(self):
+        timestamp = datetime.datetime.now()
+        start_time = time.perf_counter()
+        try:
+            frame = self.capture()
+        except Exception as e:
+            self.stats.count("failed")
+            print(f"Error capturing screenshot: {e}")
+            return
+        self.stats.capture.add((time.perf_counter() - start_time) * 1000)
+        self.stats.count("captured")
+        self._enqueue((frame, timestamp, time.perf_counter()))
+
+    def _enqueue(self, item):
+        if self.drop_policy == BLOCK:
+            self._queue.put(item)
+        else:
+            try:
+                self._queue.put_nowait(item)
+            except queue.Full:
+                self.stats.count("dropped")
+                if self.drop_policy == DROP_OLDEST:
+                    try:
+                        self._queue.get_nowait()
+                    except queue.Empty:
+                        pass
+                    self._queue.put_nowait(item)
+        depth = self._queue.qsize()
+        if depth > self.stats.max_queue_depth:
+            self.stats.max_queue_depth = depth
+
+    def _encoder_loop(self):
+        while True:
+            item = self._queue.get()
+            if item is _STOP:
+                return
+            frame, timestamp, queued_at = item
+            start_time = time.perf_counter()
+            self.stats.queue_wait.add((start_time - queued_at) * 1000)
+            try:
+                self.encode(frame, timestamp)
+                self.stats.count("encoded")
+            except Exception as e:
+                self.stats.count("failed")
+                print(f"Error encoding screenshot: {e}")
+            self.stats.encode.add((time.perf_counter() - start_time) * 1000)
+
@@ -0,0 +1,550 @@
+# Platform abstraction for tablet_mode.py.
+# Everything the tablet-mode flow does to the machine (capture the screen,
+# click, press keys, read the active window and display rotation, launch a
+# URI, wait) goes through a Desktop. WindowsDesktop drives the real machine;
+# SimulatedDesktop renders scripted screen states on a virtual clock, so the
+# whole flow, including its retries and timeouts, runs in milliseconds.
+import asyncio
+import concurrent.futures
+import ctypes
+import heapq
+import subprocess
+import sys
+import threading
+import time
+import zlib
+
+import cv2
+import numpy as np
+
+from screen_capture import (
+    PIXEL_BGRX,
+    CaptureBackend,
+    MonitorLayout,
+    ScreenCapturer,
+    Win32CaptureBackend,
+)
+from template_matcher import CapturerFrameSource, FramePyramid
+from window_events import (
+    DisplayChangeWatcher,
+    FocusWatcher,
+    PollingFocusBackend,
+    default_focus_backend,
+)
+
+# How often a cancellable wait_for_window_title() checks its cancel event.
+CANCEL_CHECK_SECONDS = 0.1
+
+
+class Desktop:
+    """
+    Interface for the machine the workflow runs against.
+
+    clock() is a monotonic time in seconds and sleep() waits on that clock.
+    active_window_title() returns the title or None, and may raise if it
+    cannot be fetched; screen_rotation() returns degrees (0/90/180/270).
+    display_scale() is the UI scale factor (1.0 at 100%, 1.5 at 150%).
+    monitor_layout() returns a screen_capture.MonitorLayout of its displays.
+    wait_for_window_title() returns the matching title, or None on timeout
+    or once its cancel event (a threading.Event) is set.
+    """
+
+    def clock(self):
+        raise NotImplementedError
+
+    def sleep(self, seconds):
+        raise NotImplementedError
+
+    def frame_source(self):
+        """Returns a template_matcher frame source for this screen."""
+        raise NotImplementedError
+
+    def click(self, point):
+        raise NotImplementedError
+
+    def right_click(self, point):
+        raise NotImplementedError
+
+    def press(self, key):
+        raise NotImplementedError
+
+    def hotkey(self, *keys):
+        raise NotImplementedError
+
+    def active_window_title(self):
+        raise NotImplementedError
+
+    def screen_rotation(self):
+        raise NotImplementedError
+
+    def display_scale(self):
+        raise NotImplementedError
+
+    def monitor_layout(self):
+        raise NotImplementedError
+
+    def launch_uri(self, uri):
+        raise NotImplementedError
+
+    def screenshot(self, path):
+        raise NotImplementedError
+
+    def wait_for_window_title(self, substring, max_wait_seconds, interval_seconds, cancel=None):
+        raise NotImplementedError
+
+
+class WindowsDesktop(Desktop):
+    """
+    The real machine, through pyautogui, pygetwindow, pywin32 and GDI capture.
+
+    Args:
+        pixel_format (str): screen_capture pixel format the screen is captured
+            in; BGRX by default, converted to gray for matching.
+        monitor (str): If set, frames cover only this monitor (a MonitorLayout
+            name such as "primary" or "\\\\.\\DISPLAY2") instead of the
+            whole virtual screen. Its rectangle follows display changes.
+    """
+
+    def __init__(self, pixel_format=PIXEL_BGRX, monitor=None):
+        import pyautogui
+        import pygetwindow
+        import win32api
+        import win32con
+
+        self._pyautogui = pyautogui
+        self._gw = pygetwindow
+        self._win32api = win32api
+        self._win32con = win32con
+        self._frame_source = None
+        self._monitor_layout = None
+        self._display_watcher = None
+        self._focus_loop = None
+        self._focus_watchers = {}  # Poll interval (None for event backends) -> FocusWatcher
+        self._focus_lock = threading.Lock()
+        self.pixel_format = pixel_format
+        self.monitor = monitor
+
+    def clock(self):
+        return time.perf_counter()
+
+    def sleep(self, seconds):
+        time.sleep(seconds)
+
+    def frame_source(self):
+        if self._frame_source is None:
+            region = self.monitor_layout().region(self.monitor) if self.monitor else None
+            self._frame_source = CapturerFrameSource(
+                ScreenCapturer(pixel_format=self.pixel_format, region=region),
+                capturer_factory=lambda region: ScreenCapturer(
+                    pixel_format=self.pixel_format, region=region
+                ),
+            )
+        return self._frame_source
+
+    def monitor_layout(self):
+        if self._monitor_layout is None:
+            self._monitor_layout = MonitorLayout(Win32CaptureBackend())
+            try:
+                self._display_watcher = DisplayChangeWatcher(self._monitor_layout.invalidate)
+                self._display_watcher.start()
+            except (AttributeError, OSError) as e:
+                # The layout still refreshes when the virtual screen size changes.
+                print(f"WARNING: Display change events unavailable: {e}", file=sys.stderr)
+        return self._monitor_layout
+
+    def click(self, point):
+        self._pyautogui.click(point)
+
+    def right_click(self, point):
+        self._pyautogui.rightClick(point)
+
+    def press(self, key):
+        self._pyautogui.press(key)
+
+    def hotkey(self, *keys):
+        self._pyautogui.hotkey(*keys)
+
+    def active_window_title(self):
+        active_window = self._gw.getActiveWindow()
+        return active_window.title if active_window else None
+
+    def screen_rotation(self):
+        win32con = self._win32con
+        # Get settings for the primary display
+        settings = self._win32api.EnumDisplaySettings(None, win32con.ENUM_CURRENT_SETTINGS)
+        orientation_val = settings.DisplayOrientation
+        orientation_map = {
+            win32con.DMDO_DEFAULT: 0,  # Landscape
+            win32con.DMDO_90: 90,  # Portrait
+            win32con.DMDO_180: 180,  # Landscape (flipped)
+            win32con.DMDO_270: 270,  # Portrait (flipped)
+        }
+        return orientation_map.get(orientation_val, f"Unk({orientation_val})")
+
+    def display_scale(self):
+        try:
+            # 96 DPI is 100% scaling. GetDpiForSystem needs Windows 10 1607+.
+            return ctypes.windll.user32.GetDpiForSystem() / 96
+        except (AttributeError, OSError):
+            return 1.0
+
+    def launch_uri(self, uri):
+        subprocess.run(["explorer.exe", uri], check=False, shell=True)
+
+    def screenshot(self, path):
+        self._pyautogui.screenshot(path)
+
+    def wait_for_window_title(self, substring, max_wait_seconds, interval_seconds, cancel=None):
+        watcher = self._shared_focus_watcher(interval_seconds)
+        future = asyncio.run_coroutine_threadsafe(
+            watcher.wait_for_title(substring, timeout=max_wait_seconds), self._focus_loop
+        )
+        deadline = self.clock() + max_wait_seconds
+        try:
+            while True:
+                timeout = max(0.0, deadline - self.clock())
+                if cancel is not None:
+                    timeout = min(timeout, CANCEL_CHECK_SECONDS)
+                try:
+                    return future.result(timeout=timeout)
+                except concurrent.futures.TimeoutError:
+                    if (cancel is not None and cancel.is_set()) or self.clock() >= deadline:
+                        return None
+        finally:
+            future.cancel()  # Unsubscribes the wait if it is still pending
+
+    def _shared_focus_watcher(self, interval_seconds):
+        """
+        Returns the FocusWatcher shared by the waits polling at interval_seconds.
+
+        Watchers are started on first use, on one event loop running on its
+        own thread, and stay subscribed for the life of the process, so each
+        wait costs a future instead of a new hook thread and event loop.
+        WinEvent hooks do not poll, so with them one watcher serves every
+        wait; the polling fallback keeps one watcher per interval, so a wait
+        is never checked less often than it asked for.
+        """
+        with self._focus_lock:
+            if self._focus_loop is None:
+                self._focus_loop = asyncio.new_event_loop()
+                threading.Thread(
+                    target=self._focus_loop.run_forever, name="focus-loop", daemon=True
+                ).start()
+            watcher = self._focus_watchers.get(None) or self._focus_watchers.get(interval_seconds)
+            if watcher is None:
+                backend = default_focus_backend(self._title_or_none, interval_seconds)
+                watcher = FocusWatcher(backend)
+                asyncio.run_coroutine_threadsafe(watcher.__aenter__(), self._focus_loop).result()
+                key = interval_seconds if isinstance(backend, PollingFocusBackend) else None
+                self._focus_watchers[key] = watcher
+            return watcher
+
+    def _title_or_none(self):
+        try:
+            return self.active_window_title()
+        except Exception:
+            return None
+
+
+# --- Simulation ---
+
+
+class VirtualClock:
+    """
+    A clock that only moves when told to.
+
+    sleep() jumps straight to the wake-up time, running any callbacks
+    scheduled with call_later() on the way, in time order.
+
+    It may be used from several threads (a workflow's Concurrent steps).
+    Each sleeping thread then moves the shared clock forward by itself, so
+    virtual time runs ahead while steps run concurrently, and their
+    simulated durations are an upper bound.
+    """
+
+    def __init__(self, start=0.0):
+        self.now = start
+        self._events = []  # heap of (time, sequence, callback)
+        self._sequence = 0
+        self._lock = threading.RLock()  # Callbacks may schedule further events
+
+    def time(self):
+        return self.now
+
+    def call_later(self, delay, callback):
+        with self._lock:
+            heapq.heappush(self._events, (self.now + max(0.0, delay), self._sequence, callback))
+            self._sequence += 1
+
+    def next_event_time(self):
+        with self._lock:
+            return self._events[0][0] if self._events else None
+
+    def advance_to(self, when):
+        with self._lock:
+            while self._events and self._events[0][0] <= when:
+                event_time, _, callback = heapq.heappop(self._events)
+                self.now = max(self.now, event_time)
+                callback()
+            self.now = max(self.now, when)
+
+    def sleep(self, seconds):
+        self.advance_to(self.now + max(0.0, seconds))
+
+
+class ScreenState:
+    """
+    One scripted screen of a simulation.
+
+    Args:
+        name (str): State name, used by transitions.
+        title (str): Active window title while in this state (None for no window).
+        rotation (int): Display rotation in degrees.
+        elements (dict): Template path -> (x, y) center where it is drawn.
+        on_click (dict): Template path -> (next_state, delay) when it is clicked.
+        on_right_click (dict): Same, for right clicks.
+        on_keys (dict): Key name or "alt+f4" style hotkey -> (next_state, delay).
+        after (tuple): (seconds, next_state) to move on by itself after entering.
+    """
+
+    def __init__(
+        self,
+        name,
+        title=None,
+        rotation=0,
+        elements=None,
+        on_click=None,
+        on_right_click=None,
+        on_keys=None,
+        after=None,
+    ):
+        self.name = name
+        self.title = title
+        self.rotation = rotation
+        self.elements = elements or {}
+        self.on_click = on_click or {}
+        self.on_right_click = on_right_click or {}
+        self.on_keys = on_keys or {}
+        self.after = after
+
+
+class SimulatedFrameSource:
+    """Frame source returning the simulated desktop's current rendered frame."""
+
+    origin = (0, 0)
+
+    def __init__(self, desktop):
+        self.desktop = desktop
+
+    def grab(self, region=None):
+        if region is not None:
+            return FramePyramid(self.desktop.render()).crop(region)
+        return self.desktop.render()
+
+
+class _SimulatedMonitors(CaptureBackend):
+    """Monitor enumeration for a SimulatedDesktop, following its rotation."""
+
+    def __init__(self, desktop):
+        self.desktop = desktop
+
+    def screen_rect(self):
+        return (0, 0, *self.desktop.rotated_size())
+
+    def monitors(self):
+        return self.desktop.monitors or super().monitors()
+
+
+class SimulatedDesktop(Desktop):
+    """
+    An in-memory desktop that renders scripted ScreenStates on a VirtualClock.
+
+    Templates are drawn (grayscale) onto a per-state noise background, so the
+    real matcher, hint cache and change detection run against it. Every
+    action taken is appended to `actions` as (virtual_time, description).
+
+    Args:
+        states (list of ScreenState): The scripted screens.
+        initial (str): Name of the starting state.
+        screen_size (tuple): (width, height) at rotation 0; swapped at 90/270.
+        launch_handlers (dict): URI -> (next_state, delay) for launch_uri().
+        clock (VirtualClock): Shared clock; a new one is created if None.
+        scale (float): Reported display scale. The screen and element positions
+            are scaled by it, like a higher-DPI panel with the same layout.
+        template_scale (float): Display scale the template PNGs were captured
+            at. Templates are drawn resized by scale / template_scale, so they
+            appear as they would on a real panel at `scale`.
+        monitors (list of screen_capture.Monitor): Display layout reported by
+            monitor_layout(); one monitor covering the screen by default.
+    """
+
+    def __init__(
+        self,
+        states,
+        initial,
+        screen_size=(1280, 800),
+        launch_handlers=None,
+        clock=None,
+        scale=1.0,
+        monitors=None,
+        template_scale=1.0,
+    ):
+        self.states = {state.name: state for state in states}
+        self.scale = scale
+        self.template_scale = template_scale
+        self.screen_size = (round(screen_size[0] * scale), round(screen_size[1] * scale))
+        self.launch_handlers = launch_handlers or {}
+        self.virtual_clock = clock or VirtualClock()
+        self.actions = []
+        self.state = None
+        self._templates = {}
+        self._frames = {}
+        self._frame_source = SimulatedFrameSource(self)
+        self.monitors = list(monitors or [])
+        self._monitor_layout = MonitorLayout(_SimulatedMonitors(self))
+        self._goto(initial)
+
+    # --- Desktop interface ---
+
+    def clock(self):
+        return self.virtual_clock.time()
+
+    def sleep(self, seconds):
+        self.virtual_clock.sleep(seconds)
+
+    def frame_source(self):
+        return self._frame_source
+
+    def monitor_layout(self):
+        return self._monitor_layout
+
+    def click(self, point):
+        self._pointer_action("click", self.state.on_click, point)
+
+    def right_click(self, point):
+        self._pointer_action("right_click", self.state.on_right_click, point)
+
+    def press(self, key):
+        self._key_action(key)
+
+    def hotkey(self, *keys):
+        self._key_action("+".join(keys))
+
+    def active_window_title(self):
+        return self.state.title
+
+    def screen_rotation(self):
+        return self.state.rotation
+
+    def display_scale(self):
+        return self.scale
+
+    def launch_uri(self, uri):
+        self._record(f"launch {uri}")
+        if uri in self.launch_handlers:
+            self._schedule(*self.launch_handlers[uri])
+
+    def screenshot(self, path):
+        cv2.imwrite(path, self.render())
+
+    def wait_for_window_title(self, substring, max_wait_seconds, interval_seconds, cancel=None):
+        # Jump from event to event instead of polling: exact, and instant in real time.
+        deadline = self.clock() + max_wait_seconds
+        while True:
+            title = self.state.title
+            if isinstance(title, str) and substring in title:
+                return title
+            if cancel is not None and cancel.is_set():
+                return None
+            next_event = self.virtual_clock.next_event_time()
+            if next_event is None or next_event > deadline:
+                self.virtual_clock.advance_to(deadline)
+                title = self.state.title
+                return title if isinstance(title, str) and substring in title else None
+            self.virtual_clock.advance_to(next_event)
+
+    # --- Rendering ---
+
+    def render(self):
+        """Returns the grayscale frame for the current state (cached per state)."""
+        frame = self._frames.get(self.state.name)
+        if frame is None:
+            frame = self._render_state(self.state)
+            self._frames[self.state.name] = frame
+        return frame
+
+    def rotated_size(self, state=None):
+        """Returns the (width, height) of the screen in a state (default: the current one)."""
+        width, height = self.screen_size
+        if (state or self.state).rotation in (90, 270):
+            width, height = height, width
+        return width, height
+
+    def _render_state(self, state):
+        width, height = self.rotated_size(state)
+        # Mild noise gives the matcher texture and makes every state's frame distinct.
+        rng = np.random.default_rng(zlib.crc32(state.name.encode()))
+        frame = rng.integers(96, 160, size=(height, width), dtype=np.uint8)
+        for path, (x, y) in self._elements(state):
+            template = self._template(path)
+            tmpl_h, tmpl_w = template.shape
+            left, top = x - tmpl_w // 2, y - tmpl_h // 2
+            frame[top : top + tmpl_h, left : left + tmpl_w] = template
+        return frame
+
+    def _template(self, path):
+        template = self._templates.get(path)
+        if template is None:
+            template = cv2.imread(path, cv2.IMREAD_GRAYSCALE)
+            if template is None:
+                raise FileNotFoundError(f"Could not read template image: {path}")
+            factor = self.scale / self.template_scale
+            if factor != 1.0:
+                template = cv2.resize(template, None, fx=factor, fy=factor)
+            self._templates[path] = template
+        return template
+
+    def element_at(self, point):
+        """Returns the template path drawn under point in the current state, or None."""
+        x, y = point
+        for path, (center_x, center_y) in self._elements(self.state):
+            tmpl_h, tmpl_w = self._template(path).shape
+            if abs(x - center_x) <= tmpl_w // 2 and abs(y - center_y) <= tmpl_h // 2:
+                return path
+        return None
+
+    def _elements(self, state):
+        for path, (x, y) in state.elements.items():
+            yield path, (round(x * self.scale), round(y * self.scale))
+
+    # --- Transitions ---
+
+    def _pointer_action(self, kind, handlers, point):
+        element = self.element_at(point)
+        self._record(f"{kind} {tuple(point)} on {element or 'nothing'}")
+        if element in handlers:
+            self._schedule(*handlers[element])
+
+    def _key_action(self, key):
+        self._record(f"key {key}")
+        if key in self.state.on_keys:
+            self._schedule(*self.state.on_keys[key])
+
+    def _schedule(self, next_state, delay):
+        origin = self.state.name
+
+        def transition():
+            # Ignore transitions queued by a state we already left.
+            if self.state.name == origin:
+                self._goto(next_state)
+
+        self.virtual_clock.call_later(delay, transition)
+
+    def _goto(self, name):
+        self.state = self.states[name]
+        self._record(f"enter {name}")
+        if self.state.after is not None:
+            self._schedule(self.state.after[1], self.state.after[0])
+
+    def _record(self, description):
+        self.actions.append((self.clock(), description))
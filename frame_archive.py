@@ -0,0 +1,349 @@
+# Deduplicating, tile-delta screenshot archive for mini_screenshot.py.
+# The e-ink desktop is mostly static, so instead of a full PNG per capture the
+# archive stores a keyframe and then only the tiles that changed. Frames
+# identical to the previous one are not stored at all.
+#
+# File layout: MAGIC, then one record per stored frame:
+#   header (RECORD_HEADER) + payload
+# A keyframe payload is the zlib-compressed frame. A delta payload is the
+# changed tile indices (uint16 row, col pairs) followed by the zlib-compressed
+# bytes of those tiles, in the same order.
+# 1-bit frames (screen_capture.PIXEL_MONO) are stored still packed, with
+# channels = 0 in the header; their tiles are tile_size rows by tile_size bytes.
+#
+# Usage: python frame_archive.py extract ARCHIVE YYYYmmdd_HHMMSS OUT.png
+import bisect
+import datetime
+import os
+import struct
+import sys
+import zlib
+
+import numpy as np
+
+from screen_capture import unpack_mono
+
+MAGIC = b"EINKARC1"
+KEYFRAME = b"KEY "
+DELTA = b"DLTA"
+# kind, timestamp (epoch seconds), width, height, channels, tile size, tile count, payload bytes
+RECORD_HEADER = struct.Struct("<4sdIIBHII")
+TIMESTAMP_FORMAT = "%Y%m%d_%H%M%S"
+PACKED_MONO = 0  # `channels` value of bit-packed 1-bit frames
+
+
+def _tile_grid(height, width, tile_size):
+    return -(-height // tile_size), -(-width // tile_size)
+
+
+def _tile_slices(row, col, tile_size):
+    return (
+        slice(row * tile_size, (row + 1) * tile_size),
+        slice(col * tile_size, (col + 1) * tile_size),
+    )
+
+
+def _scan_records(f, path):
+    """
+    Reads the record headers of an open archive.
+
+    Returns:
+        tuple: (records, end) - (timestamp, kind, width, height, channels,
+        tile_size, tile_count, offset, length) per complete record, and the
+        file offset just after the last complete record.
+    """
+    f.seek(0)
+    if f.read(len(MAGIC)) != MAGIC:
+        raise ValueError(f"{path} is not a frame archive")
+    file_size = os.fstat(f.fileno()).st_size
+    records = []
+    end = f.tell()
+    while True:
+        header = f.read(RECORD_HEADER.size)
+        if len(header) < RECORD_HEADER.size:
+            break  # End of file, or a record cut short by a crash
+        kind, timestamp, width, height, channels, tile_size, tile_count, length = (
+            RECORD_HEADER.unpack(header)
+        )
+        offset = f.tell()
+        if offset + length > file_size:
+            break
+        f.seek(length, 1)
+        records.append(
+            (timestamp, kind, width, height, channels, tile_size, tile_count, offset, length)
+        )
+        end = offset + length
+    return records, end
+
+
+class FrameArchiveWriter:
+    """
+    Appends frames to an archive file as keyframes and tile deltas.
+
+    Frames must be appended in time order from a single thread, since each
+    delta depends on the frame before it. When appending to an existing
+    archive, a last record cut short by a crash is cut off first, so the
+    frames appended after it stay readable.
+
+    Args:
+        path (str): Archive file; appended to if it already exists.
+        tile_size (int): Edge of the square tiles compared between frames.
+        keyframe_interval (int): Stored frames between keyframes, bounding
+            how many deltas the reader has to replay.
+        keyframe_change_ratio (float): A frame with at least this fraction of
+            tiles changed is stored as a keyframe instead of a delta.
+        compression_level (int): zlib level for keyframes and tile data.
+    """
+
+    def __init__(
+        self,
+        path,
+        tile_size=64,
+        keyframe_interval=120,
+        keyframe_change_ratio=0.5,
+        compression_level=6,
+    ):
+        self.path = path
+        self.tile_size = tile_size
+        self.keyframe_interval = keyframe_interval
+        self.keyframe_change_ratio = keyframe_change_ratio
+        self.compression_level = compression_level
+        self.frames_in = 0
+        self.skipped = 0
+        self.keyframes = 0
+        self.deltas = 0
+        self.bytes_in = 0
+        self.bytes_written = 0
+        self._previous = None
+        self._since_keyframe = 0
+        self._packed_width = None
+        self._previous_packed_width = None
+        if os.path.exists(path) and os.path.getsize(path) > 0:
+            self._file = open(path, "r+b")
+            _, end = _scan_records(self._file, path)
+            self._file.truncate(end)
+            self._file.seek(end)
+        else:
+            self._file = open(path, "wb")
+            self._file.write(MAGIC)
+            self.bytes_written += len(MAGIC)
+
+    def append(self, frame, timestamp, packed_width=None):
+        """
+        Stores one frame.
+
+        Args:
+            frame (np.ndarray): (height, width) or (height, width, channels) uint8
+                frame, or packed 1-bit rows if packed_width is given.
+            timestamp (datetime.datetime): Capture time, used by the reader to look frames up.
+            packed_width (int): Pixel width of a PIXEL_MONO frame; the bytes
+                are stored as they are and unpacked by the reader.
+
+        Returns:
+            str: "skipped", "keyframe" or "delta", describing what was written.
+        """
+        if frame.ndim == 2:
+            frame = frame[:, :, np.newaxis]
+        self._packed_width = packed_width
+        self.frames_in += 1
+        self.bytes_in += frame.nbytes
+        previous = self._previous
+
+        if (
+            previous is not None
+            and previous.shape == frame.shape
+            and self._previous_packed_width == packed_width
+            and np.array_equal(previous, frame)
+        ):
+            self.skipped += 1
+            return "skipped"
+
+        # Keep our own copy: the caller's buffer may be reused for the next capture.
+        self._previous = frame.copy()
+        format_changed = self._previous_packed_width != packed_width
+        self._previous_packed_width = packed_width
+        if (
+            previous is None
+            or previous.shape != frame.shape
+            or format_changed
+            or self._since_keyframe >= self.keyframe_interval
+        ):
+            return self._write_keyframe(frame, timestamp)
+
+        height, width, _ = frame.shape
+        rows, cols = _tile_grid(height, width, self.tile_size)
+        differs = np.any(previous != frame, axis=2)
+        padded = np.zeros((rows * self.tile_size, cols * self.tile_size), dtype=bool)
+        padded[:height, :width] = differs
+        changed = np.argwhere(
+            padded.reshape(rows, self.tile_size, cols, self.tile_size).any(axis=(1, 3))
+        )
+        if len(changed) >= self.keyframe_change_ratio * rows * cols:
+            return self._write_keyframe(frame, timestamp)
+
+        tile_bytes = b"".join(
+            np.ascontiguousarray(frame[_tile_slices(row, col, self.tile_size)]).tobytes()
+            for row, col in changed
+        )
+        payload = changed.astype("<u2").tobytes() + zlib.compress(
+            tile_bytes, self.compression_level
+        )
+        self._write_record(DELTA, frame, timestamp, len(changed), payload)
+        self.deltas += 1
+        self._since_keyframe += 1
+        return "delta"
+
+    def summary(self):
+        ratio = self.bytes_in / self.bytes_written if self.bytes_written else 0.0
+        return (
+            f"frames={self.frames_in} skipped={self.skipped} keyframes={self.keyframes} "
+            f"deltas={self.deltas} raw={self.bytes_in / 1e6:.1f}MB "
+            f"written={self.bytes_written / 1e6:.2f}MB ({ratio:.0f}x smaller)"
+        )
+
+    def close(self):
+        self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+    def _write_keyframe(self, frame, timestamp):
+        payload = zlib.compress(np.ascontiguousarray(frame).tobytes(), self.compression_level)
+        self._write_record(KEYFRAME, frame, timestamp, 0, payload)
+        self.keyframes += 1
+        self._since_keyframe = 0
+        return "keyframe"
+
+    def _write_record(self, kind, frame, timestamp, tile_count, payload):
+        height, width, channels = frame.shape
+        if self._packed_width is not None:
+            width, channels = self._packed_width, PACKED_MONO
+        header = RECORD_HEADER.pack(
+            kind,
+            timestamp.timestamp(),
+            width,
+            height,
+            channels,
+            self.tile_size,
+            tile_count,
+            len(payload),
+        )
+        self._file.write(header)
+        self._file.write(payload)
+        self._file.flush()  # A crash should lose at most the frame being written
+        self.bytes_written += len(header) + len(payload)
+
+
+class FrameArchiveReader:
+    """
+    Rebuilds frames from an archive written by FrameArchiveWriter.
+
+    Only the record headers are read when opening, so opening a large archive
+    is fast; payloads are read when a frame is requested.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._file = open(path, "rb")
+        self._records, _ = _scan_records(self._file, path)
+        self._timestamps = [record[0] for record in self._records]
+
+    def timestamps(self):
+        """Returns the capture times of all stored frames (skipped duplicates are not listed)."""
+        return [datetime.datetime.fromtimestamp(ts) for ts in self._timestamps]
+
+    def frame_at(self, timestamp):
+        """
+        Returns the frame that was on screen at `timestamp`.
+
+        That is the last stored frame captured at or before it; frames that
+        were skipped as duplicates are identical to it by construction.
+
+        Raises:
+            KeyError: If the archive has no frame at or before `timestamp`.
+        """
+        index = bisect.bisect_right(self._timestamps, timestamp.timestamp()) - 1
+        if index < 0:
+            raise KeyError(f"No frame at or before {timestamp}")
+        start = index
+        while self._records[start][1] != KEYFRAME:
+            start -= 1
+
+        frame = None
+        for record in self._records[start : index + 1]:
+            frame = self._apply(record, frame)
+        _, _, width, _, channels, *_ = self._records[index]
+        if channels == PACKED_MONO:
+            return unpack_mono(frame[:, :, 0], width)
+        return frame[:, :, 0] if frame.shape[2] == 1 else frame
+
+    def frames(self):
+        """
+        Yields (timestamp, frame) for every stored frame in order, replaying
+        each delta once; much faster than calling frame_at() per timestamp.
+        Each yielded frame is a new array.
+        """
+        frame = None
+        for record in self._records:
+            frame = self._apply(record, frame)
+            timestamp, _, width, _, channels, *_ = record
+            if channels == PACKED_MONO:
+                decoded = unpack_mono(frame[:, :, 0], width)
+            elif frame.shape[2] == 1:
+                decoded = frame[:, :, 0].copy()
+            else:
+                decoded = frame.copy()
+            yield datetime.datetime.fromtimestamp(timestamp), decoded
+
+    def close(self):
+        self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+    def _apply(self, record, frame):
+        _, kind, width, height, channels, tile_size, tile_count, offset, length = record
+        self._file.seek(offset)
+        payload = self._file.read(length)
+        if kind == KEYFRAME:
+            data = zlib.decompress(payload)
+            if channels == PACKED_MONO:
+                width, channels = -(-width // 8), 1
+            return np.frombuffer(data, dtype=np.uint8).reshape(height, width, channels).copy()
+
+        index_bytes = tile_count * 4
+        tiles = np.frombuffer(payload[:index_bytes], dtype="<u2").reshape(tile_count, 2)
+        data = zlib.decompress(payload[index_bytes:])
+        position = 0
+        for row, col in tiles:
+            target = frame[_tile_slices(int(row), int(col), tile_size)]
+            size = target.size
+            target[...] = np.frombuffer(data, dtype=np.uint8, count=size, offset=position).reshape(
+                target.shape
+            )
+            position += size
+        return frame
+
+
+if __name__ == "__main__":
+    if len(sys.argv) != 5 or sys.argv[1] != "extract":
+        print("Usage: python frame_archive.py extract ARCHIVE YYYYmmdd_HHMMSS OUT.png")
+        sys.exit(2)
+    from PIL import Image
+
+    _, _, archive_path, when, output_path = sys.argv
+    with FrameArchiveReader(archive_path) as reader:
+        frame = reader.frame_at(datetime.datetime.strptime(when, TIMESTAMP_FORMAT))
+    if frame.ndim == 2:
+        Image.fromarray(frame, "L").save(output_path)
+    else:
+        height, width, channels = frame.shape
+        raw_mode = {3: "BGR", 4: "BGRX"}[channels]
+        Image.frombuffer("RGB", (width, height), frame, "raw", raw_mode, 0, 1).save(output_path)
+    print(f"Saved frame at {when} to {output_path}")
@@ -0,0 +1,129 @@
+# Cheap "did the screen change?" checks for the polling loops in tablet_mode.py.
+# E-ink refreshes slowly, so most polls see the same frame; re-running the
+# template match on an identical frame cannot produce a different answer.
+import cv2
+import numpy as np
+
+
+class FrameChangeDetector:
+    """
+    Compares frames with a reference frame on a downsampled grid of tiles.
+
+    A tile counts as changed when its mean absolute difference exceeds
+    `tile_threshold` grey levels; the frame counts as changed when any tile
+    did. Downsampling first hides dithering noise and keeps the check to a
+    fraction of a millisecond even on a high-resolution panel.
+
+    The reference is the last frame reported as changed, i.e. the one the
+    caller last acted on (re-ran its match on), not simply the previous
+    poll: a slow e-ink fade that stays under the threshold from poll to
+    poll still counts as a change once it adds up.
+
+    Args:
+        downscale (int): Factor the frame is shrunk by before comparing.
+        tile_size (int): Tile edge, in downscaled pixels.
+        tile_threshold (float): Mean grey-level difference for a tile to count as changed.
+    """
+
+    def __init__(self, downscale=4, tile_size=16, tile_threshold=2.0):
+        self.downscale = downscale
+        self.tile_size = tile_size
+        self.tile_threshold = tile_threshold
+        self._reference = None
+        self._reference_packed = None
+
+    def changed(self, frame):
+        """
+        Returns True if the grayscale frame differs from the reference frame.
+
+        The first frame (and any frame of a different size) counts as changed.
+        A changed frame becomes the new reference.
+        """
+        small = self._shrink(frame)
+        reference = self._reference
+        if reference is None or reference.shape != small.shape:
+            self._reference = small
+            return True
+
+        diff = cv2.absdiff(small, reference)
+        tile = self.tile_size
+        rows = -(-diff.shape[0] // tile)
+        cols = -(-diff.shape[1] // tile)
+        padded = np.zeros((rows * tile, cols * tile), dtype=np.float32)
+        padded[: diff.shape[0], : diff.shape[1]] = diff
+        tile_means = padded.reshape(rows, tile, cols, tile).mean(axis=(1, 3))
+        if not (tile_means > self.tile_threshold).any():
+            return False
+        self._reference = small
+        return True
+
+    def changed_packed(self, packed):
+        """
+        Like changed(), for 1-bit frames packed 8 pixels per byte (PIXEL_MONO).
+
+        The packed bytes are compared directly, without unpacking: a tile of
+        (tile_size * downscale) pixels square counts as changed when its share
+        of flipped pixels, times 255, exceeds tile_threshold - the same mean
+        grey-level difference changed() uses.
+        """
+        reference = self._reference_packed
+        if reference is None or reference.shape != packed.shape:
+            self._reference_packed = packed.copy()
+            return True
+
+        diff = np.bitwise_xor(reference, packed)
+        if not diff.any():
+            return False
+        flipped = _popcount(diff)
+        tile_rows = self.tile_size * self.downscale
+        tile_bytes = max(1, tile_rows // 8)
+        rows = -(-flipped.shape[0] // tile_rows)
+        cols = -(-flipped.shape[1] // tile_bytes)
+        padded = np.zeros((rows * tile_rows, cols * tile_bytes), dtype=np.uint32)
+        padded[: flipped.shape[0], : flipped.shape[1]] = flipped
+        tile_counts = padded.reshape(rows, tile_rows, cols, tile_bytes).sum(axis=(1, 3))
+        tile_means = tile_counts * 255.0 / (tile_rows * tile_bytes * 8)
+        if not (tile_means > self.tile_threshold).any():
+            return False
+        self._reference_packed = packed.copy()
+        return True
+
+    def _shrink(self, frame):
+        height, width = frame.shape[:2]
+        size = (max(1, width // self.downscale), max(1, height // self.downscale))
+        return cv2.resize(frame, size, interpolation=cv2.INTER_AREA)
+
+
+_POPCOUNT_TABLE = np.array([bin(value).count("1") for value in range(256)], dtype=np.uint8)
+
+
+def _popcount(packed):
+    """Number of set bits in each byte."""
+    if hasattr(np, "bitwise_count"):  # NumPy 2.0+
+        return np.bitwise_count(packed)
+    return _POPCOUNT_TABLE[packed]
+
+
+class AdaptiveInterval:
+    """
+    Poll delay that is short right after a change and backs off while idle.
+
+    Args:
+        min_delay (float): Delay in seconds used right after the screen changed.
+        max_delay (float): Upper bound the delay backs off to.
+        backoff (float): Factor the delay grows by after each idle poll.
+    """
+
+    def __init__(self, min_delay=0.1, max_delay=1.0, backoff=1.5):
+        self.min_delay = min_delay
+        self.max_delay = max_delay
+        self.backoff = backoff
+        self.delay = min_delay
+
+    def next_delay(self, changed):
+        """Returns the delay before the next poll, given whether this poll saw a change."""
+        if changed:
+            self.delay = self.min_delay
+        else:
+            self.delay = min(self.max_delay, self.delay * self.backoff)
+        return self.delay
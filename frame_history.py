@@ -0,0 +1,163 @@
+# Recent-frame ring buffer for failure forensics in tablet_mode.py.
+# A single screenshot taken after a step failed only shows the final state,
+# and taking it (capture + PNG encode) delays the exit. Instead every frame
+# the polling loops capture is kept, downscaled, in a memory-capped ring
+# buffer; on failure the buffer is written out on a background thread
+# together with the best score and position of each template in each frame.
+import collections
+import datetime
+import json
+import os
+import sys
+import threading
+
+import cv2
+import numpy as np
+
+HistoryFrame = collections.namedtuple("HistoryFrame", "clock wall_time image origin repeats")
+
+
+class FrameHistory:
+    """
+    Keeps the most recent frames as downscaled grayscale, up to max_bytes.
+
+    Consecutive identical frames (unchanged polls) are stored once with a
+    repeat count. The latest full-resolution frame is kept as well, so the
+    dump still includes a full-size picture of the moment of failure; it
+    counts toward max_bytes, and is dropped if it alone exceeds it.
+
+    Args:
+        max_bytes (int): Memory cap for the downscaled frames and the latest full one.
+        level (int): Pyramid level stored (1 = half size, so a quarter of the bytes).
+    """
+
+    def __init__(self, max_bytes=32 * 1024 * 1024, level=1):
+        self.max_bytes = max_bytes
+        self.level = level
+        self.frames = collections.deque()
+        self.bytes_used = 0
+        self.latest_full = None
+        self._lock = threading.Lock()
+
+    def record(self, frame, clock, changed=True):
+        """
+        Adds a captured frame.
+
+        Args:
+            frame (template_matcher.FramePyramid): The captured frame.
+            clock (float): Desktop clock time of the capture.
+            changed (bool): False if the caller already knows the frame equals
+                the previous one; it is then only counted as a repeat,
+                without being downscaled.
+        """
+        if not changed:
+            with self._lock:
+                if self.frames:
+                    self.frames[-1] = self.frames[-1]._replace(repeats=self.frames[-1].repeats + 1)
+                    return
+        image = frame.level(self.level)
+        if self.level == 0:
+            image = image.copy()  # Level 0 may be a reused capture buffer
+        full = frame.level(0)
+        with self._lock:
+            self.latest_full = full if full.nbytes <= self.max_bytes else None
+            if self.frames and np.array_equal(self.frames[-1].image, image):
+                self.frames[-1] = self.frames[-1]._replace(repeats=self.frames[-1].repeats + 1)
+            elif image.nbytes <= self.max_bytes:
+                self.frames.append(
+                    HistoryFrame(clock, datetime.datetime.now(), image, frame.origin, 1)
+                )
+                self.bytes_used += image.nbytes
+            self._evict()
+
+    def _evict(self):
+        """Drops the oldest frames until they and latest_full fit in max_bytes."""
+        latest_bytes = self.latest_full.nbytes if self.latest_full is not None else 0
+        while self.frames and self.bytes_used + latest_bytes > self.max_bytes:
+            self.bytes_used -= self.frames.popleft().image.nbytes
+
+    def clear(self):
+        with self._lock:
+            self.frames.clear()
+            self.bytes_used = 0
+            self.latest_full = None
+
+    def dump_async(self, directory, templates, on_done=None):
+        """
+        Writes the buffered frames and their template scores on a background thread.
+
+        The thread is not a daemon thread, so a process exiting right after
+        a failure still finishes the dump first.
+
+        Args:
+            directory (str): Created if needed; receives frame PNGs and index.json.
+            templates (dict): Template name -> full-resolution grayscale image,
+                scored against every frame.
+            on_done (callable): Called with the index path (or None on error).
+
+        Returns:
+            threading.Thread: The started writer thread.
+        """
+        with self._lock:
+            frames = list(self.frames)
+            latest_full = self.latest_full
+        thread = threading.Thread(
+            target=self._dump,
+            args=(directory, frames, latest_full, templates, on_done),
+            name="frame-history-dump",
+        )
+        thread.start()
+        return thread
+
+    def _dump(self, directory, frames, latest_full, templates, on_done):
+        index_path = None
+        try:
+            os.makedirs(directory, exist_ok=True)
+            factor = 2**self.level
+            scaled_templates = {
+                name: _downscale(image, self.level) for name, image in templates.items()
+            }
+            entries = []
+            for number, frame in enumerate(frames):
+                file_name = f"frame_{number:03d}.png"
+                cv2.imwrite(os.path.join(directory, file_name), frame.image)
+                best = {}
+                for name, template in scaled_templates.items():
+                    best[name] = _best_match(frame.image, template, factor, frame.origin)
+                entries.append(
+                    {
+                        "file": file_name,
+                        "clock": round(frame.clock, 3),
+                        "wall_time": frame.wall_time.isoformat(timespec="milliseconds"),
+                        "repeats": frame.repeats,
+                        "best_match": best,
+                    }
+                )
+            if latest_full is not None:
+                cv2.imwrite(os.path.join(directory, "final_full.png"), latest_full)
+            index_path = os.path.join(directory, "index.json")
+            with open(index_path, "w", encoding="utf-8") as f:
+                json.dump({"scale": 1 / factor, "frames": entries}, f, indent=2)
+        except Exception as e:
+            print(f"ERROR: Could not write frame history to {directory}: {e}", file=sys.stderr)
+        if on_done is not None:
+            on_done(index_path)
+
+
+def _downscale(image, level):
+    for _ in range(level):
+        image = cv2.pyrDown(image)
+    return image
+
+
+def _best_match(image, template, factor, origin):
+    """Best TM_CCOEFF_NORMED score of template in image, with its full-resolution position."""
+    if template.shape[0] > image.shape[0] or template.shape[1] > image.shape[1]:
+        return None
+    scores = cv2.matchTemplate(image, template, cv2.TM_CCOEFF_NORMED)
+    _, max_score, _, (x, y) = cv2.minMaxLoc(scores)
+    return {
+        "score": round(float(max_score), 4),
+        "left": origin[0] + x * factor,
+        "top": origin[1] + y * factor,
+    }
@@ -0,0 +1,140 @@
+# Persistent "where was this template last seen" cache for the template matcher.
+# The Windows and Lenovo logos almost always sit at the same spot, so the
+# matcher first searches a small region around the last hit and only falls
+# back to the whole screen when that misses.
+import json
+import os
+import sys
+import threading
+import time
+
+
+class LocationHintCache:
+    """
+    Remembers the last frame rectangle each template was found at.
+
+    Entries are keyed by template, screen rotation and frame resolution, so a
+    rotation or resolution change never reuses a stale position. An entry is
+    dropped when it is older than `max_age_seconds` or when its region has
+    missed `max_misses` times in a row.
+
+    Args:
+        path (str): JSON file the hints are persisted to. None keeps them in memory only.
+        max_age_seconds (float): Hints not confirmed within this time are discarded.
+        max_misses (int): Consecutive region misses before a hint is discarded.
+        refresh_seconds (float): A hit that changes nothing but the time it
+            was seen is written to the file only if the last write is at least
+            this old, so confirmed hints do not expire on disk.
+    """
+
+    VERSION = 2
+
+    def __init__(
+        self,
+        path=".template_hints.json",
+        max_age_seconds=7 * 24 * 3600,
+        max_misses=3,
+        refresh_seconds=3600,
+    ):
+        self.path = path
+        self.max_age_seconds = max_age_seconds
+        self.max_misses = max_misses
+        self.refresh_seconds = refresh_seconds
+        self._entries = {}
+        self._saved_at = 0.0  # time.time() of the last write
+        self._lock = threading.Lock()
+        self._load()
+
+    @staticmethod
+    def key(template, rotation, resolution):
+        width, height = resolution
+        return f"{template}|{rotation}|{width}x{height}"
+
+    def get(self, template, rotation, resolution):
+        """
+        Returns ((left, top, width, height), scale) for a template, or None.
+
+        scale is that of the template variant that matched there, or None if
+        it was not recorded.
+        """
+        key = self.key(template, rotation, resolution)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            if time.time() - entry["seen"] > self.max_age_seconds:
+                del self._entries[key]
+                self._save_locked()
+                return None
+            return tuple(entry["rect"]), entry.get("scale")
+
+    def record_hit(self, template, rotation, resolution, rect, scale=None):
+        """Stores the rectangle (and template variant scale) a template was just found at."""
+        key = self.key(template, rotation, resolution)
+        rect = [int(value) for value in rect]
+        now = time.time()
+        with self._lock:
+            previous = self._entries.get(key)
+            self._entries[key] = {
+                "rect": rect,
+                "scale": scale,
+                "seen": now,
+                "misses": 0,
+            }
+            # Rewrite the file when the position actually moved; the
+            # timestamp alone is only worth a disk write now and then.
+            if (
+                previous is None
+                or previous["rect"] != rect
+                or previous.get("scale") != scale
+                or previous["misses"]
+                or now - self._saved_at >= self.refresh_seconds
+            ):
+                self._save_locked()
+
+    def record_miss(self, template, rotation, resolution):
+        """Counts a miss in the hinted region, discarding the hint after max_misses."""
+        key = self.key(template, rotation, resolution)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return
+            entry["misses"] += 1
+            if entry["misses"] >= self.max_misses:
+                del self._entries[key]
+                self._save_locked()
+
+    def invalidate(self, template=None):
+        """Drops the hints for one template (any rotation/resolution), or all hints."""
+        with self._lock:
+            if template is None:
+                self._entries.clear()
+            else:
+                prefix = f"{template}|"
+                for key in [key for key in self._entries if key.startswith(prefix)]:
+                    del self._entries[key]
+            self._save_locked()
+
+    def _load(self):
+        if not self.path or not os.path.exists(self.path):
+            return
+        try:
+            with open(self.path, "r", encoding="utf-8") as f:
+                data = json.load(f)
+            if data.get("version") == self.VERSION:
+                self._entries = data.get("entries", {})
+        except (OSError, ValueError) as e:
+            # A corrupt hint file only costs full-screen searches; don't fail the run.
+            print(f"WARNING: Ignoring unreadable hint cache {self.path}: {e}", file=sys.stderr)
+
+    def _save_locked(self):
+        if not self.path:
+            return
+        self._saved_at = time.time()
+        tmp_path = f"{self.path}.tmp"
+        try:
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                json.dump({"version": self.VERSION, "entries": self._entries}, f)
+            os.replace(tmp_path, self.path)
+        except OSError as e:
+            print(f"WARNING: Could not save hint cache {self.path}: {e}", file=sys.stderr)
@@ -1,96 +1,175 @@
-import datetime
-import time
+import argparse
+import collections
 
 # --- ADD THESE IMPORTS ---
 try:
-    import win32gui
-    import win32ui
-    import win32con
-    import win32api
     from PIL import Image
-    PYWIN32_AVAILABLE = True
-except ImportError:
-    PYWIN32_AVAILABLE = False
-    print("ERROR: pywin32 or Pillow library is not installed. Cannot use pywin32 for screenshots.")
-    print("Please install them (e.g., pip install pywin32 Pillow) and try again.")
+    from frame_archive import FrameArchiveWriter
+    from capture_pipeline import CapturePipeline, DROP_OLDEST, DROP_POLICIES
+    from screen_capture import PIXEL_BGRX, PIXEL_FORMATS, PIXEL_GRAY, PIXEL_MONO, ScreenCapturer
+    from screen_capture import MonitorLayout, Win32CaptureBackend
+    from screenshot_index import DEFAULT_TEMPLATES, SOURCE_ARCHIVE, SOURCE_PNG
+    from screenshot_index import ScreenshotIndexWriter, gray_frame, png_name
+except ImportError as e:
+    print(f"ERROR: {e.name or e} is not installed. Cannot take screenshots.")
+    print("Please install numpy and Pillow (e.g., pip install numpy Pillow) and try again.")
     # Exit if essential libraries are missing for the core functionality
     import sys
     sys.exit(1)
 # --- END ADDED IMPORTS ---
 
 
-# --- ADD THIS NEW FUNCTION ---
-def capture_screen_with_pywin32(filename):
-    """
-    Captures the entire virtual screen using pywin32 and saves it to a file using Pillow.
-    """
-    # Get the dimensions of the virtual screen
-    left = win32api.GetSystemMetrics(win32con.SM_XVIRTUALSCREEN)
-    top = win32api.GetSystemMetrics(win32con.SM_YVIRTUALSCREEN)
-    width = win32api.GetSystemMetrics(win32con.SM_CXVIRTUALSCREEN)
-    height = win32api.GetSystemMetrics(win32con.SM_CYVIRTUALSCREEN)
-
-    # Get a handle to the desktop window and its device context (DC)
-    hdesktop = win32gui.GetDesktopWindow()
-    desktop_dc = win32gui.GetWindowDC(hdesktop)
-    img_dc = win32ui.CreateDCFromHandle(desktop_dc)
-
-    # Create a memory DC compatible with the screen DC
-    mem_dc = img_dc.CreateCompatibleDC()
-
-    # Create a bitmap object
-    screenshot = win32ui.CreateBitmap()
-    screenshot.CreateCompatibleBitmap(img_dc, width, height)
-    mem_dc.SelectObject(screenshot)
-
-    # Copy the screen into our memory DC
-    mem_dc.BitBlt((0, 0), (width, height), img_dc, (left, top), win32con.SRCCOPY)
-
-    # Get the bitmap bits
-    bmpinfo = screenshot.GetInfo()
-    bmpstr = screenshot.GetBitmapBits(True)
-
-    # Create a Pillow Image from the raw bitmap data
-    pil_image = Image.frombuffer(
-        'RGB',
-        (width, height),
-        bmpstr,
-        'raw',
-        'BGRX',
-        0,
-        1
+# A captured frame plus what is needed to decode it: 1-bit frames are packed
+# eight pixels per byte, so their pixel width is not the array width.
+CapturedFrame = collections.namedtuple("CapturedFrame", "pixels width pixel_format")
+
+
+def capture_frame(capturer):
+    """Captures one frame that stays valid after the next capture."""
+    pixels = capturer.capture()
+    if capturer.pixel_format != PIXEL_MONO:
+        pixels = pixels.copy()  # The capturer reuses its buffer; packed frames are already new
+    return CapturedFrame(pixels, capturer.size[0], capturer.pixel_format)
+
+
+def to_pil_image(frame):
+    """Wraps a CapturedFrame in a Pillow image (RGB, L or 1-bit), without copying where possible."""
+    height = frame.pixels.shape[0]
+    size = (frame.width, height)
+    if frame.pixel_format == PIXEL_BGRX:
+        return Image.frombuffer('RGB', size, frame.pixels, 'raw', 'BGRX', 0, 1)
+    if frame.pixel_format == PIXEL_GRAY:
+        return Image.fromarray(frame.pixels, 'L')
+    # Pillow's raw "1" layout is the same: rows of packed bits, MSB first, 1 = white.
+    return Image.frombuffer('1', size, frame.pixels.tobytes(), 'raw', '1', 0, 1)
+
+
+def save_frame_png(frame, timestamp):
+    """Encodes one CapturedFrame to screenshot_<timestamp>.png (1-bit frames as 1-bit PNGs)."""
+    to_pil_image(frame).save(png_name(timestamp))
+
+
+def archive_frame(archive, frame, timestamp):
+    """Appends one CapturedFrame to a FrameArchiveWriter (1-bit frames stay packed)."""
+    packed_width = frame.width if frame.pixel_format == PIXEL_MONO else None
+    return archive.append(frame.pixels, timestamp, packed_width=packed_width)
+
+
+def index_frame(index, frame, timestamp):
+    """Adds one CapturedFrame to a ScreenshotIndexWriter."""
+    index.add(gray_frame(frame.pixels, frame.pixel_format, frame.width), timestamp)
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Capture the screen periodically.")
+    parser.add_argument("--interval", type=float, default=5, help="Seconds between captures.")
+    parser.add_argument("--workers", type=int, default=2, help="PNG encoder threads.")
+    parser.add_argument("--queue-size", type=int, default=4, help="Frames waiting for an encoder.")
+    parser.add_argument(
+        "--drop-policy",
+        choices=DROP_POLICIES,
+        default=DROP_OLDEST,
+        help="What to do with a new frame when the encoder queue is full.",
     )
+    parser.add_argument(
+        "--report-every", type=int, default=12, help="Captures between stats lines (0: only at exit)."
+    )
+    parser.add_argument(
+        "--pixel-format",
+        choices=PIXEL_FORMATS,
+        default=PIXEL_BGRX,
+        help="Capture in color, 8-bit gray (1/4 the bytes) or thresholded 1-bit (1/32), "
+        "for the e-ink panel.",
+    )
+    parser.add_argument(
+        "--mono-threshold", type=int, default=128, help="Gray level from which a 1-bit pixel is white."
+    )
+    area = parser.add_mutually_exclusive_group()
+    area.add_argument(
+        "--monitor",
+        help='Capture only this monitor: "primary", its index ("0", "1", ...) or its device name.',
+    )
+    area.add_argument(
+        "--region",
+        type=int,
+        nargs=4,
+        metavar=("LEFT", "TOP", "WIDTH", "HEIGHT"),
+        help="Capture only this rectangle of the virtual screen.",
+    )
+    parser.add_argument(
+        "--archive",
+        metavar="PATH",
+        help="Append frames to a delta-encoded archive instead of writing one PNG per "
+        "capture (read it back with frame_archive.py). Uses a single encoder.",
+    )
+    parser.add_argument(
+        "--index",
+        metavar="PATH",
+        help="Also add every frame to a screenshot index (search it with screenshot_index.py).",
+    )
+    parser.add_argument(
+        "--index-templates",
+        nargs="*",
+        default=list(DEFAULT_TEMPLATES),
+        help="Templates scored per frame in the index.",
+    )
+    return parser.parse_args()
 
-    # Save the image
-    pil_image.save(filename)
 
-    # Clean up GDI objects
-    win32gui.DeleteObject(screenshot.GetHandle())
-    mem_dc.DeleteDC()
-    img_dc.DeleteDC()
-    win32gui.ReleaseDC(hdesktop, desktop_dc)
-# --- END NEW FUNCTION ---
+if __name__ == "__main__":
+    args = parse_args()
+    print(
+        f"Starting {args.pixel_format} screenshot capture every {args.interval}s (using GDI). "
+        "Press Ctrl+C to stop."
+    )
+    region = args.region
+    if args.monitor:
+        # The rectangle is looked up on every capture, so it follows display changes.
+        region = MonitorLayout(Win32CaptureBackend()).region(args.monitor)
+    # One capturer for the whole run: the GDI objects and frame buffer are reused
+    # across frames and only reallocated when the capture size changes.
+    capturer = ScreenCapturer(
+        pixel_format=args.pixel_format, mono_threshold=args.mono_threshold, region=region
+    )
+    archive = None
+    encode, workers = save_frame_png, args.workers
+    if args.archive:
+        # Each delta depends on the previous frame, so frames must be archived
+        # in order by a single worker.
+        archive = FrameArchiveWriter(args.archive)
+        encode, workers = (lambda frame, timestamp: archive_frame(archive, frame, timestamp)), 1
+    index = None
+    if args.index:
+        index = ScreenshotIndexWriter(
+            args.index,
+            args.index_templates,
+            source=SOURCE_ARCHIVE if args.archive else SOURCE_PNG,
+            archive_path=args.archive,
+        )
+        write_frame = encode
 
-print("Starting screenshot capture every 5s (using pywin32). Press Ctrl+C to stop.")
-try:
-    while True:
-        if not PYWIN32_AVAILABLE:
-            print("pywin32 or Pillow not available. Stopping.")
-            break
-            
-        filename = f"screenshot_{datetime.datetime.now().strftime('%Y%m%d_%H%M%S')}.png"
-        start_time = time.perf_counter()
-        
-        # --- MODIFIED: Call the new screenshot function ---
-        try:
-            capture_screen_with_pywin32(filename)
-            end_time = time.perf_counter()
-            duration_ms = (end_time - start_time) * 1000
-            print(f"Saved: {filename} (took {duration_ms:.2f} ms)")
-        except Exception as e:
-            print(f"Error capturing screenshot with pywin32: {e}")
-        # --- END MODIFICATION ---
-        
-        time.sleep(5)
-except KeyboardInterrupt:
-    print("\nScreenshot capture stopped.")
+        def encode(frame, timestamp):
+            write_frame(frame, timestamp)
+            index_frame(index, frame, timestamp)
+    pipeline = CapturePipeline(
+        # The capturer reuses its buffer, so queued frames must be copies.
+        capture=lambda: capture_frame(capturer),
+        encode=encode,
+        interval_seconds=args.interval,
+        queue_size=args.queue_size,
+        workers=workers,
+        drop_policy=args.drop_policy,
+        report_every=args.report_every,
+    )
+    try:
+        pipeline.run()
+    except KeyboardInterrupt:
+        print("\nScreenshot capture stopped.")
+    finally:
+        capturer.close()
+        if archive is not None:
+            archive.close()
+            print(f"Archive {args.archive}: {archive.summary()}")
+        if index is not None:
+            index.close()
+            print(f"Index {args.index}: {index.frames_added} frames added")
@@ -0,0 +1,537 @@
+# Long-lived screen capturer shared by mini_screenshot.py and the template matcher.
+# Creating the desktop DC, memory DC and bitmap on every frame, then copying
+# the bits out with GetBitmapBits, dominated per-frame cost. Here the GDI
+# objects live as long as the capturer, BitBlt writes straight into a DIB
+# section, and frames are NumPy views of that memory. A section replaced
+# after a display change is only deleted once no frame views it any more.
+#
+# The e-ink panel is effectively grayscale, so frames can also be handed out as
+# 8-bit gray (converted from the BGRX blit with BT.601 weights: a quarter of
+# the bytes to keep) or as thresholded 1-bit rows packed eight pixels per byte (1/32).
+# GDI is not asked to blit into a gray-palette DIB: it maps each color to the
+# nearest palette entry instead of computing luminance, and slowly.
+#
+# A capturer can also be limited to one monitor or rectangle: only that area
+# is blitted and held in memory, and several capturers (one per region) can
+# run concurrently since BitBlt releases the GIL.
+import collections
+import concurrent.futures
+import threading
+import weakref
+
+import numpy as np
+
+try:
+    import cv2
+except ImportError:
+    cv2 = None  # The gray conversion falls back to NumPy
+
+PIXEL_BGRX = "bgrx"  # (height, width, 4) blue, green, red, unused
+PIXEL_GRAY = "gray"  # (height, width) 8-bit luminance
+PIXEL_MONO = "mono"  # (height, ceil(width / 8)) packed bits, MSB = leftmost, 1 = white
+PIXEL_FORMATS = (PIXEL_BGRX, PIXEL_GRAY, PIXEL_MONO)
+
+
+# A display in virtual-screen coordinates. name is the device name on Windows
+# (e.g. "\\.\DISPLAY2"); primary marks the main display.
+Monitor = collections.namedtuple("Monitor", "name left top width height primary")
+
+
+def bgrx_to_gray(bgrx, out):
+    """Writes the BT.601 luminance of a (height, width, 4) BGRX (or 3-channel BGR) frame into out."""
+    if cv2 is not None:
+        code = cv2.COLOR_BGRA2GRAY if bgrx.shape[2] == 4 else cv2.COLOR_BGR2GRAY
+        cv2.cvtColor(bgrx, code, dst=out)
+        return out
+    # Same weights as cv2.COLOR_BGRA2GRAY, in 8.8 fixed point.
+    weighted = bgrx[:, :, 0] * np.uint16(29)
+    weighted += bgrx[:, :, 1] * np.uint16(150)
+    weighted += bgrx[:, :, 2] * np.uint16(77)
+    weighted += 128
+    np.right_shift(weighted, 8, out=out, casting="unsafe")
+    return out
+
+
+def pack_mono(gray, threshold=128):
+    """Thresholds an 8-bit frame (pixels >= threshold are white) and packs it 8 pixels per byte."""
+    return np.packbits(gray >= threshold, axis=1)
+
+
+def unpack_mono(packed, width):
+    """Expands packed 1-bit rows back to an 8-bit (height, width) frame of 0 and 255."""
+    bits = np.unpackbits(packed, axis=1, count=width)
+    bits *= 255
+    return bits
+
+
+class CaptureBackend:
+    """
+    Interface for the platform side of ScreenCapturer.
+
+    screen_rect() returns (left, top, width, height) of the area to capture,
+    allocate(width, height, pixel_format) returns the uint8 array the backend
+    will write frames into - (height, width, 4) BGRX for PIXEL_BGRX, or
+    (height, width) for PIXEL_GRAY - and capture_into(left, top, width, height)
+    fills that array with the current screen contents. monitors() lists the
+    displays making up the virtual screen.
+    """
+
+    def screen_rect(self):
+        raise NotImplementedError
+
+    def monitors(self):
+        left, top, width, height = self.screen_rect()
+        return [Monitor("screen", left, top, width, height, True)]
+
+    def allocate(self, width, height, pixel_format=PIXEL_BGRX):
+        raise NotImplementedError
+
+    def capture_into(self, left, top, width, height):
+        raise NotImplementedError
+
+    def close(self):
+        pass
+
+
+class SyntheticCaptureBackend(CaptureBackend):
+    """
+    Generates frames in memory, for exercising capture consumers without a screen.
+
+    Args:
+        width, height (int): Size of the synthetic virtual screen; change it
+            later with resize() to simulate a display change.
+        render (callable): render(frame_index, buffer, left, top) paints the
+            area of the virtual screen starting at (left, top) into the
+            (height, width, 4) buffer. Defaults to a grey background with a
+            moving white bar, so consecutive frames differ.
+        monitors (list of Monitor): Display layout; one monitor covering the
+            whole screen by default.
+
+    `allocations` counts the frame buffers allocated and `released` those
+    freed again; like Win32CaptureBackend's DIB sections, a replaced buffer
+    is only freed once no frame views it.
+    """
+
+    def __init__(self, width=1920, height=1080, render=None, monitors=None):
+        self.width = width
+        self.height = height
+        self.render = render or self._moving_bar
+        self.monitor_list = monitors
+        self.frame_index = 0
+        self.allocations = 0
+        self.released = 0
+        self._buffer = None
+        self._bgrx = None
+
+    def resize(self, width, height):
+        self.width = width
+        self.height = height
+
+    def screen_rect(self):
+        return 0, 0, self.width, self.height
+
+    def monitors(self):
+        return list(self.monitor_list) if self.monitor_list else super().monitors()
+
+    def allocate(self, width, height, pixel_format=PIXEL_BGRX):
+        self.allocations += 1
+        self._bgrx = np.zeros((height, width, 4), dtype=np.uint8)
+        weakref.finalize(self._bgrx, self._count_release)
+        if pixel_format == PIXEL_GRAY:
+            self._buffer = np.zeros((height, width), dtype=np.uint8)
+        else:
+            self._buffer = self._bgrx
+        return self._buffer
+
+    def capture_into(self, left, top, width, height):
+        self.render(self.frame_index, self._bgrx, left, top)
+        if self._buffer is not self._bgrx:
+            bgrx_to_gray(self._bgrx, self._buffer)
+        self.frame_index += 1
+
+    def _count_release(self):
+        self.released += 1
+
+    def _moving_bar(self, frame_index, buffer, left, top):
+        buffer[...] = 128
+        bar_width = max(1, self.width // 20)
+        x = (frame_index * bar_width) % self.width - left  # Bar position on the virtual screen
+        buffer[:, max(0, x) : max(0, x + bar_width), :3] = 255
+
+
+class Win32CaptureBackend(CaptureBackend):
+    """
+    Captures the Windows virtual screen with BitBlt into a top-down DIB section.
+
+    ctypes is used instead of win32ui because CreateDIBSection's pixel memory
+    can then be wrapped by NumPy directly, with no GetBitmapBits copy.
+    PIXEL_GRAY still blits into a 32-bit DIB and converts each frame with
+    bgrx_to_gray() into a separate buffer.
+
+    BGRX frames are views of the section's memory, so allocate() does not
+    delete the section it replaces: that happens once the last array
+    viewing it has been garbage collected.
+    """
+
+    SM_XVIRTUALSCREEN = 76
+    SM_YVIRTUALSCREEN = 77
+    SM_CXVIRTUALSCREEN = 78
+    SM_CYVIRTUALSCREEN = 79
+    SRCCOPY = 0x00CC0020
+    DIB_RGB_COLORS = 0
+    BI_RGB = 0
+    MONITORINFOF_PRIMARY = 1
+
+    def __init__(self):
+        import ctypes
+        from ctypes import wintypes
+
+        class BITMAPINFOHEADER(ctypes.Structure):
+            _fields_ = [
+                ("biSize", wintypes.DWORD),
+                ("biWidth", wintypes.LONG),
+                ("biHeight", wintypes.LONG),
+                ("biPlanes", wintypes.WORD),
+                ("biBitCount", wintypes.WORD),
+                ("biCompression", wintypes.DWORD),
+                ("biSizeImage", wintypes.DWORD),
+                ("biXPelsPerMeter", wintypes.LONG),
+                ("biYPelsPerMeter", wintypes.LONG),
+                ("biClrUsed", wintypes.DWORD),
+                ("biClrImportant", wintypes.DWORD),
+            ]
+
+        class BITMAPINFO(ctypes.Structure):
+            # bmiColors is unused by 32-bit DIBs.
+            _fields_ = [("bmiHeader", BITMAPINFOHEADER), ("bmiColors", wintypes.DWORD * 1)]
+
+        class MONITORINFOEXW(ctypes.Structure):
+            _fields_ = [
+                ("cbSize", wintypes.DWORD),
+                ("rcMonitor", wintypes.RECT),
+                ("rcWork", wintypes.RECT),
+                ("dwFlags", wintypes.DWORD),
+                ("szDevice", wintypes.WCHAR * 32),
+            ]
+
+        self._ctypes = ctypes
+        self._BITMAPINFO = BITMAPINFO
+        self._MONITORINFOEXW = MONITORINFOEXW
+        self._user32 = ctypes.windll.user32
+        self._gdi32 = ctypes.windll.gdi32
+
+        # Handles are pointer-sized; without these ctypes truncates them on 64-bit.
+        handle = ctypes.c_void_p
+        self._user32.GetDC.restype = handle
+        self._user32.GetDC.argtypes = [handle]
+        self._user32.ReleaseDC.argtypes = [handle, handle]
+        self._gdi32.CreateCompatibleDC.restype = handle
+        self._gdi32.CreateCompatibleDC.argtypes = [handle]
+        self._gdi32.CreateDIBSection.restype = handle
+        self._gdi32.CreateDIBSection.argtypes = [
+            handle,
+            ctypes.c_void_p,
+            wintypes.UINT,
+            ctypes.POINTER(ctypes.c_void_p),
+            handle,
+            wintypes.DWORD,
+        ]
+        self._gdi32.SelectObject.restype = handle
+        self._gdi32.SelectObject.argtypes = [handle, handle]
+        self._gdi32.DeleteObject.argtypes = [handle]
+        self._gdi32.DeleteDC.argtypes = [handle]
+        self._gdi32.BitBlt.argtypes = [
+            handle,
+            ctypes.c_int,
+            ctypes.c_int,
+            ctypes.c_int,
+            ctypes.c_int,
+            handle,
+            ctypes.c_int,
+            ctypes.c_int,
+            wintypes.DWORD,
+        ]
+        self._MONITORENUMPROC = ctypes.WINFUNCTYPE(
+            wintypes.BOOL, handle, handle, ctypes.POINTER(wintypes.RECT), wintypes.LPARAM
+        )
+        self._user32.EnumDisplayMonitors.argtypes = [
+            handle,
+            ctypes.c_void_p,
+            self._MONITORENUMPROC,
+            wintypes.LPARAM,
+        ]
+        self._user32.GetMonitorInfoW.argtypes = [handle, ctypes.c_void_p]
+
+        self._screen_dc = self._user32.GetDC(None)
+        self._mem_dc = self._gdi32.CreateCompatibleDC(self._screen_dc)
+        self._bitmap = None
+        self._previous_bitmap = None
+        self._bgrx = None
+        self._gray = None  # Conversion target for PIXEL_GRAY, else None
+
+    def screen_rect(self):
+        metric = self._user32.GetSystemMetrics
+        return (
+            metric(self.SM_XVIRTUALSCREEN),
+            metric(self.SM_YVIRTUALSCREEN),
+            metric(self.SM_CXVIRTUALSCREEN),
+            metric(self.SM_CYVIRTUALSCREEN),
+        )
+
+    def monitors(self):
+        found = []
+
+        def on_monitor(monitor, dc, rect, data):
+            info = self._MONITORINFOEXW()
+            info.cbSize = self._ctypes.sizeof(info)
+            if self._user32.GetMonitorInfoW(monitor, self._ctypes.byref(info)):
+                bounds = info.rcMonitor
+                found.append(
+                    Monitor(
+                        info.szDevice,
+                        bounds.left,
+                        bounds.top,
+                        bounds.right - bounds.left,
+                        bounds.bottom - bounds.top,
+                        bool(info.dwFlags & self.MONITORINFOF_PRIMARY),
+                    )
+                )
+            return True
+
+        callback = self._MONITORENUMPROC(on_monitor)  # Must stay referenced during the call
+        self._user32.EnumDisplayMonitors(None, None, callback, 0)
+        return found or super().monitors()
+
+    def allocate(self, width, height, pixel_format=PIXEL_BGRX):
+        self._release_bitmap()
+        info = self._BITMAPINFO()
+        header = info.bmiHeader
+        header.biSize = self._ctypes.sizeof(header)
+        header.biWidth = width
+        header.biHeight = -height  # Negative height = top-down rows, like NumPy
+        header.biPlanes = 1
+        header.biBitCount = 32
+        header.biCompression = self.BI_RGB
+
+        bits = self._ctypes.c_void_p()
+        self._bitmap = self._gdi32.CreateDIBSection(
+            self._screen_dc,
+            self._ctypes.byref(info),
+            self.DIB_RGB_COLORS,
+            self._ctypes.byref(bits),
+            None,
+            0,
+        )
+        if not self._bitmap or not bits.value:
+            raise OSError(f"CreateDIBSection failed for {width}x{height}")
+        self._previous_bitmap = self._gdi32.SelectObject(self._mem_dc, self._bitmap)
+
+        pixels = (self._ctypes.c_ubyte * (width * height * 4)).from_address(bits.value)
+        # Every frame handed out is a view of `section`; deleting the bitmap
+        # waits until the last of them is gone.
+        section = np.frombuffer(pixels, dtype=np.uint8)
+        weakref.finalize(section, self._gdi32.DeleteObject, self._bitmap)
+        self._bgrx = section.reshape(height, width, 4)
+        if pixel_format == PIXEL_GRAY:
+            self._gray = np.empty((height, width), dtype=np.uint8)
+            return self._gray
+        self._gray = None
+        return self._bgrx
+
+    def capture_into(self, left, top, width, height):
+        if not self._gdi32.BitBlt(
+            self._mem_dc, 0, 0, width, height, self._screen_dc, left, top, self.SRCCOPY
+        ):
+            raise OSError("BitBlt failed")
+        self._gdi32.GdiFlush()  # Make sure the DIB memory is up to date before reading it
+        if self._gray is not None:
+            bgrx_to_gray(self._bgrx, self._gray)
+
+    def close(self):
+        self._release_bitmap()
+        if self._mem_dc:
+            self._gdi32.DeleteDC(self._mem_dc)
+            self._mem_dc = None
+        if self._screen_dc:
+            self._user32.ReleaseDC(None, self._screen_dc)
+            self._screen_dc = None
+
+    def _release_bitmap(self):
+        if self._bitmap:
+            # Deleted by the finalizer set in allocate(), once no frame views it.
+            self._gdi32.SelectObject(self._mem_dc, self._previous_bitmap)
+            self._bitmap = None
+            self._bgrx = None
+            self._gray = None
+
+
+class ScreenCapturer:
+    """
+    Captures the screen repeatedly while reusing one frame buffer.
+
+    capture() returns a view of the backend's buffer in pixel_format: a
+    (height, width, 4) BGRX or a (height, width) gray array. The next
+    capture() of the same size overwrites it, so copy the array if its
+    contents must outlive the next call. The buffer is only reallocated when
+    the capture size changes; the old one then stays valid, holding the last
+    frame captured into it, for as long as any array views it. PIXEL_MONO
+    frames are captured gray, then thresholded and packed into a new
+    (height, ceil(width / 8)) array; `size` holds their pixel width.
+
+    With a region only that rectangle of the virtual screen (clipped to it)
+    is copied, and `origin` holds its top-left corner.
+
+    Args:
+        backend (CaptureBackend): Platform backend; defaults to Win32CaptureBackend.
+        pixel_format (str): PIXEL_BGRX, PIXEL_GRAY or PIXEL_MONO.
+        mono_threshold (int): Gray level from which a PIXEL_MONO pixel is white.
+        region: (left, top, width, height) in virtual-screen coordinates, or
+            a callable returning one (e.g. MonitorLayout.region("primary"),
+            which follows display changes). None captures the whole screen.
+    """
+
+    def __init__(self, backend=None, pixel_format=PIXEL_BGRX, mono_threshold=128, region=None):
+        if pixel_format not in PIXEL_FORMATS:
+            raise ValueError(f"Unknown pixel format {pixel_format!r}; expected one of {PIXEL_FORMATS}")
+        self.backend = backend or Win32CaptureBackend()
+        self.pixel_format = pixel_format
+        self.mono_threshold = mono_threshold
+        self.region = region
+        self.origin = (0, 0)
+        self.size = None
+        self._frame = None
+
+    def capture(self, region=None):
+        """
+        Captures one frame.
+
+        Args:
+            region: Overrides the capturer's region for this call. Alternating
+                between regions of different sizes reallocates the buffer each
+                time; use one capturer per region instead.
+        """
+        if region is None:
+            region = self.region
+        left, top, width, height = self._capture_rect(region)
+        if self.size != (width, height):
+            backend_format = PIXEL_BGRX if self.pixel_format == PIXEL_BGRX else PIXEL_GRAY
+            self._frame = self.backend.allocate(width, height, backend_format)
+            self.size = (width, height)
+        self.origin = (left, top)
+        self.backend.capture_into(left, top, width, height)
+        if self.pixel_format == PIXEL_MONO:
+            return pack_mono(self._frame, self.mono_threshold)
+        return self._frame
+
+    def _capture_rect(self, region):
+        screen = self.backend.screen_rect()
+        if region is None:
+            return screen
+        if callable(region):
+            region = region()
+        clipped = intersect_rects(region, screen)
+        if clipped is None:
+            raise ValueError(f"Capture region {tuple(region)} lies outside the screen {screen}")
+        return clipped
+
+    def close(self):
+        self.backend.close()
+        self._frame = None
+        self.size = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+
+def intersect_rects(a, b):
+    """Intersection of two (left, top, width, height) rectangles, or None if disjoint."""
+    left = max(a[0], b[0])
+    top = max(a[1], b[1])
+    right = min(a[0] + a[2], b[0] + b[2])
+    bottom = min(a[1] + a[3], b[1] + b[3])
+    if right <= left or bottom <= top:
+        return None
+    return left, top, right - left, bottom - top
+
+
+def capture_regions(capturers, executor=None):
+    """
+    Captures with several region capturers at once.
+
+    Each capturer must have its own backend (its own DC and DIB). The blits
+    overlap because ctypes releases the GIL around the GDI calls.
+
+    Args:
+        capturers (list of ScreenCapturer): One per region; read each frame's
+            position from the capturer's origin afterwards.
+        executor (concurrent.futures.Executor): Runs the captures; a
+            temporary thread pool by default.
+
+    Returns:
+        list: The frames, in capturer order.
+    """
+    if len(capturers) < 2 and executor is None:
+        return [capturer.capture() for capturer in capturers]
+    if executor is not None:
+        return list(executor.map(lambda capturer: capturer.capture(), capturers))
+    with concurrent.futures.ThreadPoolExecutor(len(capturers), "region-capture") as pool:
+        return list(pool.map(lambda capturer: capturer.capture(), capturers))
+
+
+class MonitorLayout:
+    """
+    The monitors of the virtual screen by name, cached between display changes.
+
+    Enumerating monitors is too slow to repeat on every capture, so the list
+    is kept until invalidate() is called (see window_events.DisplayChangeWatcher)
+    or the virtual screen rectangle changes, which also catches layout
+    changes made while nothing was watching.
+
+    A monitor is named by its device name (e.g. "\\\\.\\DISPLAY2"), by
+    "primary", or by its position in the enumeration ("0", "1", ...).
+
+    Args:
+        backend (CaptureBackend): Enumerates the monitors.
+    """
+
+    def __init__(self, backend):
+        self.backend = backend
+        self._monitors = None
+        self._screen = None
+        self._lock = threading.Lock()
+
+    def invalidate(self):
+        with self._lock:
+            self._monitors = None
+
+    def monitors(self):
+        screen = self.backend.screen_rect()
+        with self._lock:
+            if self._monitors is None or screen != self._screen:
+                self._monitors = self.backend.monitors()
+                self._screen = screen
+            return list(self._monitors)
+
+    def find(self, name):
+        """Returns the Monitor called name; raises KeyError if there is none."""
+        monitors = self.monitors()
+        for index, monitor in enumerate(monitors):
+            if (
+                name == monitor.name
+                or (name == "primary" and monitor.primary)
+                or name == str(index)
+            ):
+                return monitor
+        names = ", ".join(monitor.name for monitor in monitors)
+        raise KeyError(f"No monitor named {name!r} (monitors: {names})")
+
+    def rect(self, name):
+        monitor = self.find(name)
+        return monitor.left, monitor.top, monitor.width, monitor.height
+
+    def region(self, name):
+        """Returns a ScreenCapturer region that tracks the named monitor across display changes."""
+        return lambda: self.rect(name)
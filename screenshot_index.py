@@ -0,0 +1,497 @@
+# Perceptual-hash index over the screenshot history of mini_screenshot.py.
+# Finding out when something appeared on screen used to mean opening days of
+# screenshot_*.png files one by one. The index stores, per captured frame, a
+# perceptual hash (a 16x16 difference hash) and the best match score and
+# position of each tablet_mode template, so questions like "frames where
+# windows-logo.png was visible" or "first frame differing from T" are answered
+# from the index alone, without decoding any image.
+#
+# mini_screenshot.py --index PATH adds frames as they are written; "build"
+# back-fills an index from existing PNGs or a frame_archive.py archive. One
+# writer at a time: it holds a lock on INDEX.lock while the index is open.
+#
+# File layout: MAGIC, header length (uint32), JSON header (hash size,
+# templates, frame source), then fixed-size records (see record_dtype()). Fixed
+# records let the reader map the whole file as one NumPy array and answer
+# queries with vectorized comparisons.
+#
+# Usage:
+#   python screenshot_index.py build INDEX (--png-dir DIR | --archive ARCHIVE) [--templates ..]
+#   python screenshot_index.py visible INDEX TEMPLATE [--min-score 0.8]
+#   python screenshot_index.py first-diff INDEX YYYYmmdd_HHMMSS [--max-distance 12]
+#   python screenshot_index.py info INDEX
+import argparse
+import bisect
+import datetime
+import glob
+import json
+import os
+import struct
+import sys
+import threading
+import time
+
+import numpy as np
+
+from screen_capture import PIXEL_BGRX, PIXEL_MONO, bgrx_to_gray, unpack_mono
+
+try:
+    import cv2
+except ImportError:
+    cv2 = None  # Hashes only; template scores need OpenCV
+
+MAGIC = b"EINKIDX1"
+HEADER_LENGTH = struct.Struct("<I")
+VERSION = 1
+HASH_SIZE = 16  # Difference hash of HASH_SIZE x HASH_SIZE bits
+MATCH_SCALE = 0.5  # Templates are scored on half-size frames
+TIMESTAMP_FORMAT = "%Y%m%d_%H%M%S"
+# mini_screenshot.py PNG names; the microseconds keep captures less than a
+# second apart from overwriting each other. Older names have no fraction.
+PNG_NAME_FORMAT = "screenshot_%Y%m%d_%H%M%S_%f.png"
+OLD_PNG_NAME_FORMAT = "screenshot_%Y%m%d_%H%M%S.png"
+# tablet_mode.TEMPLATE_IMAGES. Not imported from there: this module has to
+# work without OpenCV (hashes only), and tablet_mode cannot be imported without it.
+DEFAULT_TEMPLATES = ("switch-to-tablet.png", "lenovo.logo.png", "rotate.png", "windows-logo.png")
+SOURCE_PNG = "png"  # Frames are screenshot_<timestamp>.png files
+SOURCE_ARCHIVE = "archive"  # Frames are in a frame_archive.py archive
+
+
+def record_dtype(hash_size, template_count):
+    """
+    NumPy dtype of one index record: capture time, hash words, and per
+    template the best score (0-255 for 0.0-1.0) and its top-left position.
+    """
+    return np.dtype(
+        [
+            ("timestamp", "<f8"),
+            ("hash", "<u8", (hash_size * hash_size // 64,)),
+            ("score", "u1", (template_count,)),
+            ("x", "<u2", (template_count,)),
+            ("y", "<u2", (template_count,)),
+        ]
+    )
+
+
+def gray_frame(pixels, pixel_format, width=None):
+    """Converts a captured frame (screen_capture pixel format) to 8-bit gray."""
+    if pixel_format == PIXEL_BGRX:
+        return bgrx_to_gray(pixels, np.empty(pixels.shape[:2], dtype=np.uint8))
+    if pixel_format == PIXEL_MONO:
+        return unpack_mono(pixels, width)
+    return pixels
+
+
+def difference_hash(gray, hash_size=HASH_SIZE):
+    """
+    Returns the difference hash of a gray frame as uint64 words.
+
+    The frame is area-averaged down to hash_size rows of hash_size + 1
+    cells, and each bit says whether a cell is brighter than its right
+    neighbour. Small changes (a dialog, a moved logo) flip a few bits;
+    unrelated screens differ in about half of them.
+    """
+    height, width = gray.shape[:2]
+    row_edges = np.linspace(0, height, hash_size + 1).astype(int)[:-1]
+    col_edges = np.linspace(0, width, hash_size + 2).astype(int)[:-1]
+    row_sums = np.add.reduceat(gray, row_edges, axis=0, dtype=np.uint64)
+    sums = np.add.reduceat(row_sums, col_edges, axis=1)
+    counts = np.outer(np.diff(row_edges, append=height), np.diff(col_edges, append=width))
+    cells = sums / counts
+    bits = cells[:, 1:] > cells[:, :-1]
+    return np.packbits(bits.ravel()).view(">u8").astype("<u8")
+
+
+def hamming_distances(hashes, reference):
+    """Number of differing bits between each row of hashes and one reference hash."""
+    flipped = np.bitwise_xor(hashes, reference)
+    if hasattr(np, "bitwise_count"):  # NumPy 2.0+
+        return np.bitwise_count(flipped).sum(axis=-1, dtype=np.int64)
+    return np.unpackbits(flipped.view(np.uint8), axis=-1).sum(axis=-1, dtype=np.int64)
+
+
+def _read_header(f, path):
+    if f.read(len(MAGIC)) != MAGIC:
+        raise ValueError(f"{path} is not a screenshot index")
+    (length,) = HEADER_LENGTH.unpack(f.read(HEADER_LENGTH.size))
+    header = json.loads(f.read(length).decode("utf-8"))
+    if header.get("version") != VERSION:
+        raise ValueError(f"{path} has unsupported index version {header.get('version')}")
+    return header, f.tell()
+
+
+def _lock_for_writing(path):
+    """
+    Takes an exclusive lock on PATH.lock, held until the returned file is closed.
+
+    The index itself is not locked, so readers can keep mapping it.
+
+    Raises:
+        RuntimeError: If another writer already holds the lock.
+    """
+    lock_file = open(f"{path}.lock", "a+b")
+    try:
+        if os.name == "nt":
+            import msvcrt
+
+            lock_file.seek(0)
+            msvcrt.locking(lock_file.fileno(), msvcrt.LK_NBLCK, 1)
+        else:
+            import fcntl
+
+            fcntl.flock(lock_file.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except OSError:
+        lock_file.close()
+        raise RuntimeError(f"{path} is already being written by another process") from None
+    return lock_file
+
+
+class ScreenshotIndexWriter:
+    """
+    Appends frames to a screenshot index.
+
+    add() may be called from several encoder threads; the hashing and
+    matching run outside the file lock. An existing index is appended to,
+    which requires the same templates and hash size it was created with.
+    Only one writer may have an index open at a time: a second one would
+    truncate the first one's partly written record, or interleave with it.
+
+    Args:
+        path (str): Index file.
+        templates (iterable of str): Template PNGs scored against every frame.
+            Ignored (hashes only) if OpenCV is not installed.
+        source (str): SOURCE_PNG or SOURCE_ARCHIVE, telling the query tool
+            how to name the frames it finds.
+        archive_path (str): The archive the frames are stored in, for SOURCE_ARCHIVE.
+        hash_size (int): Difference hash size; a multiple of 8.
+    """
+
+    def __init__(
+        self,
+        path,
+        templates=DEFAULT_TEMPLATES,
+        source=SOURCE_PNG,
+        archive_path=None,
+        hash_size=HASH_SIZE,
+    ):
+        templates = list(templates)
+        if templates and cv2 is None:
+            print("WARNING: OpenCV is not installed; indexing hashes only.", file=sys.stderr)
+            templates = []
+        self.path = path
+        self.frames_added = 0
+        self._lock = threading.Lock()
+        header = {
+            "version": VERSION,
+            "hash_size": hash_size,
+            "templates": templates,
+            "source": source,
+            "archive": os.path.abspath(archive_path) if archive_path else None,
+        }
+        self._write_lock = _lock_for_writing(path)
+        try:
+            self._open(path, header)
+        except BaseException:
+            self._write_lock.close()
+            raise
+        self._scaled_templates = [self._load_template(name) for name in self.templates]
+
+    def _open(self, path, header):
+        if os.path.exists(path) and os.path.getsize(path) > 0:
+            with open(path, "rb") as f:
+                existing, data_offset = _read_header(f, path)
+            for key in ("hash_size", "templates", "source"):
+                if existing[key] != header[key]:
+                    raise ValueError(
+                        f"{path} was created with {key}={existing[key]!r}, not {header[key]!r}; "
+                        "use a new index file"
+                    )
+            header = existing
+            self._file = open(path, "r+b")
+            self.dtype = record_dtype(header["hash_size"], len(header["templates"]))
+            # Drop a record cut short by a crash, so appended records stay aligned.
+            count = (os.path.getsize(path) - data_offset) // self.dtype.itemsize
+            self._file.truncate(data_offset + count * self.dtype.itemsize)
+            self._file.seek(0, os.SEEK_END)
+        else:
+            self._file = open(path, "wb")
+            encoded = json.dumps(header).encode("utf-8")
+            self._file.write(MAGIC + HEADER_LENGTH.pack(len(encoded)) + encoded)
+            self._file.flush()
+            self.dtype = record_dtype(header["hash_size"], len(header["templates"]))
+        self.hash_size = header["hash_size"]
+        self.templates = header["templates"]
+
+    @staticmethod
+    def _load_template(name):
+        image = cv2.imread(name, cv2.IMREAD_GRAYSCALE)
+        if image is None:
+            raise FileNotFoundError(f"Could not read template image: {name}")
+        return cv2.resize(image, None, fx=MATCH_SCALE, fy=MATCH_SCALE, interpolation=cv2.INTER_AREA)
+
+    def add(self, gray, timestamp):
+        """
+        Indexes one frame.
+
+        Args:
+            gray (np.ndarray): The frame as 8-bit gray (see gray_frame()).
+            timestamp (datetime.datetime): Capture time.
+        """
+        record = np.zeros(1, dtype=self.dtype)
+        record["timestamp"] = timestamp.timestamp()
+        record["hash"] = difference_hash(gray, self.hash_size)
+        if self._scaled_templates:
+            small = cv2.resize(
+                gray, None, fx=MATCH_SCALE, fy=MATCH_SCALE, interpolation=cv2.INTER_AREA
+            )
+            for number, template in enumerate(self._scaled_templates):
+                if template.shape[0] > small.shape[0] or template.shape[1] > small.shape[1]:
+                    continue
+                scores = cv2.matchTemplate(small, template, cv2.TM_CCOEFF_NORMED)
+                _, max_score, _, (x, y) = cv2.minMaxLoc(scores)
+                record["score"][0, number] = round(min(max(max_score, 0.0), 1.0) * 255)
+                record["x"][0, number] = round(x / MATCH_SCALE)
+                record["y"][0, number] = round(y / MATCH_SCALE)
+        with self._lock:
+            self._file.write(record.tobytes())
+            self._file.flush()  # Queries can run while frames are being added
+            self.frames_added += 1
+
+    def close(self):
+        self._file.close()
+        self._write_lock.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+
+class ScreenshotIndex:
+    """
+    Read-only view of a screenshot index, sorted by capture time.
+
+    The records are memory-mapped; queries are vectorized over all of them,
+    so tens of thousands of frames take milliseconds.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        with open(path, "rb") as f:
+            header, data_offset = _read_header(f, path)
+        self.hash_size = header["hash_size"]
+        self.templates = header["templates"]
+        self.source = header["source"]
+        self.archive = header.get("archive")
+        dtype = record_dtype(self.hash_size, len(self.templates))
+        count = (os.path.getsize(path) - data_offset) // dtype.itemsize
+        if count:
+            records = np.memmap(path, dtype=dtype, mode="r", offset=data_offset, shape=(count,))
+        else:
+            records = np.zeros(0, dtype=dtype)
+        # Encoder threads may finish frames out of order.
+        order = np.argsort(records["timestamp"], kind="stable")
+        self.timestamps = records["timestamp"][order]
+        self.hashes = records["hash"][order]
+        self.scores = records["score"][order]
+        self.x = records["x"][order]
+        self.y = records["y"][order]
+
+    def __len__(self):
+        return len(self.timestamps)
+
+    def template_column(self, template):
+        """Returns the score column of a template, matched by path or file name."""
+        for number, name in enumerate(self.templates):
+            if template in (name, os.path.basename(name)):
+                return number
+        raise KeyError(f"{template} is not indexed (templates: {', '.join(self.templates)})")
+
+    def visible(self, template, min_score=0.8):
+        """Returns the indices of the frames where a template scored at least min_score."""
+        column = self.template_column(template)
+        return np.flatnonzero(self.scores[:, column] >= round(min_score * 255))
+
+    def index_at(self, timestamp):
+        """Index of the last frame captured at or before timestamp; raises KeyError if none."""
+        index = bisect.bisect_right(self.timestamps, timestamp.timestamp()) - 1
+        if index < 0:
+            raise KeyError(f"No indexed frame at or before {timestamp}")
+        return index
+
+    def first_difference(self, timestamp, max_distance=12):
+        """
+        Returns the index of the first frame after the one on screen at
+        timestamp whose hash differs from it in more than max_distance bits,
+        or None if the screen never changed that much afterwards.
+        """
+        start = self.index_at(timestamp)
+        distances = hamming_distances(self.hashes[start + 1 :], self.hashes[start])
+        changed = np.flatnonzero(distances > max_distance)
+        return start + 1 + int(changed[0]) if len(changed) else None
+
+    def distance(self, a, b):
+        return int(hamming_distances(self.hashes[a], self.hashes[b]))
+
+    def capture_time(self, index):
+        return datetime.datetime.fromtimestamp(self.timestamps[index])
+
+    def frame_name(self, index):
+        """Where to find a frame: its PNG file name, or the archive timestamp to extract."""
+        when = self.capture_time(index)
+        if self.source == SOURCE_ARCHIVE:
+            return f"{self.archive} @ {when.strftime(TIMESTAMP_FORMAT)}"
+        return png_name(when)
+
+
+def runs(indices):
+    """Groups sorted frame indices into (first, last) runs of consecutive frames."""
+    if len(indices) == 0:
+        return []
+    breaks = np.flatnonzero(np.diff(indices) != 1)
+    starts = np.concatenate(([indices[0]], indices[breaks + 1]))
+    ends = np.concatenate((indices[breaks], [indices[-1]]))
+    return list(zip(starts.tolist(), ends.tolist()))
+
+
+# --- Back-filling ---
+
+
+def png_name(timestamp):
+    """File name mini_screenshot.py saves a frame captured at timestamp under."""
+    if timestamp.microsecond == 0:
+        # Also the time parsed from a name without a fraction.
+        return timestamp.strftime(OLD_PNG_NAME_FORMAT)
+    return timestamp.strftime(PNG_NAME_FORMAT)
+
+
+def parse_png_name(name):
+    """Capture time of a screenshot PNG file name, or None if it is not one."""
+    for name_format in (PNG_NAME_FORMAT, OLD_PNG_NAME_FORMAT):
+        try:
+            return datetime.datetime.strptime(name, name_format)
+        except ValueError:
+            pass
+    return None
+
+
+def _microseconds(epoch_seconds):
+    return round(epoch_seconds * 1e6)
+
+
+def index_png_directory(writer, directory):
+    """Adds the screenshot_*.png files in directory not yet in the index; returns the count."""
+    from PIL import Image
+
+    indexed = set()
+    if os.path.getsize(writer.path) > 0:
+        existing = ScreenshotIndex(writer.path)
+        indexed = {_microseconds(ts) for ts in existing.timestamps}
+    added = 0
+    paths = glob.glob(os.path.join(directory, "screenshot_*.png"))
+    stamped = ((parse_png_name(os.path.basename(path)), path) for path in paths)
+    for timestamp, path in sorted(item for item in stamped if item[0] is not None):
+        if _microseconds(timestamp.timestamp()) in indexed:
+            continue
+        with Image.open(path) as image:
+            writer.add(np.asarray(image.convert("L")), timestamp)
+        added += 1
+    return added
+
+
+def index_archive(writer, archive_path):
+    """Adds the frames of a frame_archive.py archive not yet in the index; returns the count."""
+    from frame_archive import FrameArchiveReader
+
+    indexed = set()
+    if os.path.getsize(writer.path) > 0:
+        indexed = set(ScreenshotIndex(writer.path).timestamps.tolist())
+    added = 0
+    with FrameArchiveReader(archive_path) as reader:
+        for timestamp, frame in reader.frames():
+            if timestamp.timestamp() in indexed:
+                continue
+            if frame.ndim == 3:
+                frame = gray_frame(frame, PIXEL_BGRX)  # BGR or BGRX
+            writer.add(frame, timestamp)
+            added += 1
+    return added
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Index and search the screenshot history.")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    build = subparsers.add_parser("build", help="Add existing screenshots to an index.")
+    build.add_argument("index")
+    frames = build.add_mutually_exclusive_group(required=True)
+    frames.add_argument("--png-dir", help="Directory of mini_screenshot.py PNGs.")
+    frames.add_argument("--archive", help="A frame_archive.py archive.")
+    build.add_argument("--templates", nargs="*", default=list(DEFAULT_TEMPLATES))
+    visible = subparsers.add_parser("visible", help="Frames where a template was visible.")
+    visible.add_argument("index")
+    visible.add_argument("template")
+    visible.add_argument("--min-score", type=float, default=0.8)
+    first_diff = subparsers.add_parser(
+        "first-diff", help="First frame differing from the one on screen at a time."
+    )
+    first_diff.add_argument("index")
+    first_diff.add_argument("when", help="YYYYmmdd_HHMMSS")
+    first_diff.add_argument(
+        "--max-distance", type=int, default=12, help="Hash bits that may differ (of 256)."
+    )
+    info = subparsers.add_parser("info", help="Summarize an index.")
+    info.add_argument("index")
+    args = parser.parse_args()
+
+    if args.command == "build":
+        source = SOURCE_ARCHIVE if args.archive else SOURCE_PNG
+        with ScreenshotIndexWriter(
+            args.index, args.templates, source=source, archive_path=args.archive
+        ) as writer:
+            if args.archive:
+                added = index_archive(writer, args.archive)
+            else:
+                added = index_png_directory(writer, args.png_dir)
+        print(f"Indexed {added} new frames into {args.index}")
+        return
+
+    start_time = time.perf_counter()
+    index = ScreenshotIndex(args.index)
+    if args.command == "info":
+        print(f"{args.index}: {len(index)} frames, source={index.source}")
+        if len(index):
+            print(f"  from {index.capture_time(0)} to {index.capture_time(len(index) - 1)}")
+        print(f"  templates: {', '.join(index.templates) or '(none)'}")
+    elif args.command == "visible":
+        found = index.visible(args.template, args.min_score)
+        column = index.template_column(args.template)
+        for first, last in runs(found):
+            best = first + int(np.argmax(index.scores[first : last + 1, column]))
+            print(
+                f"{index.capture_time(first)} .. {index.capture_time(last)} "
+                f"({last - first + 1} frames, best {index.scores[best, column] / 255:.2f} "
+                f"at ({index.x[best, column]}, {index.y[best, column]}) in {index.frame_name(best)})"
+            )
+        print(f"{len(found)} of {len(index)} frames", file=sys.stderr)
+    else:
+        when = datetime.datetime.strptime(args.when, TIMESTAMP_FORMAT)
+        try:
+            start = index.index_at(when)
+        except KeyError:
+            print(f"No frame in {args.index} was captured at or before {when}.", file=sys.stderr)
+            sys.exit(1)
+        changed = index.first_difference(when, args.max_distance)
+        print(f"On screen at {when}: {index.frame_name(start)}")
+        if changed is None:
+            print(f"No later frame differs by more than {args.max_distance} bits.")
+        else:
+            print(
+                f"First different frame: {index.frame_name(changed)} "
+                f"({index.distance(start, changed)} bits differ)"
+            )
+    print(f"Query took {(time.perf_counter() - start_time) * 1000:.1f} ms", file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
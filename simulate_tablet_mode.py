@@ -0,0 +1,150 @@
+# Runs the tablet-mode workflow against a simulated desktop on a virtual clock.
+# The simulated Lenovo app, rotation menu and Settings page appear after
+# scripted delays, so end-to-end latency and timeout behaviour can be
+# measured and tuned in milliseconds, without a ThinkBook.
+#
+# Usage: python simulate_tablet_mode.py [--ui-delay-scale 1.0] [--display-scale 2.0] [--no-rotation] [--trace trace.json]
+import argparse
+import time
+
+from desktop import ScreenState, SimulatedDesktop
+from location_hints import LocationHintCache
+
+HIGH_CONTRAST_URI = "ms-settings:easeofaccess-highcontrast"
+# The ThinkBook's panels run at 200% by default, the scale the templates were captured at.
+DEFAULT_DISPLAY_SCALE = 2.0
+
+
+def build_scenario(
+    ui_delay_scale=1.0, start_rotated=False, display_scale=DEFAULT_DISPLAY_SCALE, template_scale=None
+):
+    """
+    A SimulatedDesktop scripted like a real tablet-mode switch.
+
+    Args:
+        ui_delay_scale (float): Multiplies every scripted UI delay, to test
+            how the flow copes with a slower or faster machine.
+        start_rotated (bool): Start at 90 degrees, so the rotation steps are skipped.
+        display_scale (float): Display scaling. Element positions are given at
+            100% and scaled by it.
+        template_scale (float): Display scale the template PNGs were captured
+            at; defaults to tablet_mode.TEMPLATE_DISPLAY_SCALE. Templates are
+            drawn resized by display_scale / template_scale.
+    """
+    if template_scale is None:
+        from tablet_mode import TEMPLATE_DISPLAY_SCALE as template_scale
+
+    def delay(seconds):
+        return seconds * ui_delay_scale
+
+    rotation = 90 if start_rotated else 0
+    desktop_state = "rotated-desktop" if start_rotated else "tablet-desktop"
+    states = [
+        ScreenState(
+            "eink-app-loading",
+            title="ThinkbookEinkPlus",
+            after=(delay(2.5), "eink-app"),
+        ),
+        ScreenState(
+            "eink-app",
+            title="ThinkbookEinkPlus",
+            rotation=rotation,
+            elements={"switch-to-tablet.png": (400, 400)},
+            on_click={"switch-to-tablet.png": (desktop_state, delay(1.5))},
+        ),
+        ScreenState(
+            "tablet-desktop",
+            title="Program Manager",
+            elements={"lenovo.logo.png": (120, 560), "windows-logo.png": (70, 750)},
+            on_right_click={"lenovo.logo.png": ("lenovo-menu", delay(0.4))},
+        ),
+        ScreenState(
+            "lenovo-menu",
+            title="Program Manager",
+            elements={"lenovo.logo.png": (120, 560), "rotate.png": (420, 420)},
+            on_click={"rotate.png": ("rotated-desktop", delay(1.2))},
+        ),
+        ScreenState(
+            "rotated-desktop",
+            title="Program Manager",
+            rotation=90,
+            elements={"windows-logo.png": (70, 1230)},
+            on_click={"windows-logo.png": ("start-menu", delay(0.5))},
+        ),
+        ScreenState("start-menu", title="Start", rotation=90),
+        ScreenState(
+            "settings-loading",
+            title="Settings",
+            rotation=90,
+            after=(delay(0.4), "settings"),
+        ),
+        ScreenState(
+            "settings",
+            title="Settings",
+            rotation=90,
+            on_keys={
+                "enter": ("settings-applied", delay(0.6)),
+                "alt+f4": ("done", delay(0.2)),
+            },
+        ),
+        ScreenState(
+            "settings-applied",
+            title="Settings",
+            rotation=90,
+            on_keys={"alt+f4": ("done", delay(0.2))},
+        ),
+        ScreenState("done", title=None, rotation=90),
+    ]
+    return SimulatedDesktop(
+        states,
+        initial="eink-app-loading",
+        launch_handlers={HIGH_CONTRAST_URI: ("settings-loading", delay(0.8))},
+        scale=display_scale,
+        template_scale=template_scale,
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run the tablet-mode workflow on a simulated desktop.")
+    parser.add_argument("--ui-delay-scale", type=float, default=1.0)
+    parser.add_argument("--no-rotation", action="store_true", help="Start already rotated to 90 degrees.")
+    parser.add_argument(
+        "--display-scale", type=float, default=DEFAULT_DISPLAY_SCALE, help="Simulated DPI scaling."
+    )
+    parser.add_argument("--trace", help="Write a Chrome trace of the run (virtual time) to this file.")
+    parser.add_argument("--actions", action="store_true", help="Print every simulated action.")
+    args = parser.parse_args()
+
+    import tablet_mode  # Configures logging on import
+    from tracing import tracer
+
+    if args.trace:
+        tracer.enable()
+
+    simulated = build_scenario(
+        args.ui_delay_scale, start_rotated=args.no_rotation, display_scale=args.display_scale
+    )
+    tablet_mode.use_desktop(simulated, hints=LocationHintCache(path=None))
+
+    wall_start = time.perf_counter()
+    results = tablet_mode.run_workflow(tablet_mode.TABLET_MODE_WORKFLOW)
+    wall_ms = (time.perf_counter() - wall_start) * 1000
+    virtual_seconds = simulated.clock()
+    # Let transitions triggered by the last actions (e.g. alt+f4) play out.
+    simulated.sleep(5)
+
+    failed = [result for result in results if result.status == "failed"]
+    print(
+        f"Simulated run {'FAILED' if failed else 'completed'}: "
+        f"{virtual_seconds:.2f}s virtual, {wall_ms:.0f} ms wall clock, "
+        f"final state '{simulated.state.name}'."
+    )
+    if args.trace:
+        tablet_mode.export_trace(args.trace)
+    if args.actions:
+        for when, description in simulated.actions:
+            print(f"  {when:8.2f}s  {description}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,410 @@
+# /// script
+# requires-python = ">=3.12"
+# dependencies = [
+#     "mouseinfo==0.1.3",
+#     "numpy==2.2.5",
+#     "opencv-python==4.11.0.86",
+#     "pillow==11.2.1",
+#     "pyautogui==0.9.54",
+#     "pygetwindow==0.0.9",
+#     "pymsgbox==1.0.9",
+#     "pyperclip==1.9.0",
+#     "pyrect==0.2.0",
+#     "pyscreeze==1.0.1",
+#     "pytweening==1.2.0",
+#     "pywin32==310",
+# ]
+# ///
+# Same dependencies as tablet_mode.py: uv run tablet_daemon.py serve
+# Resident service mode for tablet_mode.py.
+# A one-off "uv run tablet_mode.py" pays for interpreter startup, importing
+# cv2/numpy/pyautogui, opening the template bundle and the first screen
+# capture before it can click anything. "serve" does all of that once and
+# then waits on a local socket for commands; "send" is the client that
+# tablet_mode.bat calls on every mode switch.
+#
+# Protocol: the client sends one command line ("tablet", "rotate", "ping",
+# "stats" or "quit") and reads back one line of JSON. Over TCP the command is
+# preceded by a line holding the daemon's token (see below). Workflow replies
+# carry the per-step timings and dispatch_ms, the time from receiving the
+# command to the workflow's first step starting.
+#
+# Each connection is handled on its own thread, so ping, stats and quit are
+# answered while a workflow runs. Only one workflow runs at a time (there is
+# one screen to drive); a second one is refused as busy. A run that exceeds
+# its deadline, or is interrupted by quit, fails at its next wait.
+#
+# The socket is a Unix socket in a directory only the current user can
+# access, where available; otherwise (Windows) TCP on 127.0.0.1 only. Any
+# local user can connect to that port, so a TCP daemon writes a random token
+# to a file in the user's own profile directory and only accepts
+# connections that send it. A daemon refuses to start while another one
+# answers on its address.
+#
+# Usage:
+#   python tablet_daemon.py serve [--address ADDR] [--trace-dir DIR] [--run-timeout S] [--simulate]
+#   python tablet_daemon.py send COMMAND [--address ADDR]
+import argparse
+import datetime
+import hmac
+import json
+import logging
+import os
+import secrets
+import socket
+import socketserver
+import stat
+import sys
+import tempfile
+import threading
+import time
+
+DEFAULT_TCP_ADDRESS = "127.0.0.1:47615"
+UNIX_SOCKET_NAME = "tablet_mode.sock"
+TOKEN_FILE_NAME = "tablet_mode-{port}.token"
+# "send" exit codes besides 0 (ok) and 1 (the command failed). tablet_mode.bat
+# falls back to a one-off run only when no daemon is listening: a daemon that
+# accepted the command but did not answer may still be running it.
+NOT_RUNNING_EXIT_CODE = 3
+NO_REPLY_EXIT_CODE = 4
+RUN_TIMEOUT_SECONDS = 120
+
+
+def default_address():
+    if hasattr(socket, "AF_UNIX") and hasattr(os, "getuid"):
+        return os.path.join(_private_runtime_dir(), UNIX_SOCKET_NAME)
+    return DEFAULT_TCP_ADDRESS
+
+
+def _private_runtime_dir():
+    """$XDG_RUNTIME_DIR, or a per-user directory under the temp directory."""
+    runtime_dir = os.environ.get("XDG_RUNTIME_DIR")
+    if runtime_dir and os.path.isdir(runtime_dir):
+        return runtime_dir
+    directory = os.path.join(tempfile.gettempdir(), f"tablet_mode-{os.getuid()}")
+    os.makedirs(directory, mode=0o700, exist_ok=True)
+    info = os.lstat(directory)
+    # Someone else may have created the path first to capture our socket.
+    if not stat.S_ISDIR(info.st_mode) or info.st_uid != os.getuid() or info.st_mode & 0o077:
+        raise PermissionError(f"{directory} is not a private directory owned by this user")
+    return directory
+
+
+def token_path(port):
+    """File holding the token of the TCP daemon on port, in a directory only this user can read."""
+    if hasattr(os, "getuid"):
+        directory = _private_runtime_dir()
+    else:
+        # The profile's AppData is private to its user by default.
+        directory = os.path.join(
+            os.environ.get("LOCALAPPDATA") or os.path.expanduser("~"), "tablet_mode"
+        )
+        os.makedirs(directory, exist_ok=True)
+    return os.path.join(directory, TOKEN_FILE_NAME.format(port=port))
+
+
+def _write_token(path):
+    """Writes a new random token to path, readable only by this user, and returns it."""
+    token = secrets.token_hex(32)
+    if os.path.lexists(path):
+        os.unlink(path)  # Left behind by a daemon that did not shut down cleanly
+    fd = os.open(path, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o600)
+    with os.fdopen(fd, "w", encoding="ascii") as f:
+        f.write(token)
+    return token
+
+
+def _read_token(path):
+    with open(path, "r", encoding="ascii") as f:
+        return f.read().strip()
+
+
+def ensure_not_running(address):
+    """Raises RuntimeError if a daemon already answers at address."""
+    try:
+        reply = send("ping", address, timeout_seconds=2)
+    except (OSError, ValueError):
+        return
+    raise RuntimeError(f"A tablet_mode daemon is already running at {address} ({reply})")
+
+
+def parse_address(address):
+    """Returns (family, address) for "host:port" (TCP) or a filesystem path (Unix socket)."""
+    host, _, port = address.rpartition(":")
+    if host and port.isdigit():
+        return socket.AF_INET, (host, int(port))
+    return socket.AF_UNIX, address
+
+
+class TabletModeService:
+    """
+    Runs tablet_mode workflows on request, against a desktop that stays set up.
+
+    Args:
+        desktop (desktop.Desktop): The machine every command runs against.
+        hints (LocationHintCache): Shared by every run; defaults to the persistent cache.
+        trace_dir (str): If set, every workflow run is traced and its Chrome
+            trace written to this directory.
+        run_timeout_seconds (float): A workflow still running after this long
+            fails, instead of blocking the daemon.
+    """
+
+    def __init__(
+        self,
+        desktop,
+        hints=None,
+        trace_dir=None,
+        run_timeout_seconds=RUN_TIMEOUT_SECONDS,
+    ):
+        import tablet_mode  # Heavy imports (cv2, numpy, the desktop backend) happen once, here
+
+        self.tablet_mode = tablet_mode
+        self.started_at = time.time()
+        self.runs = 0
+        self.failures = 0
+        self.trace_dir = trace_dir
+        self.run_timeout_seconds = run_timeout_seconds
+        self.running = None  # (workflow name, start time) of the active run
+        self._run_lock = threading.Lock()
+        start_time = time.perf_counter()
+        tablet_mode.use_desktop(desktop, hints=hints)
+        tablet_mode.warm_up()
+        logging.info(f"Daemon warm in {(time.perf_counter() - start_time) * 1000:.0f} ms")
+
+    def handle(self, command, received_at):
+        """Executes one command and returns the JSON-serializable reply."""
+        if command == "ping":
+            return {"ok": True, "reply": "pong"}
+        if command == "stats":
+            return {
+                "ok": True,
+                "uptime_seconds": round(time.time() - self.started_at, 1),
+                "runs": self.runs,
+                "failures": self.failures,
+                "running": self._running_summary(),
+                "log_context": self.tablet_mode.log_context.stats(),
+            }
+        workflow = self.tablet_mode.WORKFLOWS.get(command)
+        if workflow is None:
+            known = ", ".join(sorted(self.tablet_mode.WORKFLOWS))
+            return {"ok": False, "error": f"Unknown command '{command}' (workflows: {known})"}
+        if not self._run_lock.acquire(blocking=False):
+            return {"ok": False, "error": "Busy", "running": self._running_summary()}
+        try:
+            self.running = (workflow.name, time.perf_counter())
+            return self._run(workflow, command, received_at)
+        finally:
+            self.running = None
+            self._run_lock.release()
+
+    def cancel(self):
+        """Makes the active run, if any, fail at its next wait."""
+        self.tablet_mode.run_cancel.set()
+
+    def _running_summary(self):
+        running = self.running
+        if running is None:
+            return None
+        name, started_at = running
+        return {"workflow": name, "seconds": round(time.perf_counter() - started_at, 1)}
+
+    def _run(self, workflow, command, received_at):
+        tablet_mode = self.tablet_mode
+        tablet_mode.run_deadline = tablet_mode.desktop.clock() + self.run_timeout_seconds
+        tablet_mode.log_context.invalidate()
+        tracer = tablet_mode.tracer
+        if self.trace_dir:
+            tracer.reset()
+            tracer.enable()
+        dispatch_ms = (time.perf_counter() - received_at) * 1000
+        try:
+            results = tablet_mode.run_workflow(workflow, on_failure=tablet_mode.save_debug_screenshot)
+        finally:
+            tablet_mode.run_deadline = None
+            if self.trace_dir:
+                tracer.disable()  # Also after a crashed run, so later runs aren't traced
+        self.runs += 1
+        ok = all(result.status != "failed" for result in results)
+        self.failures += not ok
+        trace_path = None
+        if self.trace_dir:
+            # Milliseconds plus the run number, so back-to-back runs never share a name.
+            stamp = datetime.datetime.now().strftime("%Y%m%d_%H%M%S_%f")[:-3]
+            trace_path = os.path.join(
+                self.trace_dir, f"trace_{command}_{stamp}_{self.runs:04d}.json"
+            )
+            tablet_mode.export_trace(trace_path)
+        return {
+            "ok": ok,
+            "workflow": workflow.name,
+            "dispatch_ms": round(dispatch_ms, 2),
+            "total_ms": round((time.perf_counter() - received_at) * 1000, 1),
+            "trace": trace_path,
+            "steps": [
+                {
+                    "name": result.name,
+                    "status": result.status,
+                    "seconds": round(result.elapsed_seconds, 3),
+                }
+                for result in results
+            ],
+        }
+
+
+class _CommandHandler(socketserver.StreamRequestHandler):
+    def handle(self):
+        received_at = time.perf_counter()
+        if self.server.token is not None:
+            token = self.rfile.readline(256).decode("utf-8", "replace").strip()
+            if not hmac.compare_digest(token.encode("utf-8"), self.server.token.encode("utf-8")):
+                logging.warning(f"Refused a connection from {self.client_address}: bad token")
+                self._reply({"ok": False, "error": "Bad token"})
+                return
+        command = self.rfile.readline(256).decode("utf-8", "replace").strip().lower()
+        if command == "quit":
+            reply = {"ok": True, "reply": "bye"}
+            self.server.service.cancel()
+            # shutdown() waits for serve_forever() to return, which runs on
+            # another thread than this handler.
+            threading.Thread(target=self.server.shutdown, name="daemon-shutdown").start()
+        else:
+            logging.info(f"Daemon command: {command}")
+            try:
+                reply = self.server.service.handle(command, received_at)
+            except (Exception, SystemExit) as e:
+                # A broken run must not take the daemon down with it, even one
+                # that tries to exit the process.
+                logging.exception(f"Command '{command}' failed")
+                reply = {"ok": False, "error": f"{type(e).__name__}: {e}"}
+        self._reply(reply)
+
+    def _reply(self, reply):
+        self.wfile.write(json.dumps(reply).encode("utf-8") + b"\n")
+
+
+class _ReusableTCPServer(socketserver.ThreadingTCPServer):
+    # On Windows SO_REUSEADDR would let a second daemon bind the same port.
+    allow_reuse_address = os.name != "nt"
+
+
+def serve(service, address):
+    """Serves commands until "quit"; each connection is handled on its own thread."""
+    ensure_not_running(address)
+    family, bind_address = parse_address(address)
+    token = token_file = None
+    if family == socket.AF_UNIX:
+        if os.path.lexists(bind_address):
+            if not stat.S_ISSOCK(os.lstat(bind_address).st_mode):
+                raise RuntimeError(f"{bind_address} exists and is not a socket")
+            os.unlink(bind_address)  # Left behind by a daemon that did not shut down cleanly
+        server = socketserver.ThreadingUnixStreamServer(bind_address, _CommandHandler)
+    else:
+        server = _ReusableTCPServer(bind_address, _CommandHandler)
+        # Written once the port is ours, so it never names another daemon.
+        token_file = token_path(server.server_address[1])
+        token = _write_token(token_file)
+    server.token = token
+    server.daemon_threads = False  # server_close() waits for a run interrupted by quit
+    server.block_on_close = True
+    server.service = service
+    logging.info(f"Daemon listening on {address}")
+    try:
+        server.serve_forever()
+    finally:
+        server.server_close()
+        if family == socket.AF_UNIX and os.path.exists(bind_address):
+            os.unlink(bind_address)
+        if token_file is not None and os.path.exists(token_file):
+            os.unlink(token_file)
+    logging.info("Daemon stopped.")
+
+
+def send(command, address, timeout_seconds=300):
+    """
+    Sends one command and returns the decoded reply.
+
+    Raises:
+        OSError: If no daemon answers; FileNotFoundError (before connecting)
+            if a TCP daemon's token file is missing, i.e. none was started.
+    """
+    family, connect_address = parse_address(address)
+    request = command.encode("utf-8") + b"\n"
+    if family != socket.AF_UNIX:
+        request = _read_token(token_path(connect_address[1])).encode("utf-8") + b"\n" + request
+    with socket.socket(family, socket.SOCK_STREAM) as client:
+        client.settimeout(timeout_seconds)
+        client.connect(connect_address)
+        client.sendall(request)
+        reply = client.makefile("rb").readline()
+    return json.loads(reply)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Resident tablet_mode service.")
+    subparsers = parser.add_subparsers(dest="mode", required=True)
+    serve_parser = subparsers.add_parser("serve", help="Run the daemon.")
+    serve_parser.add_argument("--address", default=default_address())
+    serve_parser.add_argument("--trace-dir", help="Write a Chrome trace of every run here.")
+    serve_parser.add_argument(
+        "--run-timeout",
+        type=float,
+        default=RUN_TIMEOUT_SECONDS,
+        help="Seconds after which a workflow run fails.",
+    )
+    serve_parser.add_argument(
+        "--simulate", action="store_true", help="Drive simulate_tablet_mode's scripted desktop."
+    )
+    send_parser = subparsers.add_parser("send", help="Send a command to a running daemon.")
+    send_parser.add_argument("command")
+    send_parser.add_argument("--address", default=default_address())
+    args = parser.parse_args()
+
+    if args.mode == "send":
+        start_time = time.perf_counter()
+        try:
+            reply = send(args.command, args.address)
+        except (ConnectionRefusedError, FileNotFoundError) as e:
+            print(f"No tablet_mode daemon at {args.address}: {e}", file=sys.stderr)
+            sys.exit(NOT_RUNNING_EXIT_CODE)
+        except (OSError, ValueError) as e:
+            # Includes the timeout: the daemon took the command, so don't run it twice.
+            print(f"No reply from the tablet_mode daemon at {args.address}: {e}", file=sys.stderr)
+            sys.exit(NO_REPLY_EXIT_CODE)
+        print(json.dumps(reply, indent=2))
+        print(f"Round trip: {(time.perf_counter() - start_time) * 1000:.0f} ms", file=sys.stderr)
+        sys.exit(0 if reply.get("ok") else 1)
+
+    try:
+        ensure_not_running(args.address)  # Before the slow warm-up
+    except RuntimeError as e:
+        print(e, file=sys.stderr)
+        sys.exit(1)
+    if args.simulate:
+        from location_hints import LocationHintCache
+        from simulate_tablet_mode import build_scenario
+
+        # One scenario for the daemon's life, so commands see the state the
+        # previous ones left (e.g. "rotate" after "tablet").
+        service = TabletModeService(
+            build_scenario(),
+            hints=LocationHintCache(path=None),
+            trace_dir=args.trace_dir,
+            run_timeout_seconds=args.run_timeout,
+        )
+    else:
+        from desktop import WindowsDesktop
+
+        import tablet_mode
+
+        service = TabletModeService(
+            WindowsDesktop(
+                pixel_format=tablet_mode.CAPTURE_PIXEL_FORMAT, monitor=tablet_mode.CAPTURE_MONITOR
+            ),
+            trace_dir=args.trace_dir,
+            run_timeout_seconds=args.run_timeout,
+        )
+    serve(service, args.address)
+
+
+if __name__ == "__main__":
+    main()
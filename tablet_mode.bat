@@ -0,0 +1,7 @@
+@echo off
+rem Ask a resident "tablet_daemon.py serve" to switch to tablet mode (warm, ~ms to
+rem the first action). Only if no daemon is listening (exit code 3) fall back
+rem to a one-off run; any other failure means the daemon already handled it.
+cd /d "%~dp0"
+uv run tablet_daemon.py send tablet
+if %errorlevel% equ 3 uv run tablet_mode.py
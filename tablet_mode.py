@@ -19,26 +19,144 @@
 # uv run tablet_mode.py
 # alternatives: https://github.com/pywinauto/pywinauto/
 # https://pypi.org/project/pyuiauto/
-import pyautogui
 import time
 import sys  # Import sys to exit if images are not found
 import datetime  # To timestamp the debug screenshot
 import logging  # Import the logging module
 import traceback  # For printing error details without recursion
-import subprocess  # For running system commands
+import threading  # Log records can come from worker threads
+import os  # TABLET_MODE_TRACE turns on span tracing
+
+# pyautogui, pygetwindow and pywin32 are used through desktop.WindowsDesktop,
+# so the flow can also run against desktop.SimulatedDesktop.
+from desktop import WindowsDesktop
+from frame_change import AdaptiveInterval, FrameChangeDetector
+from frame_history import FrameHistory
+from location_hints import LocationHintCache
+from screen_capture import PIXEL_BGRX, intersect_rects
+from template_bundle import open_bundle
+from template_matcher import PyramidMatcher
+from tracing import traced, tracer
+from workflow import (
+    Concurrent,
+    KeySequence,
+    LaunchUri,
+    LocateAndClick,
+    RotateIfNeeded,
+    StepFailed,
+    WaitForStableScreen,
+    WaitForTemplates,
+    WaitForWindow,
+    Workflow,
+    WorkflowContext,
+)
 
-# --- Add these imports for screen rotation ---
-import win32api
-import win32con
+_WINDOW_TITLE_ERROR_MARKER = object()  # Unique marker for title fetching errors
 
-# --- Add these imports for pygetwindow ---
-import pygetwindow as gw
+# The template PNGs were captured on the ThinkBook at 200% display scaling
+# (its default), so a template is expected at display_scale() / 2.0 of its
+# size. Scaled copies are precomputed once, so a template still matches at
+# another DPI setting; the variant that matches is remembered. Frames are
+# always captured upright, so the templates are not rotated.
+TEMPLATE_DISPLAY_SCALE = 2.0
+# Windows' scaling choices from 100% to 250%, relative to the capture's 200%.
+TEMPLATE_SCALES = (0.5, 0.625, 0.75, 0.875, 1.0, 1.25)
+# All of that is compiled once into a memory-mapped bundle, rebuilt
+# automatically when a PNG changes (or by hand: python template_bundle.py build).
+TEMPLATE_IMAGES = ("switch-to-tablet.png", "lenovo.logo.png", "rotate.png", "windows-logo.png")
+TEMPLATE_BUNDLE = ".templates.bundle"
+
+# Matching only needs luminance; the BGRX capture is converted to gray once
+# per frame. PIXEL_GRAY keeps only the gray copy, and PIXEL_MONO (thresholded,
+# bit-packed) suits the high-contrast e-ink theme.
+CAPTURE_PIXEL_FORMAT = PIXEL_BGRX
+
+# Capture only one monitor (a screen_capture.MonitorLayout name such as
+# "primary" or "\\.\DISPLAY2") instead of the whole virtual screen; None
+# captures everything. TEMPLATE_REGIONS limits single templates further, to a
+# (left, top, width, height) rectangle or a monitor name, e.g.
+# {"windows-logo.png": "primary"}; find_and_interact then captures only that
+# part of the screen while it polls for the template. Whatever the
+# configuration, a template with a location hint is first looked for in a
+# capture of the area around the hint, and once a template has been clicked,
+# only the area around the hit is captured while waiting for it to disappear.
+CAPTURE_MONITOR = None
+TEMPLATE_REGIONS = {}
+
+# Recent frames (half size, grayscale) kept for the failure dump.
+FRAME_HISTORY_MAX_BYTES = 32 * 1024 * 1024
+
+# The machine the flow runs against, and the matcher bound to its screen; set by use_desktop().
+desktop = None
+_matcher = None
+frame_history = None
+
+# Limits for a run: once desktop.clock() passes run_deadline (set by the
+# resident daemon), or run_cancel is set (by the daemon, or by a Concurrent
+# step whose other branch failed), the waits raise StepFailed: polling waits
+# at their next poll, window-title waits as soon as they notice. So an endless
+# wait (switch-to-tablet has no retry limit) cannot block it forever.
+run_deadline = None
+run_cancel = threading.Event()
+
+
+def build_matcher(
+    frame_source, hints, display_scale, rotation_provider=None, monitor_layout=None, use_bundle=True
+):
+    """
+    Returns a PyramidMatcher set up the way this module matches templates:
+    every TEMPLATE_SCALES variant, the template bundle and TEMPLATE_REGIONS.
+    benchmark_matcher.py measures the same setup.
 
-# --- End new imports ---
+    Args:
+        frame_source: template_matcher frame source to grab frames from.
+        hints (LocationHintCache): Location hints, or None for none.
+        display_scale (callable): Returns the display scale (1.0 at 100%).
+        rotation_provider (callable): Returns the current screen rotation.
+        monitor_layout (screen_capture.MonitorLayout): Resolves monitor names in TEMPLATE_REGIONS.
+        use_bundle (bool): If False, templates are decoded from their PNGs.
+    """
+    bundle = None
+    if use_bundle:
+        bundle = open_bundle(TEMPLATE_BUNDLE, TEMPLATE_IMAGES, TEMPLATE_SCALES)
+    return PyramidMatcher(
+        frame_source,
+        hints=hints,
+        rotation_provider=rotation_provider,
+        scales=TEMPLATE_SCALES,
+        scale_provider=lambda: display_scale() / TEMPLATE_DISPLAY_SCALE,
+        bundle=bundle,
+        regions=TEMPLATE_REGIONS,
+        monitor_layout=monitor_layout,
+    )
 
-_WINDOW_TITLE_ERROR_MARKER = object()  # Unique marker for title fetching errors
 
+def use_desktop(new_desktop, hints=None):
+    """
+    Points every operation in this module at a Desktop.
 
+    Args:
+        new_desktop (desktop.Desktop): WindowsDesktop for the real machine, or a SimulatedDesktop.
+        hints (LocationHintCache): Location hints for the matcher; defaults to the persistent cache.
+    """
+    global desktop, _matcher, frame_history
+    desktop = new_desktop
+    frame_history = FrameHistory(FRAME_HISTORY_MAX_BYTES)
+    tracer.clock = desktop.clock  # Simulated runs are traced in virtual time
+    # One matcher for the whole run, so each template PNG is decoded only once
+    # and the screen capture buffers are reused between polls.
+    # Hints persist across runs, so the logos are usually found with a small region search.
+    _matcher = build_matcher(
+        desktop.frame_source(),
+        hints=hints if hints is not None else LocationHintCache(),
+        display_scale=desktop.display_scale,
+        rotation_provider=log_context.rotation,
+        monitor_layout=desktop.monitor_layout(),
+    )
+    log_context.invalidate()
+
+
+@traced("wait-window", "target_title_substring", ("max_wait_seconds",))
 def wait_for_window_title(
     target_title_substring,
     max_wait_seconds=30,
@@ -48,10 +166,16 @@ def wait_for_window_title(
     """
     Waits for a window containing the target_title_substring to become active.
 
+    On Windows the wait is woken by foreground/title-change events, so it
+    returns as soon as the window is active; elsewhere (or if the hooks are
+    unavailable) the active window is polled every interval_seconds. The
+    wait ends early, raising StepFailed, when the run is cancelled or its
+    deadline passes.
+
     Args:
         target_title_substring (str): The substring to look for in the active window's title.
         max_wait_seconds (int): Maximum time in seconds to wait for the window.
-        interval_seconds (float): How often in seconds to check for the window.
+        interval_seconds (float): How often in seconds to check for the window when polling.
         exit_on_timeout (bool): If True, calls save_debug_screenshot_and_exit on timeout.
 
     Returns:
@@ -62,37 +186,34 @@ def wait_for_window_title(
     logging.info(
         f"Waiting for window with title containing: '{target_title_substring}'..."
     )
-    start_time = time.perf_counter()
-
-    while True:
-        current_title = _get_current_active_title_or_marker()
-
-        if isinstance(current_title, str) and target_title_substring in current_title:
-            logging.info(
-                f"Target window '{current_title}' (containing '{target_title_substring}') found and active."
-            )
-            return current_title  # Success
-
-        elapsed_time = time.perf_counter() - start_time
-        if elapsed_time >= max_wait_seconds:
-            logging.error(
-                f"Timeout: Window with title substring '{target_title_substring}' did not become active within {max_wait_seconds} seconds."
-            )
-            if exit_on_timeout:
-                # Sanitize substring for filename
-                safe_substring = "".join(
-                    c if c.isalnum() else "_" for c in target_title_substring
-                )
-                save_debug_screenshot_and_exit(
-                    f"Timeout_waiting_for_window_{safe_substring[:30]}"
-                )  # Pass a descriptive message
-            return None  # Timeout
+    _check_run_limits()
+    wait_seconds = max_wait_seconds
+    if run_deadline is not None:
+        wait_seconds = max(0.0, min(wait_seconds, run_deadline - desktop.clock()))
+    current_title = desktop.wait_for_window_title(
+        target_title_substring, wait_seconds, interval_seconds, cancel=run_cancel
+    )
 
-        # Log concisely; the contextual logger will show the current window state if any.
+    if current_title is not None:
+        log_context.invalidate()  # The active window just changed
         logging.info(
-            f"Still waiting for '{target_title_substring}'. Retrying in {interval_seconds}s."
+            f"Target window '{current_title}' (containing '{target_title_substring}') found and active."
         )
-        time.sleep(interval_seconds)
+        return current_title  # Success
+
+    _check_run_limits()
+    logging.error(
+        f"Timeout: Window with title substring '{target_title_substring}' did not become active within {max_wait_seconds} seconds."
+    )
+    if exit_on_timeout:
+        # Sanitize substring for filename
+        safe_substring = "".join(
+            c if c.isalnum() else "_" for c in target_title_substring
+        )
+        save_debug_screenshot_and_exit(
+            f"Timeout_waiting_for_window_{safe_substring[:30]}"
+        )  # Pass a descriptive message
+    return None  # Timeout
 
 
 def _get_current_active_title_or_marker():
@@ -104,10 +225,7 @@ def _get_current_active_title_or_marker():
         - _WINDOW_TITLE_ERROR_MARKER if an exception occurs during fetching.
     """
     try:
-        active_window = gw.getActiveWindow()
-        if active_window:
-            return active_window.title
-        return None  # No active window
+        return desktop.active_window_title()  # None if no window is active
     except Exception as e:
         # Print error directly to stderr to avoid logging recursion if this
         # function is called by the logger context filter.
@@ -130,31 +248,102 @@ def press_with_pause(key_or_keys, pause_seconds=0.1):
     action_description = ""
     if isinstance(key_or_keys, (list, tuple)):
         action_description = f"hotkey: {', '.join(key_or_keys)}"
-        pyautogui.hotkey(*key_or_keys)
+        _input("hotkey", *key_or_keys)
     else:
         action_description = f"key: '{key_or_keys}'"
-        pyautogui.press(key_or_keys)
+        _input("press", key_or_keys)
+    log_context.invalidate()
 
     logging.info(f"Pressed {action_description} and pausing for {pause_seconds}s.")
     if pause_seconds > 0:
-        time.sleep(pause_seconds)
+        _sleep(pause_seconds, "key-pause")
+
+
+# --- Traced desktop primitives ---
+# Captures, matches, input and sleeps go through these so every one of them
+# shows up as a span when tracing is enabled.
+
+
+def _input(kind, *args, **attrs):
+    """Performs desktop.<kind>(*args) (click, right_click, press, hotkey, launch_uri)."""
+    with tracer.span("input", kind, **attrs):
+        getattr(desktop, kind)(*args)
+
+
+def _check_run_limits():
+    """Raises StepFailed once the run was cancelled or its deadline passed."""
+    if run_cancel.is_set():
+        raise StepFailed("Run cancelled")
+    if run_deadline is not None and desktop.clock() >= run_deadline:
+        raise StepFailed("Run deadline exceeded")
+
+
+def _sleep(seconds, reason):
+    _check_run_limits()
+    with tracer.span("sleep", reason, seconds=round(seconds, 3)):
+        desktop.sleep(seconds)
+
+
+def _grab(detector, region=None):
+    """
+    Captures the screen, or only region ((left, top, width, height) in screen coordinates).
+
+    Returns:
+        tuple: (FramePyramid, bool) - the frame and whether it differs from
+        the detector's reference (the last frame reported changed, which the
+        callers then match). Only changed frames are downscaled into
+        frame_history; an unchanged one just counts as a repeat there.
+    """
+    with tracer.span("capture", region=region):
+        frame = _matcher.grab(region)
+    changed = _screen_changed(detector, frame)
+    frame_history.record(frame, desktop.clock(), changed=changed)
+    return frame, changed
+
+
+def _screen_changed(detector, frame):
+    """Change check on the most compact form of the frame (packed bits for mono captures)."""
+    if frame.packed is not None:
+        return detector.changed_packed(frame.packed)
+    return detector.changed(frame.level(0))
+
+
+def _locate(image_path, frame, confidence, region=None, attempt=None, full_search=True):
+    """Like PyramidMatcher.locate, recording score and template scale on the span."""
+    with tracer.span("match", image_path, attempt=attempt, region=region) as span:
+        rotation = log_context.rotation()  # Read once, for the matcher and the span
+        match = _matcher.locate(
+            image_path,
+            frame=frame,
+            confidence=confidence,
+            full_search=full_search,
+            region=region,
+            rotation=rotation,
+        )
+        if span:
+            span.set(
+                found=match is not None,
+                score=round(match.score, 4) if match else None,
+                scale=match.scale if match else None,
+                rotation=rotation,
+            )
+        return match
+
+
+def _around(match, frame, margin):
+    """The match's rectangle grown by margin pixels, clipped to the frame it was found in."""
+    frame_h, frame_w = frame.shape[:2]
+    return intersect_rects(
+        (match.left - margin, match.top - margin, match.width + 2 * margin, match.height + 2 * margin),
+        (*frame.origin, frame_w, frame_h),
+    )
 
 
 # Helper function to get screen rotation string
 def get_screen_rotation():
     try:
-        # Get settings for the primary display
-        settings = win32api.EnumDisplaySettings(None, win32con.ENUM_CURRENT_SETTINGS)
-        orientation_val = settings.DisplayOrientation
-
-        orientation_map = {
-            win32con.DMDO_DEFAULT: 0,  # Landscape
-            win32con.DMDO_90: 90,  # Portrait
-            win32con.DMDO_180: 180,  # Landscape (flipped)
-            win32con.DMDO_270: 270,  # Portrait (flipped)
-        }
-        # Using short forms for brevity in logs
-        return orientation_map.get(orientation_val, f"Unk({orientation_val})")
+        # Rotation of the primary display, in degrees
+        return desktop.screen_rotation()
     except Exception as e:
         # Print error directly to stderr to avoid logging recursion
         print(
@@ -165,15 +354,82 @@ def get_screen_rotation():
         return -1  # Rotation Error during fetch
 
 
+class LogContextProvider:
+    """
+    Caches the screen rotation and active window title shown in every log line.
+
+    Querying the OS on every log record is expensive when polling loops log
+    several times a second, so values are reused for ttl_seconds. Call
+    invalidate() after an action that may have changed either (a click,
+    key press or rotation) so the next record fetches fresh values.
+
+    The OS is queried outside the lock, so threads logging meanwhile are not
+    held up by a slow query; they may query too, and the last result is kept.
+
+    Args:
+        ttl_seconds (float): How long fetched values are reused.
+    """
+
+    def __init__(self, ttl_seconds=0.5):
+        self.ttl_seconds = ttl_seconds
+        self.hits = 0
+        self.misses = 0
+        self._rotation = None
+        self._title_result = None
+        self._fetched_at = None
+        self._generation = 0  # Bumped by invalidate()
+        self._lock = threading.Lock()
+
+    def get(self):
+        """Returns (rotation, title_result); title_result may be None or _WINDOW_TITLE_ERROR_MARKER."""
+        if desktop is None:
+            return -1, None  # Nothing to describe before use_desktop() is called
+        with self._lock:
+            now = desktop.clock()
+            if self._fetched_at is not None and now - self._fetched_at < self.ttl_seconds:
+                self.hits += 1
+                return self._rotation, self._title_result
+            self.misses += 1
+            generation = self._generation
+
+        with tracer.span("query-context") as span:
+            rotation = get_screen_rotation()
+            title_result = _get_current_active_title_or_marker()
+            if span:
+                span.set(rotation=rotation)
+
+        with self._lock:
+            # An invalidate() during the query means it may already be out of date.
+            if generation == self._generation:
+                self._rotation = rotation
+                self._title_result = title_result
+                self._fetched_at = now
+        return rotation, title_result
+
+    def rotation(self):
+        return self.get()[0]
+
+    def invalidate(self):
+        """Forces the next get() to query the OS again."""
+        with self._lock:
+            self._fetched_at = None
+            self._generation += 1
+
+    def stats(self):
+        return {"hits": self.hits, "misses": self.misses}
+
+
+log_context = LogContextProvider()
+
+
 # Custom filter to add screen rotation and active window info to log records
 class ContextualLogFilter(logging.Filter):  # Renamed
-    def filter(self, record):
-        record.screen_rotation = get_screen_rotation()
+    def __init__(self, context_provider):
+        super().__init__()
+        self.context_provider = context_provider
 
-        # Call the core title getter directly
-        title_result = (
-            _get_current_active_title_or_marker()
-        )  # Assumes _get_current_active_title_or_marker is defined
+    def filter(self, record):
+        record.screen_rotation, title_result = self.context_provider.get()
 
         if title_result is _WINDOW_TITLE_ERROR_MARKER:
             record.active_window_display = "WinErr"
@@ -187,7 +443,7 @@ class ContextualLogFilter(logging.Filter):  # Renamed
 # --- Configure logging ---
 # Create and configure the handler
 console_handler = logging.StreamHandler(sys.stdout)
-console_handler.addFilter(ContextualLogFilter())  # Add our custom (renamed) filter
+console_handler.addFilter(ContextualLogFilter(log_context))  # Add our custom (renamed) filter
 
 # Define the new log format including screen_rotation
 log_format = "%(asctime)s [%(screen_rotation)d] [%(active_window_display)s] - %(levelname)s - %(message)s"
@@ -208,13 +464,50 @@ def save_debug_screenshot_and_exit(failed_image_path):
     logging.error(
         f"Script terminated. Could not find required image: {failed_image_path}"
     )
+    save_debug_screenshot()
+    sys.exit(1)
+
+
+def save_debug_screenshot(description=None):
+    """
+    Writes out what led to a failure (the resident daemon's on_failure).
+
+    The recent frames from frame_history, with every template's best score
+    per frame, are dumped to debug_failure_<timestamp>/ on a background
+    thread, so nothing is captured or encoded on the failure path. Only if
+    no frame was captured yet is a screenshot taken.
+    """
+    if description is not None:
+        logging.error(f"Workflow step failed: {description}")
 
-    # --- Add Debug Screenshot ---
     timestamp = datetime.datetime.now().strftime("%Y%m%d_%H%M%S")
+    if frame_history is not None and frame_history.frames:
+        dump_directory = f"debug_failure_{timestamp}"
+        templates = {
+            image_path: _matcher.expected_variant(image_path).levels[0]
+            for image_path in TEMPLATE_IMAGES
+        }
+        frame_history.dump_async(
+            dump_directory,
+            templates,
+            on_done=lambda index_path: logging.info(
+                f"Failure frame history written to {index_path}"
+                if index_path
+                else f"Failure frame history in {dump_directory} is incomplete"
+            ),
+        )
+        logging.info(
+            f"Dumping the last {len(frame_history.frames)} frames to {dump_directory}/ in the background. "
+            f"index.json lists each template's best score per frame."
+        )
+        return
+
+    # --- Add Debug Screenshot ---
     debug_screenshot_path = f"debug_screenshot_failure_{timestamp}.png"
     try:
         start_time = time.perf_counter()
-        pyautogui.screenshot(debug_screenshot_path)
+        with tracer.span("capture", "debug-screenshot"):
+            desktop.screenshot(debug_screenshot_path)
         end_time = time.perf_counter()
         duration_ms = (end_time - start_time) * 1000
         logging.info(
@@ -224,9 +517,115 @@ def save_debug_screenshot_and_exit(failed_image_path):
         logging.error(f"Could not save debug screenshot: {screen_err}")
     # --- End Debug Screenshot ---
 
-    sys.exit(1)
 
+def locate_visible_templates(image_paths, confidence=0.8, frame=None):
+    """
+    Checks which of several images are visible, on one capture.
 
+    Args:
+        image_paths (iterable of str): Image files to look for.
+        confidence (float): Minimum match score for an image to count as visible.
+        frame (FramePyramid): Frame to check; the screen is captured once if None.
+
+    Returns:
+        dict: Maps each image path to its center on screen, or None if not visible.
+    """
+    image_paths = list(image_paths)
+    with tracer.span("match", "many", templates=len(image_paths)):
+        matches = _matcher.locate_many(image_paths, frame=frame, confidence=confidence)
+    visible = {path: match.center if match else None for path, match in matches.items()}
+    logging.info(
+        "Visible templates: "
+        + ", ".join(f"{path}={'yes' if center else 'no'}" for path, center in visible.items())
+    )
+    return visible
+
+
+def _locate_at_hints(image_paths, confidence):
+    """
+    Looks for images only around their location hints, capturing those
+    areas at the same time.
+
+    Returns:
+        list of str: The images found at their hints; empty if none was, or
+        if some image has no hint (the whole screen is captured for it anyway).
+    """
+    rotation = log_context.rotation()
+    regions = {path: _matcher.hint_region(path, rotation) for path in image_paths}
+    if not regions or None in regions.values():
+        return []
+    with tracer.span("capture", "hints", regions=len(regions)):
+        frames = _matcher.grab_many(regions.values())
+    return [
+        path
+        for (path, region), frame in zip(regions.items(), frames)
+        if _locate(path, frame, confidence, region=region)
+    ]
+
+
+@traced("wait-templates", attr_args=("timeout_seconds",))
+def wait_for_templates(image_paths, timeout_seconds=10, confidence=0.8):
+    """
+    Waits until at least one of several images is visible.
+
+    Each poll captures the screen once and matches every image against that
+    frame; a frame that has not changed since the last match is not matched
+    again. With timeout_seconds None, it waits until one appears (or the run
+    is cancelled). If every image has a location hint, the areas around the
+    hints are captured and checked first; the images found there are
+    returned without looking at the rest of the screen.
+
+    Returns:
+        list of str: The visible images; empty if none appeared within timeout_seconds.
+    """
+    logging.info(f"Waiting for any of: {', '.join(image_paths)}...")
+    detector = FrameChangeDetector()
+    # The images usually appear within a second or two; a short idle backoff
+    # keeps the wait from overshooting by much.
+    poll_interval = AdaptiveInterval(0.1, 0.5)
+    deadline = None if timeout_seconds is None else desktop.clock() + timeout_seconds
+    found = _locate_at_hints(image_paths, confidence)
+    if found:
+        return found
+    frame, changed = _grab(detector)
+    while True:
+        if changed:
+            visible = locate_visible_templates(image_paths, confidence, frame=frame)
+            found = [path for path, center in visible.items() if center]
+            if found:
+                return found
+        if deadline is not None and desktop.clock() >= deadline:
+            logging.info(f"None of {', '.join(image_paths)} appeared within {timeout_seconds}s.")
+            return []
+        frame, changed = _wait_for_next_check(detector, poll_interval, deadline)
+
+
+def _wait_for_next_check(detector, poll_interval, deadline, region=None):
+    """
+    Polls the screen until it changes or the deadline passes, whichever is first.
+
+    Args:
+        detector (FrameChangeDetector): Holds the frame the last match ran on.
+        poll_interval (AdaptiveInterval): Supplies the (backing off) delay between polls.
+        deadline (float): desktop.clock() value to stop at; None waits for a change only.
+        region (tuple): Only this part of the screen is captured; None captures all of it.
+
+    Returns:
+        tuple: (FramePyramid, bool) - the latest frame and whether it differs
+        from the one the last match ran on.
+    """
+    while True:
+        delay = poll_interval.delay
+        if deadline is not None:
+            delay = min(delay, max(0.0, deadline - desktop.clock()))
+        _sleep(delay, "poll")
+        frame, changed = _grab(detector, region)
+        poll_interval.next_delay(changed)
+        if changed or (deadline is not None and desktop.clock() >= deadline):
+            return frame, changed
+
+
+@traced("find", "image_path", ("action_type", "max_retries", "wait_to_disappear"))
 def find_and_interact(
     image_path,
     action_type="click",
@@ -238,110 +637,171 @@ def find_and_interact(
     Finds an image on screen, performs an action, retries if not found,
     and handles errors including saving a debug screenshot and exiting on failure.
     Supports infinite retries if max_retries is float('inf').
+
+    Between checks the screen is polled cheaply: matching only re-runs when the
+    frame changed, so a retry on an unchanged screen reuses the previous miss.
+    A retry is still counted once per RETRY_DELAY_SECONDS, keeping the overall
+    timeout the same as a fixed 1s retry loop. If the image has a location
+    hint, the first check captures only the area around it; while waiting for
+    the image to disappear, only the area around the hit is captured and searched.
     """
     CONFIDENCE_LEVEL = 0.8
     # MAX_RETRIES is now a parameter
     RETRY_DELAY_SECONDS = 1
-
+    # Idle screens are polled less often the longer nothing changes, but at
+    # least once per retry, so backing off never delays a retry.
+    MIN_POLL_SECONDS = 0.1
+    MAX_IDLE_POLL_SECONDS = RETRY_DELAY_SECONDS
+    # Pixels around a clicked image captured while waiting for it to disappear.
+    DISAPPEAR_MARGIN = 24
+
+    detector = FrameChangeDetector()
+    poll_interval = AdaptiveInterval(MIN_POLL_SECONDS, MAX_IDLE_POLL_SECONDS)
+    search_region = _matcher.region_for(image_path)
+    hinted_region = _matcher.hint_region(image_path, log_context.rotation())
+    frame, changed = _grab(detector, hinted_region or search_region)
+    retry_deadline = None
     initial_location = None
     attempt = 0
     while True:  # Loop potentially indefinitely
-        try:
-            location = pyautogui.locateCenterOnScreen(
-                image_path, confidence=CONFIDENCE_LEVEL
+        match = None
+        if changed:
+            match = _locate(
+                image_path, frame, CONFIDENCE_LEVEL, region=hinted_region, attempt=attempt + 1
             )
-            if location:
-                logging.info(f"Found {image_path} at: {location}")
-
-                initial_location = location  # Store the first location
-
-                if action_type == "click":
-                    pyautogui.click(location)
-                    logging.info(f"Clicked on {image_path}")
-                elif action_type == "right_click":
-                    pyautogui.rightClick(location)
-                    logging.info(f"Right-clicked on {image_path}")
-                else:
-                    logging.info(
-                        f"Action '{action_type}' ignored on {image_path} at {location}"
-                    )
-                    if wait_to_disappear:
-                        logging.warning(
-                            f"wait_to_disappear=True but action_type is '{action_type}'. Disappearance check will be skipped as no action was performed to make it disappear."
-                        )
-                    return location  # Success (image found, no action), return location and exit function
-
-                # --- Start wait_to_disappear logic ---
+        if match is None and hinted_region is not None:
+            # Not at its hint: capture the whole search area right away.
+            hinted_region = None
+            frame, changed = _grab(detector, search_region)
+            continue
+        if match:
+            location = match.center
+            logging.info(f"Found {image_path} at: {location}")
+
+            initial_location = location  # Store the first location
+
+            if action_type == "click":
+                _input("click", location, template=image_path)
+                log_context.invalidate()
+                logging.info(f"Clicked on {image_path}")
+            elif action_type == "right_click":
+                _input("right_click", location, template=image_path)
+                log_context.invalidate()
+                logging.info(f"Right-clicked on {image_path}")
+            else:
+                logging.info(
+                    f"Action '{action_type}' ignored on {image_path} at {location}"
+                )
                 if wait_to_disappear:
-                    logging.info(
-                        f"Waiting for {image_path} to disappear (action will be retried up to {max_retries} times if it doesn't)..."
-                    )
-                    disappear_retry_count = (
-                        0  # Number of times the action has been retried
+                    logging.warning(
+                        f"wait_to_disappear=True but action_type is '{action_type}'. Disappearance check will be skipped as no action was performed to make it disappear."
                     )
+                return location  # Success (image found, no action), return location and exit function
 
-                    while True:
-                        time.sleep(
-                            RETRY_DELAY_SECONDS
-                        )  # Wait before checking visibility / after an action
-
-                        try:
-                            # Attempt to find the image. If it's gone, pyautogui.locateCenterOnScreen will raise ImageNotFoundException.
-                            current_location_check = pyautogui.locateCenterOnScreen(
-                                image_path, confidence=CONFIDENCE_LEVEL
+            # --- Start wait_to_disappear logic ---
+            if wait_to_disappear:
+                logging.info(
+                    f"Waiting for {image_path} to disappear (action will be retried up to {max_retries} times if it doesn't)..."
+                )
+                disappear_retry_count = (
+                    0  # Number of times the action has been retried
+                )
+                last_seen_location = location
+                # The check area is a new, smaller frame, so it gets its own
+                # detector; the first capture of it is always matched.
+                check_region = _around(match, frame, DISAPPEAR_MARGIN)
+                detector = FrameChangeDetector()
+                poll_interval.next_delay(True)
+                retry_deadline = desktop.clock() + RETRY_DELAY_SECONDS
+
+                while True:
+                    # Wait before checking visibility / after an action. A screen
+                    # change ends the wait early.
+                    frame, changed = _wait_for_next_check(
+                        detector, poll_interval, retry_deadline, check_region
+                    )
+                    retry_due = desktop.clock() >= retry_deadline
+
+                    # Only the area we just clicked is captured and checked.
+                    # An unchanged frame still shows the image, so it is not re-matched.
+                    current_location_check = last_seen_location
+                    if changed:
+                        check_match = _locate(
+                            image_path,
+                            frame,
+                            CONFIDENCE_LEVEL,
+                            region=check_region,
+                            attempt=disappear_retry_count + 1,
+                            # Not finding the image here is the expected
+                            # outcome, not a sign that its hint is stale.
+                            full_search=False,
+                        )
+                        current_location_check = check_match.center if check_match else None
+
+                    if current_location_check is None:
+                        # SUCCESS: the image is no longer found.
+                        total_actions_performed = (
+                            disappear_retry_count + 1
+                        )  # Initial action + number of retries
+                        logging.info(
+                            f"{image_path} has disappeared as expected. Total actions performed: {total_actions_performed}."
+                        )
+                        break  # Exit disappearance loop, success
+                    last_seen_location = current_location_check
+
+                    if not retry_due:
+                        # The screen changed but the image is still there; give
+                        # the previous action the rest of its retry window.
+                        continue
+
+                    # If we are here, the image is STILL VISIBLE.
+                    # Check if we have exhausted retries for re-performing the action.
+                    if (
+                        max_retries != float("inf")
+                        and disappear_retry_count >= max_retries
+                    ):
+                        logging.error(
+                            f"Image {image_path} did not disappear after {disappear_retry_count} re-attempts of action '{action_type}'. Max retries reached."
+                        )
+                        if exit_on_timeout:
+                            save_debug_screenshot_and_exit(
+                                f"{image_path} (failed to disappear after {disappear_retry_count} re-attempts of action)"
                             )
+                        return None  # The caller (e.g. a workflow step) handles the failure
 
-                            # If we are here, the image is STILL VISIBLE.
-                            # Check if we have exhausted retries for re-performing the action.
-                            if (
-                                max_retries != float("inf")
-                                and disappear_retry_count >= max_retries
-                            ):
-                                logging.error(
-                                    f"Image {image_path} did not disappear after {disappear_retry_count} re-attempts of action '{action_type}'. Max retries reached."
-                                )
-                                save_debug_screenshot_and_exit(
-                                    f"{image_path} (failed to disappear after {disappear_retry_count} re-attempts of action)"
-                                )
-                                return initial_location  # Should not be reached due to exit
-
-                            # Image is still visible, and we have retries left (or infinite retries).
-                            logging.info(
-                                f"Disappearance check: {image_path} still visible at {current_location_check}. Re-attempting action '{action_type}' (re-attempt {disappear_retry_count + 1}{f'/{max_retries}' if max_retries != float('inf') else '/inf'})."
-                            )
+                    # Image is still visible, and we have retries left (or infinite retries).
+                    logging.info(
+                        f"Disappearance check: {image_path} still visible at {current_location_check}. Re-attempting action '{action_type}' (re-attempt {disappear_retry_count + 1}{f'/{max_retries}' if max_retries != float('inf') else '/inf'})."
+                    )
 
-                            # Re-perform the action on the (potentially new) location
-                            if action_type == "click":
-                                pyautogui.click(current_location_check)
-                                logging.info(
-                                    f"Clicked again on {image_path} at {current_location_check}"
-                                )
-                            elif action_type == "right_click":
-                                pyautogui.rightClick(current_location_check)
-                                logging.info(
-                                    f"Right-clicked again on {image_path} at {current_location_check}"
-                                )
-                            # Add other action types here if they are supported by wait_to_disappear
-
-                            disappear_retry_count += (
-                                1  # Increment the count of re-attempts
-                            )
+                    # Re-perform the action on the (potentially new) location
+                    if action_type == "click":
+                        _input("click", current_location_check, template=image_path)
+                        log_context.invalidate()
+                        logging.info(
+                            f"Clicked again on {image_path} at {current_location_check}"
+                        )
+                    elif action_type == "right_click":
+                        _input("right_click", current_location_check, template=image_path)
+                        log_context.invalidate()
+                        logging.info(
+                            f"Right-clicked again on {image_path} at {current_location_check}"
+                        )
+                    # Add other action types here if they are supported by wait_to_disappear
 
-                        except pyautogui.ImageNotFoundException:
-                            # SUCCESS: ImageNotFoundException means the image is no longer found.
-                            total_actions_performed = (
-                                disappear_retry_count + 1
-                            )  # Initial action + number of retries
-                            logging.info(
-                                f"{image_path} has disappeared as expected. Total actions performed: {total_actions_performed}."
-                            )
-                            break  # Exit disappearance loop, success
-                    # End of disappearance while-loop
-                # --- End wait_to_disappear logic ---
+                    disappear_retry_count += (
+                        1  # Increment the count of re-attempts
+                    )
+                    poll_interval.next_delay(True)
+                    retry_deadline = desktop.clock() + RETRY_DELAY_SECONDS
+                # End of disappearance while-loop
+            # --- End wait_to_disappear logic ---
 
-                return initial_location  # Success, return initial_location and exit function
+            return initial_location  # Success, return initial_location and exit function
 
-        except pyautogui.ImageNotFoundException:
+        # Not found. A retry is only used up once its window has elapsed, so
+        # early re-checks triggered by screen changes are free.
+        if retry_deadline is None or desktop.clock() >= retry_deadline:
             attempt += 1
             # Check if we have exceeded retries, but only if max_retries is not infinite
             if max_retries != float("inf") and attempt >= max_retries:
@@ -356,8 +816,13 @@ def find_and_interact(
             logging.info(
                 f"Attempt {attempt}{f'/{max_retries}' if max_retries != float('inf') else ''}: {image_path} not found on screen. Retrying {f'indefinitely ' if max_retries == float('inf') else ''}(delay: {RETRY_DELAY_SECONDS}s)."
             )
+            if max_retries != float("inf"):
+                retry_deadline = desktop.clock() + RETRY_DELAY_SECONDS
 
-            time.sleep(RETRY_DELAY_SECONDS)
+        # With infinite retries there is no deadline: wait for the screen to change.
+        frame, changed = _wait_for_next_check(
+            detector, poll_interval, retry_deadline, search_region
+        )
 
     # This part should ideally not be reached because the loop either
     # returns on success, exits on failure, or continues indefinitely.
@@ -366,61 +831,170 @@ def find_and_interact(
     return None
 
 
-if True:
-    # --- Main script execution ---
-    active_settings_window_title = wait_for_window_title("ThinkbookEinkPlus")
-    time.sleep(4)  # Wait for the switch to tablet mode to complete
-    find_and_interact(
-        "switch-to-tablet.png", action_type="click", max_retries=float("inf")
-    )
+def launch_uri(uri):
+    """Opens a URI (e.g. an ms-settings: page) through explorer.exe."""
+    logging.info(f"Launching {uri}...")
+    _input("launch_uri", uri)
+    log_context.invalidate()
 
-    # if screen orientation != 90
-    if get_screen_rotation() != 90:
-        logging.info("Screen rotation is not 90 degrees. Attempting to rotate...")
-        # Find and right-click the logo
-        find_and_interact("lenovo.logo.png", action_type="right_click")
 
-        time.sleep(1)
-        # Find and click the relevant rotate button
-        find_and_interact("rotate.png", action_type="click")
+@traced("stable-screen", attr_args=("quiet_seconds", "timeout_seconds"))
+def wait_for_stable_screen(quiet_seconds=0.5, timeout_seconds=4, min_seconds=0, poll_seconds=0.1):
+    """
+    Waits until the screen has not changed for quiet_seconds, and at least min_seconds.
 
-    find_and_interact("windows-logo.png", action_type="click", wait_to_disappear=True)
+    Returns:
+        bool: True once the screen is stable, False if timeout_seconds passed first.
+    """
+    detector = FrameChangeDetector()
+    start_time = last_change = desktop.clock()
+    while True:
+        _, changed = _grab(detector)
+        now = desktop.clock()
+        if changed:
+            last_change = now
+        if now - last_change >= quiet_seconds and now - start_time >= min_seconds:
+            logging.info(f"Screen stable after {now - start_time:.2f}s.")
+            return True
+        if now - start_time >= timeout_seconds:
+            logging.info(f"Screen still changing after {timeout_seconds}s; continuing.")
+            return False
+        _sleep(poll_seconds, "stable-poll")
+
+
+def _observe_screen_rotation():
+    """Reads the rotation from the OS, refreshing the cached log context if it changed."""
+    rotation = get_screen_rotation()
+    if rotation != log_context.rotation():
+        log_context.invalidate()
+    return rotation
+
+
+def build_workflow_context(on_failure=save_debug_screenshot_and_exit):
+    """Binds the workflow steps to this module's desktop operations."""
+    return WorkflowContext(
+        wait_for_window_title=lambda substring, max_wait_seconds, interval_seconds: wait_for_window_title(
+            substring, max_wait_seconds, interval_seconds, exit_on_timeout=False
+        ),
+        find_and_interact=lambda image_path, action_type, max_retries, wait_to_disappear: find_and_interact(
+            image_path,
+            action_type=action_type,
+            max_retries=max_retries,
+            wait_to_disappear=wait_to_disappear,
+            exit_on_timeout=False,
+        ),
+        get_screen_rotation=_observe_screen_rotation,
+        press_keys=press_with_pause,
+        launch_uri=launch_uri,
+        wait_for_stable_screen=wait_for_stable_screen,
+        wait_for_templates=wait_for_templates,
+        on_failure=on_failure,
+        clock=desktop.clock,
+        sleep=lambda seconds: _sleep(seconds, "step-poll"),
+        cancel=run_cancel.set,
+    )
 
 
-# Launch High Contrast settings page
-logging.info(
-    "Launching High Contrast settings page (ms-settings:easeofaccess-highcontrast)..."
-)
-subprocess.run(
-    ["explorer.exe", "ms-settings:easeofaccess-highcontrast"],
-    check=False,
-    shell=True,
+def run_workflow(workflow, on_failure=save_debug_screenshot_and_exit):
+    """
+    Runs a workflow against the current desktop and returns its StepResults.
+
+    frame_history is cleared before and after the run, so a failure dump only
+    shows frames of the run that failed and a resident process does not keep
+    the last run's frames in memory. run_cancel is reset for the run.
+    """
+    run_cancel.clear()
+    frame_history.clear()
+    try:
+        return workflow.run(build_workflow_context(on_failure=on_failure))
+    finally:
+        frame_history.clear()
+
+
+# --- Main workflow definition ---
+# Every former fixed sleep is now a wait for the condition it stood in for:
+# the image lookups poll until the Lenovo UI is ready, rotation completes when
+# the new orientation is reported, and the Settings page is driven once its
+# window is active and the screen has stopped redrawing.
+ROTATE_TO_PORTRAIT = RotateIfNeeded(
+    90,
+    [
+        LocateAndClick("lenovo.logo.png", action_type="right_click"),
+        # Extra retries cover the context menu opening (was a fixed 1s sleep).
+        LocateAndClick("rotate.png", max_retries=5),
+    ],
 )
 
-# Wait for the Settings window to become active
-active_settings_window_title = wait_for_window_title("Settings")
-# If the function returns, the window was found (due to default exit_on_timeout=True).
-# The script will have exited via save_debug_screenshot_and_exit if the window wasn't found in time.
-
-# The script continues here if the window was found
-# The next line in your script was time.sleep(2)
-time.sleep(4)
-# Press Tab twice
-logging.info("Starting to select eink theme...Pressing Tab twice...")
-press_with_pause("tab", pause_seconds=0.1)  # First tab with pause
-pyautogui.press("tab")  # Second tab (original had no sleep after this specific press)
-for _ in range(5):
-    press_with_pause("down", pause_seconds=0.1)
-# tab, then enter
-logging.info("Pressing Tab, then Enter...")
-press_with_pause("tab", pause_seconds=0.1)  # Tab with pause
-pyautogui.press("enter")  # Enter (original had no sleep after this specific press)
-
-active_settings_window_title = wait_for_window_title(
-    "Settings", max_wait_seconds=30, interval_seconds=0.5
+TABLET_MODE_WORKFLOW = Workflow(
+    "tablet-mode",
+    [
+        # The Lenovo app is ready once its window is active and its button is
+        # drawn; the two checks are independent, so they run side by side.
+        # Like the click below, the button wait has no time limit; if the
+        # window wait times out, it is cancelled.
+        Concurrent(
+            [
+                WaitForWindow("ThinkbookEinkPlus"),
+                WaitForTemplates(["switch-to-tablet.png"], timeout_seconds=None),
+            ],
+            name="eink-app-ready",
+        ),
+        LocateAndClick("switch-to-tablet.png", max_retries=float("inf")),
+        # The tablet desktop is up once either taskbar logo is drawn; both are
+        # checked on one capture per poll.
+        WaitForTemplates(["lenovo.logo.png", "windows-logo.png"], name="tablet-desktop"),
+        ROTATE_TO_PORTRAIT,
+        LocateAndClick("windows-logo.png", wait_to_disappear=True),
+        # Select the e-ink high contrast theme
+        LaunchUri("ms-settings:easeofaccess-highcontrast"),
+        WaitForWindow("Settings"),
+        # The keys below are pressed blind, so never earlier than the fixed 4 s
+        # sleep this replaces: an e-ink redraw can pause for half a second.
+        WaitForStableScreen(quiet_seconds=0.5, timeout_seconds=8, min_seconds=4),
+        KeySequence(["tab", "tab"] + ["down"] * 5 + ["tab", "enter"], name="select-eink-theme"),
+        WaitForWindow("Settings", timeout_seconds=30, interval_seconds=0.5),
+        # Close the Settings window
+        KeySequence([("alt", "f4")], pause_seconds=0),
+    ],
 )
 
-# press alt + f4 to close the settings window
-logging.info("Pressing Alt + F4 to close the Settings window...")
-pyautogui.hotkey("alt", "f4")
-logging.info("Script completed successfully.")
+ROTATE_WORKFLOW = Workflow("rotate", [ROTATE_TO_PORTRAIT])
+
+# Workflows the resident daemon (tablet_daemon.py) can be asked to run.
+WORKFLOWS = {"tablet": TABLET_MODE_WORKFLOW, "rotate": ROTATE_WORKFLOW}
+
+
+def warm_up():
+    """
+    Loads every template variant and captures one frame, so the first
+    workflow step does not pay for it. Used by the resident daemon.
+    """
+    for image_path in TEMPLATE_IMAGES:
+        _matcher.load_variants(image_path)
+    _matcher.grab()
+    log_context.invalidate()
+
+
+def export_trace(path):
+    """Writes the recorded spans as Chrome trace JSON and logs the span summary."""
+    tracer.write_chrome_trace(path)
+    logging.info(f"Trace written to {path} ({len(tracer.spans)} spans):\n{tracer.summary_table()}")
+
+
+def main():
+    # TABLET_MODE_TRACE=trace.json records spans and writes them on exit.
+    trace_path = os.environ.get("TABLET_MODE_TRACE")
+    if trace_path:
+        tracer.enable()
+    try:
+        use_desktop(WindowsDesktop(pixel_format=CAPTURE_PIXEL_FORMAT, monitor=CAPTURE_MONITOR))
+        run_workflow(TABLET_MODE_WORKFLOW)
+        logging.info("Script completed successfully.")
+        logging.info(f"Log context cache: {log_context.stats()}")
+    finally:
+        if trace_path:
+            export_trace(trace_path)
+
+
+if __name__ == "__main__":
+    main()
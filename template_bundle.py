@@ -0,0 +1,261 @@
+# Precompiled template bundle for template_matcher.py.
+# Decoding the PNG templates, resizing them and building their pyramids
+# is repeated by every run of tablet_mode.py. A bundle stores all of that as
+# raw grayscale arrays in one file, which is memory-mapped at startup: the
+# matcher uses the mapped arrays directly, with nothing decoded or copied.
+#
+# File layout: MAGIC, index length (uint32), JSON index, then the arrays,
+# each starting on an ALIGNMENT boundary. The index records the pyramid
+# parameters, and per template its source PNG size/mtime and, per scale
+# variant, the offset and shape of every pyramid level.
+#
+# Usage: python template_bundle.py build BUNDLE TEMPLATE.png... [--scales ..]
+import argparse
+import json
+import os
+import struct
+import sys
+import tempfile
+
+import cv2
+import numpy as np
+
+from template_matcher import build_template_variants
+
+MAGIC = b"EINKTPL1"
+INDEX_LENGTH = struct.Struct("<I")
+ALIGNMENT = 64
+VERSION = 2
+
+
+def _variant_key(scale):
+    return f"{float(scale):g}"
+
+
+def _source_stamp(path):
+    stat = os.stat(path)
+    return {"size": stat.st_size, "mtime_ns": stat.st_mtime_ns}
+
+
+def build_bundle(path, template_paths, scales=(1.0,), max_level=3, min_side=12):
+    """
+    Compiles templates into a bundle file (written atomically).
+
+    Args:
+        path (str): Bundle file to write.
+        template_paths (list of str): Template PNGs, stored under these names.
+        scales: Variants to precompute, as for PyramidMatcher.
+        max_level, min_side: Pyramid limits; must match the matcher's to be used.
+
+    Returns:
+        int: Bundle size in bytes.
+    """
+    index = {
+        "version": VERSION,
+        "max_level": max_level,
+        "min_side": min_side,
+        "templates": {},
+    }
+    arrays = []
+    for template_path in template_paths:
+        image = cv2.imread(template_path, cv2.IMREAD_GRAYSCALE)
+        if image is None:
+            raise FileNotFoundError(f"Could not read template image: {template_path}")
+        entry = {"source": _source_stamp(template_path), "variants": {}}
+        for variant in build_template_variants(template_path, image, scales, max_level, min_side):
+            levels = []
+            for level in variant.levels:
+                levels.append({"shape": list(level.shape), "offset": None})
+                arrays.append((levels[-1], np.ascontiguousarray(level, dtype=np.uint8)))
+            entry["variants"][_variant_key(variant.scale)] = levels
+        index["templates"][template_path] = entry
+
+    # Offsets depend on the index length, which depends on the offsets' digits;
+    # lay out twice so the second pass sees the final index size.
+    for _ in range(2):
+        encoded = json.dumps(index, sort_keys=True).encode("utf-8")
+        offset = _align(len(MAGIC) + INDEX_LENGTH.size + len(encoded))
+        for level, array in arrays:
+            level["offset"] = offset
+            offset = _align(offset + array.nbytes)
+    encoded = json.dumps(index, sort_keys=True).encode("utf-8")
+
+    # A unique temporary file next to the bundle: two processes rebuilding at
+    # once don't write into the same file, and os.replace() stays on one volume.
+    directory, name = os.path.split(os.path.abspath(path))
+    fd, tmp_path = tempfile.mkstemp(prefix=f"{name}.", suffix=".tmp", dir=directory)
+    try:
+        with os.fdopen(fd, "wb") as f:
+            f.write(MAGIC)
+            f.write(INDEX_LENGTH.pack(len(encoded)))
+            f.write(encoded)
+            for level, array in arrays:
+                f.write(b"\0" * (level["offset"] - f.tell()))
+                f.write(array.tobytes())
+            size = f.tell()
+        # mkstemp() creates the file readable by its owner only; give the
+        # bundle the permissions a plain open() would have.
+        os.chmod(tmp_path, 0o666 & ~_umask())
+        os.replace(tmp_path, path)
+    except BaseException:
+        os.unlink(tmp_path)
+        raise
+    return size
+
+
+def _umask():
+    # The only way to read the umask is to set it; put it straight back.
+    umask = os.umask(0o022)
+    os.umask(umask)
+    return umask
+
+
+def _align(offset):
+    return -(-offset // ALIGNMENT) * ALIGNMENT
+
+
+class TemplateBundle:
+    """
+    A memory-mapped template bundle.
+
+    levels() returns read-only array views into the mapping. Templates whose
+    source PNG changed since the bundle was built are reported as missing, so
+    the matcher falls back to decoding them.
+
+    Args:
+        path (str): Bundle file written by build_bundle().
+    """
+
+    def __init__(self, path):
+        self.path = path
+        with open(path, "rb") as f:
+            if f.read(len(MAGIC)) != MAGIC:
+                raise ValueError(f"{path} is not a template bundle")
+            (index_length,) = INDEX_LENGTH.unpack(f.read(INDEX_LENGTH.size))
+            index = json.loads(f.read(index_length).decode("utf-8"))
+        if index.get("version") != VERSION:
+            raise ValueError(f"{path} has unsupported bundle version {index.get('version')}")
+        self.max_level = index["max_level"]
+        self.min_side = index["min_side"]
+        self._map = np.memmap(path, dtype=np.uint8, mode="r")
+        self._templates = index["templates"]
+        self.stale = {
+            name for name, entry in self._templates.items() if not self._is_current(name, entry)
+        }
+
+    @staticmethod
+    def _is_current(name, entry):
+        try:
+            return _source_stamp(name) == entry["source"]
+        except OSError:
+            return False
+
+    def matches_pyramid(self, max_level, min_side):
+        """True if the bundle's pyramids were built with these limits."""
+        return self.max_level == max_level and self.min_side == min_side
+
+    def templates(self):
+        return list(self._templates)
+
+    def variants(self, name):
+        """Returns the scale keys stored for a template (current or not)."""
+        entry = self._templates.get(name)
+        return list(entry["variants"]) if entry else []
+
+    def has(self, name, scale):
+        """True if an up-to-date copy of this template variant is stored."""
+        entry = self._templates.get(name)
+        return (
+            entry is not None
+            and name not in self.stale
+            and _variant_key(scale) in entry["variants"]
+        )
+
+    def levels(self, name, scale):
+        """Returns the pyramid levels of one variant as array views, or None."""
+        if not self.has(name, scale):
+            return None
+        levels = self._templates[name]["variants"][_variant_key(scale)]
+        return [
+            np.ndarray(
+                tuple(level["shape"]), dtype=np.uint8, buffer=self._map, offset=level["offset"]
+            )
+            for level in levels
+        ]
+
+    def close(self):
+        # The mapping is released once the last view into it is gone.
+        self._map = None
+
+
+def open_bundle(path, template_paths, scales, max_level=3, min_side=12, rebuild=True):
+    """
+    Opens a bundle, (re)building it first if it is missing or out of date.
+
+    Out of date means built with other pyramid limits, from an older version
+    of a template PNG, or for other templates or variants than requested:
+    a bundle left over from a larger configuration is rebuilt too, so it
+    does not keep mapping variants nothing uses.
+    Returns None if the bundle can neither be opened nor built; the matcher
+    then simply decodes the PNGs.
+    """
+    bundle = None
+    try:
+        bundle = TemplateBundle(path)
+    except (OSError, ValueError) as e:
+        if os.path.exists(path):
+            print(f"WARNING: Ignoring unusable template bundle {path}: {e}", file=sys.stderr)
+    if bundle is not None and _covers(bundle, template_paths, scales, max_level, min_side):
+        return bundle
+    if not rebuild:
+        return bundle
+    if bundle is not None:
+        bundle.close()
+    try:
+        build_bundle(path, template_paths, scales, max_level, min_side)
+        return TemplateBundle(path)
+    except (OSError, ValueError) as e:
+        print(f"WARNING: Could not build template bundle {path}: {e}", file=sys.stderr)
+        return None
+
+
+def _covers(bundle, template_paths, scales, max_level, min_side):
+    """True if the bundle holds up-to-date copies of exactly these templates and variants."""
+    keys = {_variant_key(scale) for scale in scales}
+    return (
+        bundle.matches_pyramid(max_level, min_side)
+        and set(bundle.templates()) == set(template_paths)
+        and not bundle.stale
+        and all(set(bundle.variants(name)) == keys for name in template_paths)
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compile template PNGs into a memory-mappable bundle.")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    build = subparsers.add_parser("build", help="Build a bundle from template PNGs.")
+    build.add_argument("bundle", help="Bundle file to write.")
+    build.add_argument("templates", nargs="+", help="Template PNGs.")
+    build.add_argument("--scales", type=float, nargs="+", default=[1.0])
+    build.add_argument("--max-level", type=int, default=3)
+    build.add_argument("--min-side", type=int, default=12)
+    info = subparsers.add_parser("info", help="List the contents of a bundle.")
+    info.add_argument("bundle")
+    args = parser.parse_args()
+
+    if args.command == "build":
+        size = build_bundle(
+            args.bundle, args.templates, args.scales, args.max_level, args.min_side
+        )
+        print(f"Wrote {args.bundle}: {len(args.templates)} templates, {size / 1e6:.2f} MB")
+    else:
+        bundle = TemplateBundle(args.bundle)
+        print(f"{args.bundle}: max_level={bundle.max_level} min_side={bundle.min_side}")
+        for name in bundle.templates():
+            variants = bundle.variants(name)
+            state = " (stale)" if name in bundle.stale else ""
+            print(f"  {name}{state}: {len(variants)} variants: {', '.join(variants)}")
+
+
+if __name__ == "__main__":
+    main()
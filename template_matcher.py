@@ -0,0 +1,903 @@
+# Coarse-to-fine template matching for tablet_mode.py.
+# pyautogui.locateCenterOnScreen reloads the PNG and runs a full-resolution
+# OpenCV match over the whole screen on every call. This module keeps the
+# templates decoded, searches a downsampled pyramid of screen and template
+# first, and only refines the few promising windows at full resolution.
+# Templates can be limited to a region (a rectangle or a named monitor), so
+# only that part of the screen is captured and searched.
+import collections
+import concurrent.futures
+import contextlib
+import itertools
+import os
+import threading
+
+import cv2
+import numpy as np
+
+from screen_capture import (
+    PIXEL_BGRX,
+    PIXEL_GRAY,
+    PIXEL_MONO,
+    capture_regions,
+    intersect_rects,
+    unpack_mono,
+)
+
+Point = collections.namedtuple("Point", "x y")
+
+
+class Match(
+    collections.namedtuple(
+        "Match", "left top width height score scale", defaults=(None,)
+    )
+):
+    """
+    A template hit in screen coordinates, with its normalized correlation score
+    and the scale of the template variant that matched.
+    """
+
+    __slots__ = ()
+
+    @property
+    def center(self):
+        return Point(self.left + self.width // 2, self.top + self.height // 2)
+
+
+# --- Frame sources ---
+# A frame source has an `origin` (screen coordinates of the frame's top-left
+# pixel) and a `grab(region=None)` method returning a grayscale uint8 array.
+# With a region (left, top, width, height) in screen coordinates, grab()
+# returns only that part of the screen, as a FramePyramid carrying its origin.
+
+
+class ScreenFrameSource:
+    """Grabs the primary screen through pyautogui, the same area locateCenterOnScreen searches."""
+
+    origin = (0, 0)
+
+    def grab(self, region=None):
+        import pyautogui  # Imported lazily so saved-screenshot runs work headless
+
+        if region is None:
+            image = pyautogui.screenshot()
+            return cv2.cvtColor(np.asarray(image), cv2.COLOR_RGB2GRAY)
+        image = pyautogui.screenshot(region=tuple(region))
+        return FramePyramid(cv2.cvtColor(np.asarray(image), cv2.COLOR_RGB2GRAY), tuple(region[:2]))
+
+
+class _RegionCapturer:
+    """A region's capturer, the lock serializing its grabs, and whether it was evicted."""
+
+    def __init__(self, capturer):
+        self.capturer = capturer
+        self.lock = threading.Lock()
+        self.closed = False
+
+    def close(self):
+        with self.lock:
+            self.closed = True
+            self.capturer.close()
+
+
+class CapturerFrameSource:
+    """
+    Grabs the whole virtual screen through a screen_capture.ScreenCapturer.
+
+    The capturer's GDI resources and buffer are reused across grabs; only
+    the grayscale conversion allocates. `origin` follows the virtual screen,
+    so matches on monitors left of or above the primary one get the right
+    click coordinates.
+
+    A PIXEL_GRAY capturer's frames arrive already converted, so only a copy
+    is made. A PIXEL_MONO capturer's frames are unpacked to 0/255 for
+    matching, with the packed bits kept on the FramePyramid for cheap change
+    detection; `binary_threshold` then tells the matcher to binarize templates.
+
+    Region grabs go through one capturer per region, made by
+    capturer_factory(region), so each region keeps its own small buffer and
+    different regions can be captured concurrently. Without a factory they
+    share the main capturer.
+
+    Args:
+        capturer (screen_capture.ScreenCapturer): Captures whole-frame grabs.
+        capturer_factory (callable): Returns a new ScreenCapturer (with its
+            own backend) limited to the given region.
+        max_region_capturers (int): Least recently used region capturers
+            beyond this many are closed.
+    """
+
+    def __init__(self, capturer, capturer_factory=None, max_region_capturers=8):
+        self.capturer = capturer
+        self.capturer_factory = capturer_factory
+        self.max_region_capturers = max_region_capturers
+        self._lock = threading.Lock()  # The capture buffer is shared between grabs
+        self._region_capturers = collections.OrderedDict()  # region -> _RegionCapturer
+        self._regions_lock = threading.Lock()
+
+    @property
+    def origin(self):
+        return self.capturer.origin
+
+    @property
+    def binary_threshold(self):
+        if self.capturer.pixel_format == PIXEL_MONO:
+            return self.capturer.mono_threshold
+        return None
+
+    def grab(self, region=None):
+        if region is None:
+            with self._lock:
+                return self._convert(self.capturer, self.capturer.capture())
+        region = tuple(region)
+        if self.capturer_factory is None:
+            with self._lock:
+                frame = self._convert(self.capturer, self.capturer.capture(region))
+                origin = self.capturer.origin
+        else:
+            while True:
+                entry = self._region_capturer(region)
+                with entry.lock:
+                    if entry.closed:
+                        continue  # Evicted since the lookup; a new capturer is made
+                    capturer = entry.capturer
+                    frame = self._convert(capturer, capturer.capture())
+                    origin = capturer.origin
+                    break
+        if isinstance(frame, FramePyramid):
+            return frame
+        return FramePyramid(frame, origin)
+
+    def grab_many(self, regions):
+        """
+        Grabs several regions, returning one FramePyramid per region.
+
+        With a capturer_factory the regions' capturers blit at the same time
+        (screen_capture.capture_regions); otherwise, or with more regions
+        than max_region_capturers, they are grabbed one after another.
+        """
+        regions = [tuple(region) for region in regions]
+        unique = sorted(set(regions))  # Sorted, so concurrent calls lock in the same order
+        if self.capturer_factory is None or not 1 < len(unique) <= self.max_region_capturers:
+            return [self.grab(region) for region in regions]
+        while True:
+            entries = [self._region_capturer(region) for region in unique]
+            with contextlib.ExitStack() as stack:
+                for entry in entries:
+                    stack.enter_context(entry.lock)
+                if any(entry.closed for entry in entries):
+                    continue  # One was evicted since the lookup; look them up again
+                capturers = [entry.capturer for entry in entries]
+                frames = {}
+                for region, capturer, frame in zip(unique, capturers, capture_regions(capturers)):
+                    frame = self._convert(capturer, frame)
+                    if not isinstance(frame, FramePyramid):
+                        frame = FramePyramid(frame, capturer.origin)
+                    frames[region] = frame
+                break
+        return [frames[region] for region in regions]
+
+    def close(self):
+        with self._regions_lock:
+            entries = list(self._region_capturers.values())
+            self._region_capturers.clear()
+        for entry in entries:
+            entry.close()
+
+    def _region_capturer(self, region):
+        evicted = []
+        with self._regions_lock:
+            entry = self._region_capturers.get(region)
+            if entry is None:
+                entry = _RegionCapturer(self.capturer_factory(region))
+                self._region_capturers[region] = entry
+                while len(self._region_capturers) > self.max_region_capturers:
+                    evicted.append(self._region_capturers.popitem(last=False)[1])
+            self._region_capturers.move_to_end(region)
+        # Closed outside _regions_lock, so lookups don't wait for a grab in progress;
+        # a grab that looked an evicted entry up sees `closed` and looks again.
+        for old in evicted:
+            old.close()
+        return entry
+
+    @staticmethod
+    def _convert(capturer, frame):
+        pixel_format = capturer.pixel_format
+        if pixel_format == PIXEL_BGRX:
+            return cv2.cvtColor(frame, cv2.COLOR_BGRA2GRAY)
+        if pixel_format == PIXEL_GRAY:
+            return frame.copy()  # The capture buffer is reused
+        width = capturer.size[0]
+        return FramePyramid(unpack_mono(frame, width), capturer.origin, packed=frame)
+
+
+class FileFrameSource:
+    """
+    Replays saved screenshots (e.g. the output of mini_screenshot.py).
+
+    Each grab() returns the next file; once the list is exhausted the last
+    frame is returned again, like a screen that stopped changing.
+    """
+
+    origin = (0, 0)
+
+    def __init__(self, paths):
+        self.paths = list(paths)
+        if not self.paths:
+            raise ValueError("FileFrameSource needs at least one screenshot path")
+        self._index = 0
+
+    def grab(self, region=None):
+        path = self.paths[min(self._index, len(self.paths) - 1)]
+        self._index += 1
+        frame = cv2.imread(path, cv2.IMREAD_GRAYSCALE)
+        if frame is None:
+            raise FileNotFoundError(f"Could not read screenshot: {path}")
+        if region is not None:
+            return FramePyramid(frame).crop(region)
+        return frame
+
+
+_frame_serials = itertools.count()
+
+
+class FramePyramid:
+    """
+    A grayscale frame plus lazily built half-resolution levels (level 0 is full size).
+
+    `packed` optionally holds the same frame as 1-bit packed rows
+    (screen_capture.PIXEL_MONO), for change detection on the compact form.
+    `serial` identifies the capture; crops keep their frame's serial.
+    """
+
+    def __init__(self, frame, origin=(0, 0), packed=None, serial=None):
+        self.levels = [frame]
+        self.origin = origin
+        self.packed = packed
+        self.serial = next(_frame_serials) if serial is None else serial
+
+    @property
+    def shape(self):
+        return self.levels[0].shape
+
+    def level(self, index):
+        while len(self.levels) <= index:
+            self.levels.append(cv2.pyrDown(self.levels[-1]))
+        return self.levels[index]
+
+    def crop(self, region):
+        """
+        Returns the part of the frame inside region (screen coordinates) as a
+        FramePyramid sharing this frame's pixels.
+
+        Raises:
+            ValueError: If the region lies outside the frame.
+        """
+        origin_x, origin_y = self.origin
+        frame_h, frame_w = self.shape[:2]
+        left, top, width, height = region
+        clipped = intersect_rects(
+            (left - origin_x, top - origin_y, width, height), (0, 0, frame_w, frame_h)
+        )
+        if clipped is None:
+            raise ValueError(f"Region {tuple(region)} lies outside the frame")
+        if clipped == (0, 0, frame_w, frame_h):
+            return self
+        x, y, width, height = clipped
+        window = self.levels[0][y : y + height, x : x + width]
+        return FramePyramid(window, (origin_x + x, origin_y + y), serial=self.serial)
+
+
+class TemplatePyramid:
+    """A decoded template variant and its downsampled copies, built once per run."""
+
+    def __init__(self, name, image, max_level, min_side, scale=1.0):
+        self.name = name
+        self.scale = scale
+        self.levels = [image]
+        while len(self.levels) <= max_level:
+            height, width = self.levels[-1].shape[:2]
+            if min(height, width) // 2 < min_side:
+                break
+            self.levels.append(cv2.pyrDown(self.levels[-1]))
+
+    @classmethod
+    def from_levels(cls, name, levels, scale=1.0):
+        """Wraps already computed levels (e.g. arrays mapped from a template bundle)."""
+        template = cls.__new__(cls)
+        template.name = name
+        template.scale = scale
+        template.levels = list(levels)
+        return template
+
+    @property
+    def shape(self):
+        return self.levels[0].shape
+
+    @property
+    def coarsest_level(self):
+        return len(self.levels) - 1
+
+
+def build_template_variants(name, image, scales, max_level, min_side, threshold=None):
+    """
+    Precomputes every scaled copy of a template.
+
+    Args:
+        name (str): Template name (its path).
+        image (np.ndarray): Grayscale template as captured.
+        scales (iterable of float): Size factors, e.g. 1.25 for a display at 125%
+            of the scale the template was captured at.
+        max_level, min_side: Pyramid limits, as for TemplatePyramid.
+        threshold (int): If set, each copy is binarized at this gray level
+            after resizing, like a PIXEL_MONO capture of it would be.
+            (Resizing a binarized template would leave gray edges that a
+            thresholded frame never has.)
+
+    Returns:
+        list of TemplatePyramid: One per scale, in the given order.
+    """
+    variants = []
+    for scale in scales:
+        scaled = image
+        if scale != 1.0:
+            height, width = image.shape[:2]
+            size = (max(1, round(width * scale)), max(1, round(height * scale)))
+            interpolation = cv2.INTER_AREA if scale < 1.0 else cv2.INTER_LINEAR
+            scaled = cv2.resize(image, size, interpolation=interpolation)
+        if threshold is not None:
+            _, scaled = cv2.threshold(scaled, threshold - 1, 255, cv2.THRESH_BINARY)
+        variants.append(TemplatePyramid(name, scaled, max_level, min_side, scale))
+    return variants
+
+
+class PyramidMatcher:
+    """
+    Locates templates on a frame by searching a downsampled pyramid first.
+
+    The coarsest usable level is searched over the whole frame. Up to
+    `max_candidates` peaks scoring at least `confidence - coarse_slack` are
+    then re-matched at full resolution inside a small window around each
+    peak, and the best full-resolution score decides the result.
+
+    Args:
+        frame_source: Object with `grab()` and `origin`; defaults to the live screen.
+        confidence (float): Minimum full-resolution TM_CCOEFF_NORMED score for a hit.
+        max_level (int): Deepest pyramid level to search (each level halves the size).
+        min_template_side (int): Templates are never downsampled below this many pixels.
+        coarse_slack (float): How far below `confidence` a coarse peak may score and
+            still be refined. Downsampling blurs edges, so coarse scores run low.
+        max_candidates (int): Maximum number of coarse peaks refined per lookup.
+        max_workers (int): Thread pool size for locate_many(); OpenCV releases the
+            GIL while matching, so templates are matched in parallel.
+        hints (LocationHintCache): If given, the region around a template's last
+            hit is searched before the whole frame.
+        rotation_provider (callable): Returns the current screen rotation, used
+            to key the hints.
+        hint_margin (int): Pixels searched around a hinted rectangle.
+        scales (tuple of float): Template scales to precompute. Frames are
+            captured upright at any screen rotation, so templates are never
+            rotated.
+        scale_provider (callable): Returns the expected template scale (display
+            scale relative to the one the templates were captured at).
+        bundle (template_bundle.TemplateBundle): Precompiled templates; variants
+            found in it are used as-is instead of decoding and resizing PNGs.
+        template_threshold (int): Binarize templates at this gray level, to match
+            thresholded (PIXEL_MONO) captures. Defaults to the frame source's
+            binary_threshold, if it has one. Binarized templates are built from
+            the PNGs (resized, then thresholded); the bundle holds gray ones.
+        regions (dict): Template path -> region it is searched in: a
+            (left, top, width, height) rectangle in screen coordinates, a
+            monitor name, or a callable returning a rectangle. Only that part
+            of the screen is captured for the template (or, for a given
+            frame, searched). A template without one is searched on the
+            whole frame; either way that is the template's search area.
+        monitor_layout (screen_capture.MonitorLayout): Resolves monitor names
+            in `regions` and in locate()'s region argument.
+
+    When several variants exist, the one expected for the current display
+    scale is tried first, then the as-captured one (scale 1.0), so a
+    display scale that was read or configured wrong cannot hide a template
+    drawn exactly as it was captured. If both miss and nothing has matched
+    at this screen rotation and display scale yet, the remaining variants are swept, once
+    per frame: looking at the same frame (or a crop of it) again skips the
+    sweep, a new capture sweeps again. Callers that skip unchanged frames
+    (like tablet_mode's polling loops) therefore sweep once per screen
+    change. A variant that matched before is tried first afterwards; if it
+    misses, the expected and as-captured ones are tried too, so one false
+    positive cannot lock them out.
+
+    Hints are kept in search-area coordinates, keyed by the area's size, so
+    they also apply to a frame covering only part of the area (one grabbed
+    around hint_region(), say): the matcher remembers each search area's
+    position and size from the last frame of the whole area it saw.
+    """
+
+    def __init__(
+        self,
+        frame_source=None,
+        confidence=0.8,
+        max_level=3,
+        min_template_side=12,
+        coarse_slack=0.15,
+        max_candidates=5,
+        max_workers=None,
+        hints=None,
+        rotation_provider=None,
+        hint_margin=24,
+        scales=(1.0,),
+        scale_provider=None,
+        bundle=None,
+        template_threshold=None,
+        regions=None,
+        monitor_layout=None,
+    ):
+        self.frame_source = frame_source or ScreenFrameSource()
+        self.confidence = confidence
+        self.max_level = max_level
+        self.min_template_side = min_template_side
+        self.coarse_slack = coarse_slack
+        self.max_candidates = max_candidates
+        self._templates = {}
+        self._max_workers = max_workers or min(4, os.cpu_count() or 1)
+        self._pool = None
+        self.hints = hints
+        self.rotation_provider = rotation_provider or (lambda: 0)
+        self.hint_margin = hint_margin
+        self.scales = tuple(scales)
+        self.scale_provider = scale_provider or (lambda: 1.0)
+        if template_threshold is None:
+            template_threshold = getattr(self.frame_source, "binary_threshold", None)
+        self.template_threshold = template_threshold
+        self.bundle = bundle if template_threshold is None else None
+        self._variants = {}
+        self._confirmed = {}  # (path, rotation, scale) -> scale of the variant that matched there
+        self._swept = {}  # (path, rotation, scale) -> serial of the frame last swept
+        self._areas = {}  # search region (None: whole frame) -> (origin, size, rotation)
+        self.regions = dict(regions or {})
+        self.monitor_layout = monitor_layout
+
+    def load_template(self, image_path):
+        """Returns the decoded grayscale template image, reading the PNG only once."""
+        image = self._templates.get(image_path)
+        if image is None and self.bundle is not None:
+            levels = self.bundle.levels(image_path, 1.0)
+            if levels is not None:
+                image = levels[0]
+                self._templates[image_path] = image
+        if image is None:
+            image = cv2.imread(image_path, cv2.IMREAD_GRAYSCALE)
+            if image is None:
+                raise FileNotFoundError(f"Could not read template image: {image_path}")
+            self._templates[image_path] = image
+        return image
+
+    def load_variants(self, image_path):
+        """Returns every precomputed TemplatePyramid variant of a template (built once)."""
+        variants = self._variants.get(image_path)
+        if variants is None:
+            variants = []
+            for scale in self.scales:
+                levels = None
+                if self.bundle is not None and self.bundle.matches_pyramid(
+                    self.max_level, self.min_template_side
+                ):
+                    levels = self.bundle.levels(image_path, scale)
+                if levels is not None:
+                    variant = TemplatePyramid.from_levels(image_path, levels, scale)
+                else:
+                    variant = build_template_variants(
+                        image_path,
+                        self.load_template(image_path),
+                        (scale,),
+                        self.max_level,
+                        self.min_template_side,
+                        self.template_threshold,
+                    )[0]
+                variants.append(variant)
+            self._variants[image_path] = variants
+        return variants
+
+    def grab(self, region=None):
+        """
+        Captures a frame from the frame source and wraps it in a FramePyramid.
+
+        Args:
+            region: Rectangle or monitor name; only that part of the screen
+                is captured. None grabs the whole frame.
+        """
+        region = self._resolve_region(region)
+        if region is None:
+            frame = self.frame_source.grab()
+        else:
+            frame = self.frame_source.grab(region)
+        if isinstance(frame, FramePyramid):
+            return frame
+        return FramePyramid(frame, self.frame_source.origin)
+
+    def grab_many(self, regions):
+        """
+        Captures several parts of the screen at once; returns a FramePyramid per region.
+
+        Uses the frame source's grab_many() if it has one (concurrent region
+        captures), else grabs the regions one after another.
+        """
+        grab_many = getattr(self.frame_source, "grab_many", None)
+        if grab_many is None:
+            return [self.grab(region) for region in regions]
+        return grab_many([self._resolve_region(region) for region in regions])
+
+    def region_for(self, image_path):
+        """Returns the (left, top, width, height) a template is limited to, or None."""
+        return self._resolve_region(self.regions.get(image_path))
+
+    def hint_region(self, image_path, rotation=None):
+        """
+        Returns the screen rectangle around a template's location hint (grown
+        by hint_margin and clipped to the template's search area), or None.
+
+        Grabbing only this rectangle and passing it to locate() as the region
+        searches it with the hint. None if there is no hint for the current
+        rotation, or no frame of the whole search area was seen at that
+        rotation yet (the hints are keyed by the area's size).
+
+        Args:
+            image_path (str): Path of the template PNG.
+            rotation (int): Screen rotation the caller already read; None asks
+                rotation_provider.
+        """
+        if self.hints is None:
+            return None
+        if rotation is None:
+            rotation = self.rotation_provider()
+        area = self._areas.get(self.region_for(image_path))
+        if area is None or area[2] != rotation:
+            return None
+        (origin_x, origin_y), (width, height), _ = area
+        hint = self.hints.get(image_path, rotation, (width, height))
+        if hint is None:
+            return None
+        left, top, hint_w, hint_h = hint[0]
+        margin = self.hint_margin
+        return intersect_rects(
+            (origin_x + left - margin, origin_y + top - margin, hint_w + 2 * margin, hint_h + 2 * margin),
+            (origin_x, origin_y, width, height),
+        )
+
+    def locate(
+        self, image_path, frame=None, confidence=None, full_search=True, region=None, rotation=None
+    ):
+        """
+        Finds the best match of a template on a frame.
+
+        Args:
+            image_path (str): Path of the template PNG.
+            frame (FramePyramid): Frame to search; a new one is grabbed if None.
+            confidence (float): Overrides the matcher's default confidence.
+            full_search (bool): If False and a location hint exists, only the
+                hinted region is searched (e.g. to check that a just-clicked
+                button went away); a miss there then leaves the hint alone.
+            region: Rectangle or monitor name to search in, instead of the
+                template's whole search area (e.g. the rectangle from
+                hint_region(), or the area around a hit). Location hints are
+                used there once the search area itself was seen.
+            rotation (int): Screen rotation the caller already read; None asks
+                rotation_provider.
+
+        Returns:
+            Match: The best hit in screen coordinates.
+            None: If nothing scored at least `confidence`.
+        """
+        if rotation is None:
+            rotation = self.rotation_provider()
+        area_region = self.region_for(image_path)
+        if region is None:
+            frame = self.grab(area_region) if frame is None else frame
+            if area_region is not None:
+                frame = frame.crop(area_region)
+            area = self._remember_area(area_region, frame, rotation)
+        else:
+            region = self._resolve_region(region)
+            frame = self.grab(region) if frame is None else frame.crop(region)
+            area = self._areas.get(area_region)
+            if area is not None and area[2] != rotation:
+                area = None
+        return self._locate_in(image_path, frame, confidence, full_search, rotation, area)
+
+    def _remember_area(self, region, frame, rotation):
+        """Records frame as the latest view of a search area; returns the entry."""
+        frame_h, frame_w = frame.shape[:2]
+        area = self._areas[region] = (tuple(frame.origin), (frame_w, frame_h), rotation)
+        return area
+
+    def _locate_in(
+        self, image_path, frame, confidence=None, full_search=True, rotation=None, area=None
+    ):
+        # area: (origin, size, rotation) of the search area frame lies in;
+        # hints are only used if it is known.
+        if confidence is None:
+            confidence = self.confidence
+        variants = self.load_variants(image_path)
+        if rotation is None:
+            rotation = self.rotation_provider()
+        display_scale = self.scale_provider()
+        confirmed_key = (image_path, rotation, display_scale)
+        confirmed = self._confirmed.get(confirmed_key)
+
+        hint = None
+        hint_key = None
+        offset_x = offset_y = 0  # Search area coordinates minus frame coordinates
+        if self.hints is not None and area is not None:
+            (area_x, area_y), area_size, _ = area
+            offset_x, offset_y = frame.origin[0] - area_x, frame.origin[1] - area_y
+            hint_key = (image_path, rotation, area_size)
+            hint = self.hints.get(*hint_key)
+
+        preferred = confirmed or (hint[1] if hint else None)
+        first = self._pick_variant(variants, preferred, display_scale)
+        expected = self._pick_variant(variants, None, display_scale)
+        as_captured = self._pick_variant(variants, None, 1.0)
+
+        match = None
+        if hint is not None:
+            hint_left, hint_top, hint_w, hint_h = hint[0]
+            match = self._match_hint(
+                first, frame, (hint_left - offset_x, hint_top - offset_y, hint_w, hint_h), confidence
+            )
+            if match is None:
+                if not full_search:
+                    # Checking that the image went away: a miss is the expected
+                    # outcome, not evidence that the hint is stale.
+                    return None
+                self.hints.record_miss(*hint_key)
+
+        if match is None:
+            match = self._match_pyramid(first, frame, confidence)
+        tried = [first]
+        for variant in (expected, as_captured):
+            if match is None and variant not in tried:
+                tried.append(variant)
+                match = self._match_pyramid(variant, frame, confidence)
+        if (
+            match is None
+            and confirmed is None
+            and self._swept.get(confirmed_key) != frame.serial
+        ):
+            # Nothing has matched at this rotation/scale yet: sweep the other
+            # variants, but only once per frame.
+            self._swept[confirmed_key] = frame.serial
+            for variant in variants:
+                if variant not in tried:
+                    match = self._match_pyramid(variant, frame, confidence)
+                    if match is not None:
+                        break
+        if match is None:
+            return None
+
+        self._confirmed[confirmed_key] = match.scale
+        if hint_key is not None:
+            self.hints.record_hit(
+                *hint_key,
+                (match.left + offset_x, match.top + offset_y, match.width, match.height),
+                scale=match.scale,
+            )
+        origin_x, origin_y = frame.origin
+        return match._replace(left=match.left + origin_x, top=match.top + origin_y)
+
+    def locate_center(
+        self, image_path, frame=None, confidence=None, full_search=True, region=None
+    ):
+        """Like locate(), but returns only the center Point (or None)."""
+        match = self.locate(
+            image_path, frame=frame, confidence=confidence, full_search=full_search, region=region
+        )
+        return match.center if match else None
+
+    def best_match(self, image_path, frame, confidence=None):
+        """
+        Returns the best-scoring Match of any variant of a template, or None.
+
+        Unlike locate(), every variant is searched and no state (hints,
+        matched variants, sweeps) is read or written, so the result depends
+        on the frame alone; benchmark_matcher.py thresholds it at several
+        confidence levels.
+
+        Args:
+            image_path (str): Path of the template PNG.
+            frame (FramePyramid): Frame to search.
+            confidence (float): Lowest score reported; the matcher's default if None.
+        """
+        if confidence is None:
+            confidence = self.confidence
+        best = None
+        for variant in self.load_variants(image_path):
+            match = self._match_pyramid(variant, frame, confidence)
+            if match and (best is None or match.score > best.score):
+                best = match
+        if best is None:
+            return None
+        origin_x, origin_y = frame.origin
+        return best._replace(left=best.left + origin_x, top=best.top + origin_y)
+
+    def locate_many(self, image_paths, frame=None, confidence=None):
+        """
+        Matches several templates against a single captured frame.
+
+        Templates limited to a region are searched in that part of the frame.
+        Without a frame, one is grabbed: the smallest rectangle holding every
+        template's region, or the whole screen if some template has none.
+
+        Args:
+            image_paths (iterable of str): Template PNGs to look for.
+            frame (FramePyramid): Frame to search; new frames are grabbed if None.
+            confidence (float): Overrides the matcher's default confidence.
+
+        Returns:
+            dict: Maps each image path to its Match, or None if it is not visible.
+        """
+        image_paths = list(dict.fromkeys(image_paths))
+        regions = {path: self.region_for(path) for path in image_paths}
+        rotation = self.rotation_provider()
+        if frame is None:
+            frame = self.grab(_bounding_rect(regions.values()))
+        scoped = {
+            region: frame if region is None else frame.crop(region)
+            for region in regions.values()
+        }
+        areas = {
+            region: self._remember_area(region, scoped_frame, rotation)
+            for region, scoped_frame in scoped.items()
+        }
+
+        # Decode templates and build every pyramid level up front, so the
+        # worker threads only read shared state.
+        for region, scoped_frame in scoped.items():
+            deepest = max(
+                (
+                    variant.coarsest_level
+                    for path in image_paths
+                    if regions[path] == region
+                    for variant in self.load_variants(path)
+                ),
+                default=0,
+            )
+            scoped_frame.level(deepest)
+
+        def locate(path):
+            region = regions[path]
+            return self._locate_in(path, scoped[region], confidence, True, rotation, areas[region])
+
+        if len(image_paths) <= 1:
+            return {path: locate(path) for path in image_paths}
+        futures = {path: self._get_pool().submit(locate, path) for path in image_paths}
+        return {path: future.result() for path, future in futures.items()}
+
+    def _get_pool(self):
+        if self._pool is None:
+            self._pool = concurrent.futures.ThreadPoolExecutor(
+                max_workers=self._max_workers, thread_name_prefix="matcher"
+            )
+        return self._pool
+
+    def _resolve_region(self, region):
+        if region is None:
+            return None
+        if callable(region):
+            return tuple(region())
+        if isinstance(region, str):
+            if self.monitor_layout is None:
+                raise ValueError(
+                    f"Region {region!r} names a monitor, but the matcher has no monitor_layout"
+                )
+            return self.monitor_layout.rect(region)
+        return tuple(region)
+
+    def close(self):
+        """Shuts down the locate_many() thread pool, if one was started."""
+        if self._pool is not None:
+            self._pool.shutdown(wait=True)
+            self._pool = None
+
+    def expected_variant(self, image_path):
+        """Returns the TemplatePyramid variant locate() would try first right now."""
+        rotation = self.rotation_provider()
+        display_scale = self.scale_provider()
+        preferred = self._confirmed.get((image_path, rotation, display_scale))
+        return self._pick_variant(self.load_variants(image_path), preferred, display_scale)
+
+    @staticmethod
+    def _pick_variant(variants, preferred, display_scale):
+        """Returns the variant to try first: the one of the preferred scale, else the nearest."""
+        if preferred is not None:
+            for variant in variants:
+                if variant.scale == preferred:
+                    return variant
+        return min(variants, key=lambda v: abs(v.scale - display_scale))
+
+    def _match_hint(self, template, frame, hint, confidence):
+        frame_h, frame_w = frame.shape[:2]
+        hint_left, hint_top, hint_w, hint_h = hint
+        left = max(0, hint_left - self.hint_margin)
+        top = max(0, hint_top - self.hint_margin)
+        right = min(frame_w, hint_left + hint_w + self.hint_margin)
+        bottom = min(frame_h, hint_top + hint_h + self.hint_margin)
+        window = frame.level(0)[top:bottom, left:right]
+        return self._match_window(template, window, left, top, confidence)
+
+    def _match_pyramid(self, template, frame, confidence):
+        frame_h, frame_w = frame.shape[:2]
+        tmpl_h, tmpl_w = template.shape[:2]
+        if tmpl_h > frame_h or tmpl_w > frame_w:
+            return None
+
+        level = template.coarsest_level
+        if level == 0:
+            return self._match_window(template, frame.level(0), 0, 0, confidence)
+
+        coarse_scores = cv2.matchTemplate(
+            frame.level(level), template.levels[level], cv2.TM_CCOEFF_NORMED
+        )
+        candidates = _top_peaks(
+            coarse_scores,
+            confidence - self.coarse_slack,
+            self.max_candidates,
+            template.levels[level].shape[:2],
+        )
+
+        scale = 1 << level
+        margin = scale + 2  # Rounding error of one coarse pixel, plus a little slack
+        best = None
+        for coarse_x, coarse_y in candidates:
+            left = max(0, coarse_x * scale - margin)
+            top = max(0, coarse_y * scale - margin)
+            right = min(frame_w, coarse_x * scale + tmpl_w + margin)
+            bottom = min(frame_h, coarse_y * scale + tmpl_h + margin)
+            window = frame.level(0)[top:bottom, left:right]
+            match = self._match_window(template, window, left, top, confidence)
+            if match and (best is None or match.score > best.score):
+                best = match
+        return best
+
+    @staticmethod
+    def _match_window(template, window, left, top, confidence):
+        image = template.levels[0]
+        tmpl_h, tmpl_w = image.shape[:2]
+        if window.shape[0] < tmpl_h or window.shape[1] < tmpl_w:
+            return None
+        scores = cv2.matchTemplate(window, image, cv2.TM_CCOEFF_NORMED)
+        _, max_score, _, (x, y) = cv2.minMaxLoc(scores)
+        if max_score < confidence:
+            return None
+        return Match(left + x, top + y, tmpl_w, tmpl_h, float(max_score), template.scale)
+
+
+def _bounding_rect(rects):
+    """Smallest (left, top, width, height) holding all rectangles; None if any is None."""
+    rects = list(rects)
+    if not rects or any(rect is None for rect in rects):
+        return None
+    left = min(rect[0] for rect in rects)
+    top = min(rect[1] for rect in rects)
+    right = max(rect[0] + rect[2] for rect in rects)
+    bottom = max(rect[1] + rect[3] for rect in rects)
+    return left, top, right - left, bottom - top
+
+
+def _top_peaks(scores, threshold, limit, template_shape):
+    """
+    Returns up to `limit` (x, y) peaks of a score map above threshold,
+    suppressing the neighbourhood (one template size) around each peak found.
+    """
+    scores = scores.copy()
+    tmpl_h, tmpl_w = template_shape
+    peaks = []
+    while len(peaks) < limit:
+        _, max_score, _, (x, y) = cv2.minMaxLoc(scores)
+        if max_score < threshold:
+            break
+        peaks.append((x, y))
+        scores[
+            max(0, y - tmpl_h // 2) : y + tmpl_h // 2 + 1,
+            max(0, x - tmpl_w // 2) : x + tmpl_w // 2 + 1,
+        ] = -1.0
+    return peaks
@@ -0,0 +1,90 @@
+# Run with: python -m pytest test_frame_archive.py
+import datetime
+import os
+
+import numpy as np
+import pytest
+
+from frame_archive import FrameArchiveReader, FrameArchiveWriter
+from screen_capture import pack_mono, unpack_mono
+
+START = datetime.datetime(2026, 1, 5, 9, 30, 0)
+
+
+def _at(seconds):
+    return START + datetime.timedelta(seconds=seconds)
+
+
+def _frames(shape, count, seed=0):
+    """A screen that changes one small patch per frame."""
+    rng = np.random.default_rng(seed)
+    frame = rng.integers(0, 256, shape, dtype=np.uint8)
+    frames = []
+    for number in range(count):
+        frame = frame.copy()
+        frame[10 * number : 10 * number + 8, 20:40] = 255 - frame[10 * number : 10 * number + 8, 20:40]
+        frames.append(frame)
+    return frames
+
+
+@pytest.mark.parametrize("shape", [(96, 160), (96, 160, 4)])
+def test_frames_round_trip(tmp_path, shape):
+    path = str(tmp_path / "frames.arc")
+    frames = _frames(shape, 4)
+    with FrameArchiveWriter(path, tile_size=16) as writer:
+        kinds = [writer.append(frame, _at(number)) for number, frame in enumerate(frames)]
+        kinds.append(writer.append(frames[-1].copy(), _at(10)))
+
+    assert kinds == ["keyframe", "delta", "delta", "delta", "skipped"]
+    with FrameArchiveReader(path) as reader:
+        assert reader.timestamps() == [_at(number) for number in range(4)]
+        for number, frame in enumerate(frames):
+            assert np.array_equal(reader.frame_at(_at(number + 0.5)), frame)
+        # A skipped duplicate is served by the frame stored before it.
+        assert np.array_equal(reader.frame_at(_at(10)), frames[-1])
+        replayed = list(reader.frames())
+        with pytest.raises(KeyError):
+            reader.frame_at(_at(-1))
+    assert [timestamp for timestamp, _ in replayed] == reader.timestamps()
+    assert all(np.array_equal(a, b) for (_, a), b in zip(replayed, frames))
+
+
+def test_mono_frames_round_trip(tmp_path):
+    path = str(tmp_path / "mono.arc")
+    width = 150  # Not a multiple of 8: the last byte of each row is padded
+    frames = [unpack_mono(pack_mono(frame), width) for frame in _frames((80, width), 3)]
+    with FrameArchiveWriter(path, tile_size=4) as writer:
+        kinds = [
+            writer.append(pack_mono(frame), _at(number), packed_width=width)
+            for number, frame in enumerate(frames)
+        ]
+
+    assert kinds == ["keyframe", "delta", "delta"]
+    with FrameArchiveReader(path) as reader:
+        assert all(
+            np.array_equal(decoded, frame) for (_, decoded), frame in zip(reader.frames(), frames)
+        )
+        assert np.array_equal(reader.frame_at(_at(1)), frames[1])
+
+
+def test_reopening_drops_a_truncated_last_record(tmp_path):
+    path = str(tmp_path / "crashed.arc")
+    frames = _frames((64, 64), 3)
+    with FrameArchiveWriter(path, tile_size=16) as writer:
+        for number, frame in enumerate(frames[:2]):
+            writer.append(frame, _at(number))
+    intact_size = os.path.getsize(path)
+    with FrameArchiveWriter(path, tile_size=16) as writer:
+        writer.append(frames[2], _at(2))
+    with open(path, "r+b") as f:  # A crash in the middle of writing the last record
+        f.truncate(os.path.getsize(path) - 3)
+
+    with FrameArchiveReader(path) as reader:
+        assert reader.timestamps() == [_at(0), _at(1)]
+    with FrameArchiveWriter(path, tile_size=16) as writer:
+        assert os.path.getsize(path) == intact_size
+        assert writer.append(frames[2], _at(3)) == "keyframe"
+    with FrameArchiveReader(path) as reader:
+        assert reader.timestamps() == [_at(0), _at(1), _at(3)]
+        assert np.array_equal(reader.frame_at(_at(1)), frames[1])
+        assert np.array_equal(reader.frame_at(_at(3)), frames[2])
@@ -0,0 +1,63 @@
+# Run with: python -m pytest test_frame_change.py
+import numpy as np
+
+from frame_change import AdaptiveInterval, FrameChangeDetector
+from screen_capture import pack_mono
+
+
+def _frame(value=200, size=(256, 320)):
+    return np.full(size, value, dtype=np.uint8)
+
+
+def test_first_frame_and_size_changes_count_as_changed():
+    detector = FrameChangeDetector()
+    assert detector.changed(_frame())
+    assert not detector.changed(_frame())
+    assert detector.changed(_frame(size=(256, 256)))
+
+
+def test_small_noise_is_ignored_but_a_dialog_is_not():
+    detector = FrameChangeDetector()
+    frame = _frame()
+    detector.changed(frame)
+
+    noisy = frame.copy()
+    noisy[::7, ::5] = 203  # Dithering noise spread over the panel
+    assert not detector.changed(noisy)
+    dialog = frame.copy()
+    dialog[100:140, 100:180] = 0
+    assert detector.changed(dialog)
+
+
+def test_slow_fade_adds_up_against_the_last_changed_frame():
+    detector = FrameChangeDetector(tile_threshold=2.0)
+    detector.changed(_frame(200))
+    # Each step is under the threshold; the reference stays at 200.
+    assert not detector.changed(_frame(199))
+    assert not detector.changed(_frame(198))
+    assert detector.changed(_frame(197))
+    assert not detector.changed(_frame(196))
+
+
+def test_packed_frames():
+    detector = FrameChangeDetector()
+    frame = _frame(255)
+    assert detector.changed_packed(pack_mono(frame))
+    assert not detector.changed_packed(pack_mono(frame))
+
+    speck = frame.copy()
+    speck[10, 10] = 0  # One flipped pixel in a 64x64 tile
+    assert not detector.changed_packed(pack_mono(speck))
+    dialog = frame.copy()
+    dialog[100:140, 100:180] = 0
+    assert detector.changed_packed(pack_mono(dialog))
+    assert not detector.changed_packed(pack_mono(dialog))
+
+
+def test_adaptive_interval_backs_off_while_idle():
+    interval = AdaptiveInterval(min_delay=0.1, max_delay=0.3, backoff=2)
+    assert interval.delay == 0.1
+    assert interval.next_delay(False) == 0.2
+    assert interval.next_delay(False) == 0.3
+    assert interval.next_delay(False) == 0.3
+    assert interval.next_delay(True) == 0.1
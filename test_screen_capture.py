@@ -0,0 +1,77 @@
+# Run with: python -m pytest test_screen_capture.py
+import gc
+
+import numpy as np
+
+from screen_capture import PIXEL_BGRX, ScreenCapturer, SyntheticCaptureBackend
+
+
+def _fill(value):
+    def render(frame_index, buffer, left, top):
+        buffer[...] = value
+
+    return render
+
+
+def test_frame_outlives_reallocation_on_size_change():
+    backend = SyntheticCaptureBackend(64, 32, render=_fill(10))
+    capturer = ScreenCapturer(backend, pixel_format=PIXEL_BGRX)
+    old_frame = capturer.capture()
+    old_view = old_frame[4:8, 4:8]  # Frames are sliced and cropped by their users
+
+    backend.resize(48, 40)
+    backend.render = _fill(200)
+    new_frame = capturer.capture()
+
+    assert backend.allocations == 2
+    assert new_frame.shape == (40, 48, 4)
+    assert (new_frame == 200).all()
+    # The old buffer was not reused or freed while the frames still view it.
+    assert old_frame.shape == (32, 64, 4)
+    assert (old_frame == 10).all()
+    assert backend.released == 0
+
+    del old_frame
+    gc.collect()
+    assert backend.released == 0  # old_view still holds the buffer
+    assert (old_view == 10).all()
+
+    del old_view
+    gc.collect()
+    assert backend.released == 1
+
+
+def test_same_size_capture_reuses_buffer():
+    backend = SyntheticCaptureBackend(64, 32, render=_fill(10))
+    capturer = ScreenCapturer(backend, pixel_format=PIXEL_BGRX)
+    first = capturer.capture()
+    backend.render = _fill(20)
+    second = capturer.capture()
+
+    assert backend.allocations == 1
+    assert np.shares_memory(first, second)
+    assert (first == 20).all()  # Overwritten, as documented
+
+
+def _gradient(frame_index, buffer, left, top):
+    height, width = buffer.shape[:2]
+    xs = (np.arange(width) + left) % 256
+    ys = (np.arange(height) + top) % 256
+    buffer[..., :3] = ((xs[None, :] + ys[:, None]) % 256)[..., None]
+
+
+def test_grab_many_captures_each_region_concurrently():
+    from template_matcher import CapturerFrameSource
+
+    def capturer_factory(region):
+        return ScreenCapturer(SyntheticCaptureBackend(64, 32, render=_gradient), region=region)
+
+    source = CapturerFrameSource(capturer_factory(None), capturer_factory=capturer_factory)
+    whole = source.grab()
+    regions = [(40, 4, 16, 8), (2, 20, 10, 6), (40, 4, 16, 8)]
+    frames = source.grab_many(regions)
+
+    assert [frame.origin for frame in frames] == [region[:2] for region in regions]
+    for (left, top, width, height), frame in zip(regions, frames):
+        assert (frame.level(0) == whole[top : top + height, left : left + width]).all()
+    assert len(source._region_capturers) == 2  # One capturer per distinct region
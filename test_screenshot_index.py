@@ -0,0 +1,100 @@
+# Run with: python -m pytest test_screenshot_index.py
+import datetime
+import os
+
+import numpy as np
+import pytest
+
+from screen_capture import PIXEL_MONO, pack_mono
+from screenshot_index import ScreenshotIndex, ScreenshotIndexWriter, gray_frame, runs
+
+cv2 = pytest.importorskip("cv2")
+
+START = datetime.datetime(2026, 1, 5, 9, 30, 0)
+
+
+def _at(seconds):
+    return START + datetime.timedelta(seconds=seconds)
+
+
+def _screen(seed):
+    """A smooth random screen, so the half-size template scores stay sharp."""
+    noise = np.random.default_rng(seed).integers(0, 256, (120, 200), dtype=np.uint8)
+    return cv2.GaussianBlur(noise, (0, 0), 3)
+
+
+def _with_logo(screen, logo, x, y):
+    screen = screen.copy()
+    screen[y : y + logo.shape[0], x : x + logo.shape[1]] = logo
+    return screen
+
+
+def test_index_round_trip(tmp_path):
+    logo = cv2.normalize(_screen(99)[:32, :48], None, 0, 255, cv2.NORM_MINMAX)
+    logo_path = str(tmp_path / "logo.png")
+    cv2.imwrite(logo_path, logo)
+    desktop, settings = _screen(1), _screen(2)
+    frames = [desktop, _with_logo(desktop, logo, 40, 60), _with_logo(desktop, logo, 40, 60), settings]
+    path = str(tmp_path / "shots.idx")
+    with ScreenshotIndexWriter(path, [logo_path]) as writer:
+        # Encoder threads may add frames out of order.
+        for number in (1, 0, 2, 3):
+            writer.add(frames[number], _at(number))
+
+    index = ScreenshotIndex(path)
+    assert len(index) == 4
+    assert [index.capture_time(number) for number in range(4)] == [_at(n) for n in range(4)]
+    visible = index.visible("logo.png", min_score=0.9)
+    assert runs(visible) == [(1, 2)]
+    column = index.template_column(logo_path)
+    assert abs(int(index.x[1, column]) - 40) <= 2 and abs(int(index.y[1, column]) - 60) <= 2
+    assert index.index_at(_at(2.5)) == 2
+    assert index.distance(1, 2) == 0
+    assert index.first_difference(_at(1)) == 3
+    assert index.first_difference(_at(3)) is None
+    with pytest.raises(KeyError):
+        index.index_at(_at(-1))
+    with pytest.raises(KeyError):
+        index.visible("rotate.png")
+
+
+def test_mono_frames_are_indexed_unpacked(tmp_path):
+    path = str(tmp_path / "mono.idx")
+    width = 195  # Not a multiple of 8: the last byte of each row is padded
+    screens = [_screen(seed)[:, :width] for seed in (3, 3, 4)]
+    with ScreenshotIndexWriter(path, templates=()) as writer:
+        for number, screen in enumerate(screens):
+            gray = gray_frame(pack_mono(screen), PIXEL_MONO, width)
+            assert gray.shape == screen.shape
+            writer.add(gray, _at(number))
+
+    index = ScreenshotIndex(path)
+    assert index.templates == []
+    assert index.distance(0, 1) == 0
+    assert index.first_difference(_at(0)) == 2
+
+
+def test_reopening_drops_a_truncated_record(tmp_path):
+    path = str(tmp_path / "crashed.idx")
+    with ScreenshotIndexWriter(path, templates=()) as writer:
+        writer.add(_screen(5), _at(0))
+        writer.add(_screen(6), _at(1))
+    with open(path, "r+b") as f:  # A crash in the middle of writing the second record
+        f.truncate(os.path.getsize(path) - 5)
+
+    assert len(ScreenshotIndex(path)) == 1
+    with ScreenshotIndexWriter(path, templates=()) as writer:
+        writer.add(_screen(7), _at(2))
+    index = ScreenshotIndex(path)
+    assert [index.capture_time(number) for number in range(len(index))] == [_at(0), _at(2)]
+    assert index.first_difference(_at(0)) == 1
+
+
+def test_reopening_with_other_templates_is_refused(tmp_path):
+    path = str(tmp_path / "shots.idx")
+    ScreenshotIndexWriter(path, templates=()).close()
+    with pytest.raises(ValueError):
+        ScreenshotIndexWriter(path, templates=["rotate.png"])
+    with pytest.raises(RuntimeError):
+        with ScreenshotIndexWriter(path, templates=()):
+            ScreenshotIndexWriter(path, templates=())
@@ -0,0 +1,100 @@
+# Run with: python -m pytest test_template_matcher.py
+import cv2
+import numpy as np
+import pytest
+
+from location_hints import LocationHintCache
+from template_matcher import FramePyramid, PyramidMatcher
+
+LOGO_AT = (230, 140)
+
+
+def _screen(seed, size=(300, 400)):
+    """A smooth random screen: features survive the pyramid's downsampling."""
+    noise = np.random.default_rng(seed).integers(0, 256, size, dtype=np.uint8)
+    return cv2.normalize(cv2.GaussianBlur(noise, (0, 0), 4), None, 0, 255, cv2.NORM_MINMAX)
+
+
+@pytest.fixture
+def logo(tmp_path):
+    image = _screen(7, (40, 60))
+    path = str(tmp_path / "logo.png")
+    cv2.imwrite(path, image)
+    return path, image
+
+
+def _frame_with(image, at=LOGO_AT, origin=(0, 0)):
+    frame = _screen(1)
+    x, y = at
+    frame[y : y + image.shape[0], x : x + image.shape[1]] = image
+    return FramePyramid(frame, origin)
+
+
+def test_locate_finds_the_template_in_screen_coordinates(logo):
+    path, image = logo
+    matcher = PyramidMatcher()
+
+    match = matcher.locate(path, _frame_with(image, origin=(1920, 0)))
+
+    assert (match.left, match.top) == (1920 + LOGO_AT[0], LOGO_AT[1])
+    assert (match.width, match.height) == (60, 40)
+    assert match.score > 0.95
+    assert match.center == (1920 + LOGO_AT[0] + 30, LOGO_AT[1] + 20)
+    assert matcher.locate(path, FramePyramid(_screen(1))) is None
+
+
+def test_scaled_variant_is_found(logo):
+    path, image = logo
+    matcher = PyramidMatcher(scales=(1.0, 1.5), scale_provider=lambda: 1.5)
+    bigger = cv2.resize(image, (90, 60), interpolation=cv2.INTER_LINEAR)
+
+    match = matcher.locate(path, _frame_with(bigger))
+
+    assert match.scale == 1.5
+    assert (match.left, match.top, match.width, match.height) == (*LOGO_AT, 90, 60)
+
+
+def test_hint_region_round_trip(logo):
+    path, image = logo
+    hints = LocationHintCache(path=None)
+    matcher = PyramidMatcher(hints=hints, hint_margin=10)
+    assert matcher.hint_region(path) is None
+
+    frame = _frame_with(image)
+    first = matcher.locate(path, frame)
+    assert hints.get(path, 0, (400, 300))[0] == (*LOGO_AT, 60, 40)
+    region = matcher.hint_region(path)
+    assert region == (LOGO_AT[0] - 10, LOGO_AT[1] - 10, 80, 60)
+
+    # A frame of only the hinted region is searched with the hint.
+    window = frame.crop(region)
+    assert window.shape == (60, 80)
+    assert matcher.locate(path, window, region=region) == first
+    # At another rotation the hint does not apply.
+    assert matcher.hint_region(path, rotation=90) is None
+
+
+def test_missing_the_hinted_region_only_when_asked(logo):
+    path, image = logo
+    hints = LocationHintCache(path=None)
+    matcher = PyramidMatcher(hints=hints)
+    matcher.locate(path, _frame_with(image))
+
+    moved = _frame_with(image, at=(20, 30))
+    # Checking that the image went away searches only the hinted region.
+    assert matcher.locate(path, moved, full_search=False) is None
+    match = matcher.locate(path, moved)
+    assert (match.left, match.top) == (20, 30)
+    assert hints.get(path, 0, (400, 300))[0] == (20, 30, 60, 40)
+
+
+def test_binarized_templates_match_thresholded_frames(logo):
+    path, image = logo
+    matcher = PyramidMatcher(template_threshold=128)
+    frame = _frame_with(image).levels[0]
+    _, mono = cv2.threshold(frame, 127, 255, cv2.THRESH_BINARY)
+
+    match = matcher.locate(path, FramePyramid(mono))
+
+    assert (match.left, match.top) == LOGO_AT
+    assert match.score > 0.95
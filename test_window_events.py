@@ -0,0 +1,68 @@
+# Run with: python -m pytest test_window_events.py
+import asyncio
+
+from window_events import FocusWatcher, ScriptedFocusBackend
+
+
+class CountingFocusBackend(ScriptedFocusBackend):
+    starts = 0
+
+    def start(self, on_title):
+        self.starts += 1
+        super().start(on_title)
+
+
+def test_waiters_with_different_substrings_share_one_subscription():
+    backend = CountingFocusBackend("Program Manager")
+
+    async def run():
+        async with FocusWatcher(backend) as watcher:
+            settings = asyncio.ensure_future(watcher.wait_for_title("Settings", timeout=5))
+            eink = asyncio.ensure_future(watcher.wait_for_title("EinkPlus", timeout=5))
+            await asyncio.sleep(0)  # Let both waiters register
+            assert len(watcher._waiters) == 2
+            backend.play([(0.01, "ThinkbookEinkPlus"), (0.01, "Settings - Ease of Access")])
+            return await settings, await eink, watcher._waiters
+
+    settings_title, eink_title, waiters_left = asyncio.run(run())
+    assert settings_title == "Settings - Ease of Access"
+    assert eink_title == "ThinkbookEinkPlus"
+    assert waiters_left == []
+    assert backend.starts == 1
+
+
+def test_wait_times_out_and_forgets_the_waiter():
+    backend = ScriptedFocusBackend("Program Manager")
+
+    async def run():
+        async with FocusWatcher(backend) as watcher:
+            backend.play([(0.01, "Start")])
+            title = await watcher.wait_for_title("Settings", timeout=0.1)
+            return title, watcher._waiters, watcher.current_title
+
+    title, waiters_left, current_title = asyncio.run(run())
+    assert title is None
+    assert waiters_left == []
+    assert current_title == "Start"  # Non-matching titles were still delivered
+
+
+def test_title_matching_at_subscribe_returns_at_once():
+    backend = ScriptedFocusBackend("Settings - Home")
+
+    async def run():
+        async with FocusWatcher(backend) as watcher:
+            # A zero timeout would expire if the wait had to await a change.
+            return await watcher.wait_for_title("Settings", timeout=0)
+
+    assert asyncio.run(run()) == "Settings - Home"
+
+
+def test_no_active_window_does_not_wake_waiters():
+    backend = ScriptedFocusBackend("Program Manager")
+
+    async def run():
+        async with FocusWatcher(backend) as watcher:
+            backend.play([(0.01, None), (0.01, "Settings")])
+            return await watcher.wait_for_title("Settings", timeout=5)
+
+    assert asyncio.run(run()) == "Settings"
@@ -0,0 +1,40 @@
+# Run with: python -m pytest test_workflow.py
+import pytest
+
+from location_hints import LocationHintCache
+from simulate_tablet_mode import build_scenario
+
+tablet_mode = pytest.importorskip("tablet_mode")  # Needs OpenCV
+
+
+def _run(simulated, hints):
+    failures = []
+    tablet_mode.use_desktop(simulated, hints=hints)
+    results = tablet_mode.run_workflow(tablet_mode.TABLET_MODE_WORKFLOW, on_failure=failures.append)
+    simulated.sleep(5)  # Let the transitions started by the last steps play out
+    return results, failures
+
+
+@pytest.mark.parametrize("start_rotated", [False, True])
+def test_simulated_workflow_completes(start_rotated):
+    simulated = build_scenario(start_rotated=start_rotated)
+    results, failures = _run(simulated, LocationHintCache(path=None))
+
+    assert failures == []
+    assert [result.status for result in results if result.status == "failed"] == []
+    assert len(results) == len(tablet_mode.TABLET_MODE_WORKFLOW.steps)
+    assert simulated.state.name == "done"
+    rotate = next(result for result in results if result.name.startswith("rotate-to:"))
+    assert rotate.status == ("skipped" if start_rotated else "ok")
+
+
+def test_second_run_uses_the_hints_of_the_first():
+    hints = LocationHintCache(path=None)
+    first = build_scenario()
+    _run(first, hints)
+    second = build_scenario()
+    results, failures = _run(second, hints)
+
+    assert failures == []
+    assert second.state.name == "done"
+    assert sum(result.elapsed_seconds for result in results) <= first.clock()
@@ -0,0 +1,206 @@
+# Lightweight span tracing for tablet_mode.py.
+# Records nested, timed spans (capture, match, input, sleep, window waits,
+# workflow steps) with attributes such as template, attempt, score and
+# rotation, then exports them as Chrome trace-event JSON (load it in
+# chrome://tracing or https://ui.perfetto.dev) and as a summary table.
+#
+# Tracing is off by default. While disabled, span() returns one shared no-op
+# object and traced() functions call straight through, so instrumented code
+# costs one attribute check per span.
+import functools
+import inspect
+import json
+import math
+import os
+import threading
+import time
+
+
+class _NullSpan:
+    """Stand-in returned while tracing is disabled. It is falsy, so callers
+    can skip computing expensive attributes with `if span:`."""
+
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        return False
+
+    def __bool__(self):
+        return False
+
+    def set(self, **attrs):
+        pass
+
+
+_NULL_SPAN = _NullSpan()
+
+
+class Span:
+    """One timed operation; use as a context manager, add attributes with set()."""
+
+    __slots__ = ("tracer", "name", "category", "attrs", "start", "end", "thread_id")
+
+    def __init__(self, tracer, name, category, attrs):
+        self.tracer = tracer
+        self.name = name
+        self.category = category
+        self.attrs = attrs
+        self.start = None
+        self.end = None
+        self.thread_id = threading.get_ident()
+
+    def __enter__(self):
+        self.start = self.tracer.clock()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.end = self.tracer.clock()
+        if exc_type is not None:
+            self.attrs["error"] = exc_type.__name__
+        self.tracer._finish(self)
+        return False
+
+    def __bool__(self):
+        return True
+
+    def set(self, **attrs):
+        self.attrs.update(attrs)
+
+    @property
+    def duration(self):
+        return self.end - self.start
+
+
+class Tracer:
+    """
+    Collects spans while enabled.
+
+    Args:
+        clock (callable): Monotonic time in seconds. tablet_mode points this at
+            the desktop's clock, so simulated runs trace virtual time.
+    """
+
+    def __init__(self, clock=time.perf_counter):
+        self.clock = clock
+        self.enabled = False
+        self.spans = []
+        self._lock = threading.Lock()
+
+    def enable(self):
+        self.enabled = True
+
+    def disable(self):
+        self.enabled = False
+
+    def reset(self):
+        with self._lock:
+            self.spans = []
+
+    def span(self, category, label=None, **attrs):
+        """
+        Returns a span context manager named "category:label" (or just category).
+
+        Spans opened inside another span on the same thread nest under it in
+        the trace viewer.
+        """
+        if not self.enabled:
+            return _NULL_SPAN
+        name = f"{category}:{label}" if label is not None else category
+        return Span(self, name, category, attrs)
+
+    def _finish(self, span):
+        with self._lock:
+            self.spans.append(span)
+
+    # --- Export ---
+
+    def chrome_trace(self):
+        """Returns the recorded spans as a Chrome trace-event JSON object."""
+        with self._lock:
+            spans = list(self.spans)
+        origin = min((span.start for span in spans), default=0.0)
+        thread_ids = {}
+        events = []
+        for span in sorted(spans, key=lambda span: span.start):
+            tid = thread_ids.setdefault(span.thread_id, len(thread_ids))
+            events.append(
+                {
+                    "name": span.name,
+                    "cat": span.category,
+                    "ph": "X",  # Complete event: start and duration
+                    "ts": round((span.start - origin) * 1e6, 1),
+                    "dur": round(span.duration * 1e6, 1),
+                    "pid": os.getpid(),
+                    "tid": tid,
+                    "args": {key: _json_value(value) for key, value in span.attrs.items()},
+                }
+            )
+        return {"traceEvents": events, "displayTimeUnit": "ms"}
+
+    def write_chrome_trace(self, path):
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump(self.chrome_trace(), f)
+
+    def summary_table(self):
+        """
+        Returns a text table of count, total, mean and max time per span name,
+        longest total first. Totals include the time of nested spans.
+        """
+        with self._lock:
+            spans = list(self.spans)
+        totals = {}
+        for span in spans:
+            entry = totals.setdefault(span.name, [0, 0.0, 0.0])
+            entry[0] += 1
+            entry[1] += span.duration
+            entry[2] = max(entry[2], span.duration)
+        width = max((len(name) for name in totals), default=4)
+        lines = [f"  {'span':<{width}}  {'count':>6}  {'total':>9}  {'mean':>9}  {'max':>9}"]
+        for name, (count, total, longest) in sorted(totals.items(), key=lambda item: -item[1][1]):
+            lines.append(
+                f"  {name:<{width}}  {count:>6}  {total:9.3f}s  {total / count * 1000:7.1f}ms  {longest * 1000:7.1f}ms"
+            )
+        return "\n".join(lines)
+
+
+def _json_value(value):
+    if isinstance(value, float) and not math.isfinite(value):
+        return str(value)  # e.g. max_retries=inf; JSON has no Infinity
+    if isinstance(value, (str, int, float, bool)) or value is None:
+        return value
+    return str(value)
+
+
+tracer = Tracer()
+
+
+def traced(category, label_arg=None, attr_args=()):
+    """
+    Decorator wrapping each call in a span.
+
+    Args:
+        category (str): Span category.
+        label_arg (str): Parameter whose value becomes the span label.
+        attr_args (tuple of str): Parameters recorded as span attributes.
+    """
+
+    def decorate(func):
+        signature = inspect.signature(func)
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            if not tracer.enabled:
+                return func(*args, **kwargs)
+            bound = signature.bind(*args, **kwargs)
+            bound.apply_defaults()
+            values = bound.arguments
+            label = values.get(label_arg) if label_arg else None
+            with tracer.span(category, label, **{name: values[name] for name in attr_args}):
+                return func(*args, **kwargs)
+
+        return wrapper
+
+    return decorate
@@ -0,0 +1,412 @@
+# Foreground-window change notifications for tablet_mode.py.
+# wait_for_window_title used to poll gw.getActiveWindow() once a second; here
+# a backend pushes every foreground title change to a FocusWatcher, which
+# wakes the asyncio waiters whose substring matches as soon as it happens.
+# DisplayChangeWatcher reports monitor layout changes (WM_DISPLAYCHANGE) the
+# same way, so cached monitor rectangles can be refreshed.
+import asyncio
+import sys
+import threading
+
+
+class FocusBackend:
+    """
+    Interface for a source of foreground window title changes.
+
+    start() begins delivering titles by calling on_title(title) from any
+    thread (title is None when no window is active); stop() ends delivery.
+    """
+
+    def current_title(self):
+        raise NotImplementedError
+
+    def start(self, on_title):
+        raise NotImplementedError
+
+    def stop(self):
+        raise NotImplementedError
+
+
+class ScriptedFocusBackend(FocusBackend):
+    """
+    In-memory backend for exercising the waiting logic without Windows.
+
+    Titles are pushed with set_title(), or scheduled with play() as a list of
+    (delay_seconds, title) steps replayed on a background thread.
+    """
+
+    def __init__(self, title=None):
+        self._title = title
+        self._on_title = None
+        self._stop_event = threading.Event()
+        self._player = None
+
+    def current_title(self):
+        return self._title
+
+    def start(self, on_title):
+        self._on_title = on_title
+        self._stop_event.clear()
+
+    def stop(self):
+        self._on_title = None
+        self._stop_event.set()
+        if self._player is not None:
+            self._player.join()
+            self._player = None
+
+    def set_title(self, title):
+        self._title = title
+        if self._on_title is not None:
+            self._on_title(title)
+
+    def play(self, script):
+        def run():
+            for delay, title in script:
+                if self._stop_event.wait(delay):
+                    return
+                self.set_title(title)
+
+        self._player = threading.Thread(target=run, name="scripted-focus", daemon=True)
+        self._player.start()
+
+
+class PollingFocusBackend(FocusBackend):
+    """
+    Fallback backend that polls a title getter on a background thread.
+
+    Args:
+        get_title (callable): Returns the active window title, or None.
+        interval_seconds (float): How often to poll.
+    """
+
+    def __init__(self, get_title, interval_seconds=1):
+        self.get_title = get_title
+        self.interval_seconds = interval_seconds
+        self._stop_event = threading.Event()
+        self._thread = None
+
+    def current_title(self):
+        return self.get_title()
+
+    def start(self, on_title):
+        self._stop_event.clear()
+        last_title = self.get_title()
+
+        def run():
+            nonlocal last_title
+            while not self._stop_event.wait(self.interval_seconds):
+                title = self.get_title()
+                if title != last_title:
+                    last_title = title
+                    on_title(title)
+
+        self._thread = threading.Thread(target=run, name="focus-poller", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop_event.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+
+class WinEventFocusBackend(FocusBackend):
+    """
+    Windows backend using SetWinEventHook, so no polling is involved.
+
+    Listens for EVENT_SYSTEM_FOREGROUND (another window became active) and
+    EVENT_OBJECT_NAMECHANGE on the foreground window (e.g. Settings updating
+    its title after navigation). The hook needs a message loop, which runs
+    on a dedicated thread.
+    """
+
+    EVENT_SYSTEM_FOREGROUND = 0x0003
+    EVENT_OBJECT_NAMECHANGE = 0x800C
+    WINEVENT_OUTOFCONTEXT = 0x0000
+    OBJID_WINDOW = 0
+    WM_QUIT = 0x0012
+
+    def __init__(self):
+        import ctypes
+        from ctypes import wintypes
+
+        self._ctypes = ctypes
+        self._wintypes = wintypes
+        self._user32 = ctypes.windll.user32
+        self._kernel32 = ctypes.windll.kernel32
+        self._user32.SetWinEventHook.restype = wintypes.HANDLE
+        self._proc_type = ctypes.WINFUNCTYPE(
+            None,
+            wintypes.HANDLE,
+            wintypes.DWORD,
+            wintypes.HWND,
+            wintypes.LONG,
+            wintypes.LONG,
+            wintypes.DWORD,
+            wintypes.DWORD,
+        )
+        self._thread = None
+        self._thread_id = None
+        self._ready = threading.Event()
+
+    def current_title(self):
+        hwnd = self._user32.GetForegroundWindow()
+        if not hwnd:
+            return None
+        length = self._user32.GetWindowTextLengthW(hwnd)
+        buffer = self._ctypes.create_unicode_buffer(length + 1)
+        self._user32.GetWindowTextW(hwnd, buffer, length + 1)
+        return buffer.value
+
+    def start(self, on_title):
+        self._ready.clear()
+        self._thread = threading.Thread(
+            target=self._run, args=(on_title,), name="winevent-focus", daemon=True
+        )
+        self._thread.start()
+        self._ready.wait()
+
+    def stop(self):
+        if self._thread is None:
+            return
+        self._user32.PostThreadMessageW(self._thread_id, self.WM_QUIT, 0, 0)
+        self._thread.join()
+        self._thread = None
+
+    def _run(self, on_title):
+        user32 = self._user32
+        last_title = self.current_title()
+
+        def callback(hook, event, hwnd, id_object, id_child, thread, event_time):
+            nonlocal last_title
+            if id_object != self.OBJID_WINDOW:
+                return
+            if (
+                event == self.EVENT_OBJECT_NAMECHANGE
+                and hwnd != user32.GetForegroundWindow()
+            ):
+                return
+            title = self.current_title()
+            if title != last_title:
+                last_title = title
+                on_title(title)
+
+        # Keep a reference to the ctypes callback for as long as the hooks live.
+        proc = self._proc_type(callback)
+        hooks = [
+            user32.SetWinEventHook(event, event, 0, proc, 0, 0, self.WINEVENT_OUTOFCONTEXT)
+            for event in (self.EVENT_SYSTEM_FOREGROUND, self.EVENT_OBJECT_NAMECHANGE)
+        ]
+        self._thread_id = self._kernel32.GetCurrentThreadId()
+        self._ready.set()
+
+        msg = self._wintypes.MSG()
+        while user32.GetMessageW(self._ctypes.byref(msg), 0, 0, 0) > 0:
+            user32.TranslateMessage(self._ctypes.byref(msg))
+            user32.DispatchMessageW(self._ctypes.byref(msg))
+
+        for hook in hooks:
+            if hook:
+                user32.UnhookWinEvent(hook)
+
+
+def default_focus_backend(get_title, interval_seconds=1):
+    """Returns the WinEvent backend on Windows, or a polling backend elsewhere."""
+    if sys.platform == "win32":
+        try:
+            return WinEventFocusBackend()
+        except (AttributeError, OSError) as e:
+            print(
+                f"WARNING: WinEvent hooks unavailable ({e}); polling for window changes.",
+                file=sys.stderr,
+            )
+    return PollingFocusBackend(get_title, interval_seconds)
+
+
+class FocusWatcher:
+    """
+    Shares one backend subscription between any number of async waiters.
+
+    Use as an async context manager; the backend is started on entry and
+    stopped on exit. Titles delivered from the backend's thread are handed
+    to the event loop, and every waiter whose substring is contained in the
+    new title is woken.
+    """
+
+    def __init__(self, backend):
+        self.backend = backend
+        self.current_title = None
+        self._loop = None
+        self._waiters = []  # (substring, future) pairs
+
+    async def __aenter__(self):
+        self._loop = asyncio.get_running_loop()
+        # Subscribe before reading the title, so a change in between is not lost;
+        # one already reported is simply re-read here.
+        self.backend.start(self._on_title_threadsafe)
+        self.current_title = self.backend.current_title()
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        self.backend.stop()
+        for _, future in self._waiters:
+            future.cancel()
+        self._waiters.clear()
+
+    async def wait_for_title(self, substring, timeout=None):
+        """
+        Waits until the active window title contains substring.
+
+        Args:
+            substring (str): Text the active window's title must contain.
+            timeout (float): Seconds to wait; None waits forever.
+
+        Returns:
+            str: The full matching title.
+            None: If the timeout elapsed first.
+        """
+        if isinstance(self.current_title, str) and substring in self.current_title:
+            return self.current_title
+        future = self._loop.create_future()
+        waiter = (substring, future)
+        self._waiters.append(waiter)
+        try:
+            return await asyncio.wait_for(future, timeout)
+        except asyncio.TimeoutError:
+            return None
+        finally:
+            if waiter in self._waiters:
+                self._waiters.remove(waiter)
+
+    def _on_title_threadsafe(self, title):
+        self._loop.call_soon_threadsafe(self._on_title, title)
+
+    def _on_title(self, title):
+        self.current_title = title
+        if not isinstance(title, str):
+            return
+        for substring, future in list(self._waiters):
+            if substring in title and not future.done():
+                future.set_result(title)
+
+
+class DisplayChangeWatcher:
+    """
+    Calls on_change() on a background thread whenever the display layout
+    changes (a monitor is attached, detached, resized or rotated).
+
+    WM_DISPLAYCHANGE is only broadcast to top-level windows, so a hidden
+    window with its own message loop receives it.
+
+    Args:
+        on_change (callable): Called without arguments, e.g. MonitorLayout.invalidate.
+    """
+
+    WM_DISPLAYCHANGE = 0x007E
+    WM_QUIT = 0x0012
+
+    def __init__(self, on_change):
+        import ctypes
+        from ctypes import wintypes
+
+        self.on_change = on_change
+        self._ctypes = ctypes
+        self._wintypes = wintypes
+        self._user32 = ctypes.windll.user32
+        self._kernel32 = ctypes.windll.kernel32
+        lresult = ctypes.c_ssize_t
+        self._proc_type = ctypes.WINFUNCTYPE(
+            lresult, wintypes.HWND, wintypes.UINT, wintypes.WPARAM, wintypes.LPARAM
+        )
+
+        class WNDCLASSW(ctypes.Structure):
+            _fields_ = [
+                ("style", wintypes.UINT),
+                ("lpfnWndProc", self._proc_type),
+                ("cbClsExtra", ctypes.c_int),
+                ("cbWndExtra", ctypes.c_int),
+                ("hInstance", wintypes.HINSTANCE),
+                ("hIcon", wintypes.HICON),
+                ("hCursor", wintypes.HANDLE),
+                ("hbrBackground", wintypes.HBRUSH),
+                ("lpszMenuName", wintypes.LPCWSTR),
+                ("lpszClassName", wintypes.LPCWSTR),
+            ]
+
+        self._WNDCLASSW = WNDCLASSW
+        self._user32.DefWindowProcW.restype = lresult
+        self._user32.DefWindowProcW.argtypes = [
+            wintypes.HWND,
+            wintypes.UINT,
+            wintypes.WPARAM,
+            wintypes.LPARAM,
+        ]
+        # Handles are pointer-sized; without argtypes ctypes passes them as 32-bit ints.
+        self._user32.CreateWindowExW.restype = wintypes.HWND
+        self._user32.CreateWindowExW.argtypes = [
+            wintypes.DWORD,
+            wintypes.LPCWSTR,
+            wintypes.LPCWSTR,
+            wintypes.DWORD,
+            ctypes.c_int,
+            ctypes.c_int,
+            ctypes.c_int,
+            ctypes.c_int,
+            wintypes.HWND,
+            wintypes.HMENU,
+            wintypes.HINSTANCE,
+            wintypes.LPVOID,
+        ]
+        self._user32.DestroyWindow.argtypes = [wintypes.HWND]
+        self._user32.UnregisterClassW.argtypes = [wintypes.LPCWSTR, wintypes.HINSTANCE]
+        self._kernel32.GetModuleHandleW.restype = wintypes.HMODULE
+        self._thread = None
+        self._thread_id = None
+        self._ready = threading.Event()
+
+    def start(self):
+        self._ready.clear()
+        self._thread = threading.Thread(target=self._run, name="display-change", daemon=True)
+        self._thread.start()
+        self._ready.wait()
+
+    def stop(self):
+        if self._thread is None:
+            return
+        self._user32.PostThreadMessageW(self._thread_id, self.WM_QUIT, 0, 0)
+        self._thread.join()
+        self._thread = None
+
+    def _run(self):
+        user32 = self._user32
+
+        def window_proc(hwnd, message, wparam, lparam):
+            if message == self.WM_DISPLAYCHANGE:
+                self.on_change()
+            return user32.DefWindowProcW(hwnd, message, wparam, lparam)
+
+        # Keep a reference to the ctypes callback for as long as the window lives.
+        proc = self._proc_type(window_proc)
+        instance = self._kernel32.GetModuleHandleW(None)
+        window_class = self._WNDCLASSW()
+        window_class.lpfnWndProc = proc
+        window_class.hInstance = instance
+        window_class.lpszClassName = f"TabletModeDisplayWatcher{id(self)}"
+        atom = user32.RegisterClassW(self._ctypes.byref(window_class))
+        hwnd = user32.CreateWindowExW(
+            0, window_class.lpszClassName, None, 0, 0, 0, 0, 0, None, None, instance, None
+        )
+        self._thread_id = self._kernel32.GetCurrentThreadId()
+        self._ready.set()
+        if not atom or not hwnd:
+            print("WARNING: Could not create the display change window.", file=sys.stderr)
+            return
+
+        msg = self._wintypes.MSG()
+        while user32.GetMessageW(self._ctypes.byref(msg), 0, 0, 0) > 0:
+            user32.TranslateMessage(self._ctypes.byref(msg))
+            user32.DispatchMessageW(self._ctypes.byref(msg))
+
+        user32.DestroyWindow(hwnd)
+        user32.UnregisterClassW(window_class.lpszClassName, instance)
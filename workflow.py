@@ -0,0 +1,335 @@
+# Declarative step engine for tablet_mode.py.
+# The tablet-mode flow used to be a list of top-level statements separated by
+# fixed time.sleep() calls that only existed to let the UI settle. Here each
+# step finishes as soon as its postcondition is observed (a window is active,
+# an image was clicked, the rotation changed, the screen stopped updating),
+# with a timeout, and the time every step spent waiting is recorded.
+# Independent checks can run side by side in a Concurrent step.
+import concurrent.futures
+import logging
+import time
+
+from tracing import tracer
+
+
+class StepFailed(Exception):
+    """Raised by a step whose postcondition was not observed in time."""
+
+
+class StepResult:
+    """Outcome and timing of one executed step."""
+
+    def __init__(self, name, status, elapsed_seconds, detail=None):
+        self.name = name
+        self.status = status  # "ok", "skipped" or "failed"
+        self.elapsed_seconds = elapsed_seconds
+        self.detail = detail
+
+
+class WorkflowContext:
+    """
+    The operations steps are allowed to perform, supplied by the caller.
+
+    Keeping them here (instead of steps importing pyautogui and friends)
+    lets the same workflow definition drive the real desktop or a stand-in.
+
+    Args:
+        wait_for_window_title (callable): (substring, max_wait_seconds, interval_seconds) -> title or None.
+        find_and_interact (callable): (image, action_type, max_retries, wait_to_disappear) -> location or None.
+        get_screen_rotation (callable): () -> rotation in degrees.
+        press_keys (callable): (key_or_keys, pause_seconds) -> None; a tuple is a hotkey.
+        launch_uri (callable): (uri) -> None.
+        wait_for_stable_screen (callable): (quiet_seconds, timeout_seconds, min_seconds) -> bool.
+        wait_for_templates (callable): (images, timeout_seconds) -> list of the
+            visible images, empty if none appeared in time (None waits forever).
+        on_failure (callable): (description) -> None, called when a step fails.
+        clock (callable): Monotonic clock in seconds.
+        sleep (callable): Sleeps for a number of seconds.
+        cancel (callable): () -> None; makes the waits in progress fail with
+            StepFailed. Called by Concurrent once one of its steps failed, so
+            the others stop waiting. None leaves them to finish on their own.
+
+    A context belongs to one run: sub_results collects, by step name, the
+    StepResults of the sub-steps run by RotateIfNeeded and Concurrent.
+    """
+
+    def __init__(
+        self,
+        wait_for_window_title,
+        find_and_interact,
+        get_screen_rotation,
+        press_keys,
+        launch_uri,
+        wait_for_stable_screen,
+        wait_for_templates,
+        on_failure,
+        clock=time.perf_counter,
+        sleep=time.sleep,
+        cancel=None,
+    ):
+        self.wait_for_window_title = wait_for_window_title
+        self.find_and_interact = find_and_interact
+        self.get_screen_rotation = get_screen_rotation
+        self.press_keys = press_keys
+        self.launch_uri = launch_uri
+        self.wait_for_stable_screen = wait_for_stable_screen
+        self.wait_for_templates = wait_for_templates
+        self.on_failure = on_failure
+        self.clock = clock
+        self.sleep = sleep
+        self.cancel = cancel
+        self.sub_results = {}
+
+
+class Step:
+    """Base class: run() performs the step and returns once its postcondition holds."""
+
+    name = "step"
+
+    def run(self, ctx):
+        raise NotImplementedError
+
+    def execute(self, ctx):
+        """Runs the step and returns a StepResult; StepFailed is turned into a failed result."""
+        start_time = ctx.clock()
+        try:
+            with tracer.span("step", self.name):
+                detail = self.run(ctx)
+            status = "skipped" if detail == "skipped" else "ok"
+        except StepFailed as e:
+            detail = str(e)
+            status = "failed"
+        return StepResult(self.name, status, ctx.clock() - start_time, detail)
+
+
+class WaitForWindow(Step):
+    """Completes when the active window's title contains title_substring."""
+
+    def __init__(self, title_substring, timeout_seconds=30, interval_seconds=1):
+        self.name = f"wait-window:{title_substring}"
+        self.title_substring = title_substring
+        self.timeout_seconds = timeout_seconds
+        self.interval_seconds = interval_seconds
+
+    def run(self, ctx):
+        title = ctx.wait_for_window_title(
+            self.title_substring, self.timeout_seconds, self.interval_seconds
+        )
+        if title is None:
+            raise StepFailed(
+                f"Window '{self.title_substring}' not active within {self.timeout_seconds}s"
+            )
+        return title
+
+
+class LocateAndClick(Step):
+    """Completes when the image was found and clicked (and, optionally, went away)."""
+
+    def __init__(self, image_path, action_type="click", max_retries=3, wait_to_disappear=False):
+        self.name = f"{action_type}:{image_path}"
+        self.image_path = image_path
+        self.action_type = action_type
+        self.max_retries = max_retries
+        self.wait_to_disappear = wait_to_disappear
+
+    def run(self, ctx):
+        location = ctx.find_and_interact(
+            self.image_path, self.action_type, self.max_retries, self.wait_to_disappear
+        )
+        if location is None:
+            raise StepFailed(f"{self.image_path} not found")
+        return location
+
+
+class RotateIfNeeded(Step):
+    """
+    Runs `steps` only if the screen rotation differs from target_rotation,
+    then completes as soon as the new rotation is observed.
+
+    The sub-steps are executed like workflow steps, so each one is traced and
+    timed; their StepResults are kept in ctx.sub_results[name].
+    """
+
+    def __init__(self, target_rotation, steps, timeout_seconds=10, poll_seconds=0.1):
+        self.name = f"rotate-to:{target_rotation}"
+        self.target_rotation = target_rotation
+        self.steps = steps
+        self.timeout_seconds = timeout_seconds
+        self.poll_seconds = poll_seconds
+
+    def run(self, ctx):
+        sub_results = ctx.sub_results[self.name] = []
+        rotation = ctx.get_screen_rotation()
+        if rotation == self.target_rotation:
+            return "skipped"
+        logging.info(
+            f"Screen rotation is {rotation}, not {self.target_rotation} degrees. Attempting to rotate..."
+        )
+        for step in self.steps:
+            result = step.execute(ctx)
+            sub_results.append(result)
+            logging.info(
+                f"  Sub-step '{result.name}' {result.status} in {result.elapsed_seconds:.2f}s"
+            )
+            if result.status == "failed":
+                raise StepFailed(f"{result.name}: {result.detail}")
+
+        deadline = ctx.clock() + self.timeout_seconds
+        while ctx.get_screen_rotation() != self.target_rotation:
+            if ctx.clock() >= deadline:
+                raise StepFailed(
+                    f"Rotation did not reach {self.target_rotation} within {self.timeout_seconds}s"
+                )
+            ctx.sleep(self.poll_seconds)
+        return self.target_rotation
+
+
+class KeySequence(Step):
+    """Presses keys in order; a tuple entry is pressed as a hotkey combination."""
+
+    def __init__(self, keys, pause_seconds=0.1, name=None):
+        self.name = name or "keys:" + ",".join(
+            "+".join(key) if isinstance(key, tuple) else key for key in keys
+        )
+        self.keys = keys
+        self.pause_seconds = pause_seconds
+
+    def run(self, ctx):
+        for key in self.keys:
+            ctx.press_keys(key, self.pause_seconds)
+
+
+class LaunchUri(Step):
+    """Opens a URI (e.g. an ms-settings: page) through the shell."""
+
+    def __init__(self, uri):
+        self.name = f"launch:{uri}"
+        self.uri = uri
+
+    def run(self, ctx):
+        ctx.launch_uri(self.uri)
+
+
+class WaitForStableScreen(Step):
+    """
+    Completes once the screen has not changed for quiet_seconds.
+
+    Replaces "sleep long enough for the page to render" waits. The step
+    never completes before min_seconds, so a pause in the middle of a slow
+    (e-ink) redraw cannot pass for the end of it earlier than the old fixed
+    sleep would have. Reaching the timeout is not an error unless required
+    is True.
+    """
+
+    def __init__(self, quiet_seconds=0.5, timeout_seconds=4, min_seconds=0, required=False):
+        self.name = f"stable-screen:{quiet_seconds}s"
+        self.quiet_seconds = quiet_seconds
+        self.timeout_seconds = timeout_seconds
+        self.min_seconds = min_seconds
+        self.required = required
+
+    def run(self, ctx):
+        stable = ctx.wait_for_stable_screen(
+            self.quiet_seconds, self.timeout_seconds, self.min_seconds
+        )
+        if not stable and self.required:
+            raise StepFailed(f"Screen still changing after {self.timeout_seconds}s")
+        return "stable" if stable else "timeout"
+
+
+class WaitForTemplates(Step):
+    """
+    Completes once any of several images is visible, and returns the visible
+    ones so later steps can branch on them. All images are checked on the
+    same capture, so a poll costs one screenshot however many there are.
+    A timeout_seconds of None waits until one appears.
+    """
+
+    def __init__(self, image_paths, timeout_seconds=10, name=None):
+        self.name = name or "wait-images:" + "|".join(image_paths)
+        self.image_paths = list(image_paths)
+        self.timeout_seconds = timeout_seconds
+
+    def run(self, ctx):
+        visible = ctx.wait_for_templates(self.image_paths, self.timeout_seconds)
+        if not visible:
+            raise StepFailed(
+                f"None of {', '.join(self.image_paths)} visible within {self.timeout_seconds}s"
+            )
+        return visible
+
+
+class Concurrent(Step):
+    """
+    Runs independent steps at the same time; completes when all of them have.
+
+    Each step is executed on its own thread like a workflow step, so it is
+    traced and timed; the StepResults are kept in ctx.sub_results[name].
+    As soon as one step fails, ctx.cancel() stops the others, and the
+    Concurrent step fails. The context's operations must therefore be safe
+    to call from several threads at once.
+    """
+
+    def __init__(self, steps, name=None):
+        self.name = name or "concurrent:" + "|".join(step.name for step in steps)
+        self.steps = steps
+
+    def run(self, ctx):
+        with concurrent.futures.ThreadPoolExecutor(
+            max_workers=len(self.steps), thread_name_prefix="step"
+        ) as pool:
+            futures = [pool.submit(step.execute, ctx) for step in self.steps]
+            for future in concurrent.futures.as_completed(futures):
+                if future.result().status == "failed" and ctx.cancel is not None:
+                    ctx.cancel()
+        sub_results = ctx.sub_results[self.name] = [future.result() for future in futures]
+        for result in sub_results:
+            logging.info(
+                f"  Concurrent step '{result.name}' {result.status} in {result.elapsed_seconds:.2f}s"
+            )
+        failed = [result for result in sub_results if result.status == "failed"]
+        if failed:
+            raise StepFailed("; ".join(f"{result.name}: {result.detail}" for result in failed))
+        return [result.detail for result in sub_results]
+
+
+class Workflow:
+    """
+    An ordered list of steps, run until one fails.
+
+    run() returns the StepResults and logs a per-step timing table. On the
+    first failure ctx.on_failure() is called and the remaining steps are
+    not run.
+    """
+
+    def __init__(self, name, steps):
+        self.name = name
+        self.steps = steps
+
+    def run(self, ctx):
+        logging.info(f"Running workflow '{self.name}' ({len(self.steps)} steps)...")
+        results = []
+        for step in self.steps:
+            result = step.execute(ctx)
+            results.append(result)
+            logging.info(
+                f"Step '{result.name}' {result.status} in {result.elapsed_seconds:.2f}s"
+            )
+            if result.status == "failed":
+                logging.error(f"Workflow '{self.name}' failed at '{result.name}': {result.detail}")
+                log_step_timings(self.name, results)
+                ctx.on_failure(f"{self.name}: {result.name}")
+                return results
+        log_step_timings(self.name, results)
+        return results
+
+
+def log_step_timings(workflow_name, results):
+    """Logs a table of how long each step took."""
+    width = max((len(result.name) for result in results), default=4)
+    lines = [f"Step timings for '{workflow_name}':"]
+    for result in results:
+        lines.append(f"  {result.name:<{width}}  {result.status:<7}  {result.elapsed_seconds:7.2f}s")
+    total = sum(result.elapsed_seconds for result in results)
+    lines.append(f"  {'total':<{width}}  {'':<7}  {total:7.2f}s")
+    logging.info("\n".join(lines))